@@ -0,0 +1,7 @@
+# accounts 相关配置的默认值，都可以在 settings 里用同名的配置覆盖
+
+# user 对象缓存(UserService.get_by_id / get_by_ids)用 settings.CACHES 里的哪个 cache
+USER_CACHE_ALIAS = 'default'
+USER_CACHE_TIMEOUT = 3600
+# 缓存的是 pickle 之后的 User 对象，User 的字段有变化的时候把版本号加一，旧的缓存就都不会被读到了
+USER_CACHE_VERSION = 1
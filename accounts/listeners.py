@@ -0,0 +1,4 @@
+def invalidate_user_cache(sender, instance, **kwargs):
+    # import 写在里面避免循环依赖
+    from accounts.services import UserService
+    UserService.invalidate_cache([instance.id])
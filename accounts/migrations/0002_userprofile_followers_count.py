@@ -0,0 +1,57 @@
+# Generated by Django 3.1.3 on 2026-10-18 10:40
+
+from django.db import migrations, models
+from django.db.models import Count
+
+BATCH_SIZE = 1000
+
+
+def backfill_followers_count(apps, schema_editor):
+    Friendship = apps.get_model('friendships', 'Friendship')
+    UserProfile = apps.get_model('accounts', 'UserProfile')
+
+    counts = Friendship.objects.filter(
+        to_user_id__isnull=False,
+    ).values('to_user_id').annotate(
+        followers_count=Count('id'),
+    ).order_by('to_user_id')
+
+    batch = {}
+    for row in counts.iterator():
+        batch[row['to_user_id']] = row['followers_count']
+        if len(batch) >= BATCH_SIZE:
+            _write_batch(UserProfile, batch)
+            batch = {}
+    if batch:
+        _write_batch(UserProfile, batch)
+
+
+def _write_batch(UserProfile, counts):
+    profiles = list(UserProfile.objects.filter(user_id__in=counts.keys()))
+    for profile in profiles:
+        profile.followers_count = counts[profile.user_id]
+    UserProfile.objects.bulk_update(profiles, ['followers_count'])
+
+    existing_user_ids = {profile.user_id for profile in profiles}
+    UserProfile.objects.bulk_create([
+        UserProfile(user_id=user_id, followers_count=followers_count)
+        for user_id, followers_count in counts.items()
+        if user_id not in existing_user_ids
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0001_initial'),
+        ('friendships', '0002_auto_20220701_1412'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userprofile',
+            name='followers_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_followers_count, migrations.RunPython.noop),
+    ]
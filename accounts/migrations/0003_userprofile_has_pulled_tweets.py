@@ -0,0 +1,18 @@
+# Generated by Django 3.1.3 on 2026-10-18 12:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0002_userprofile_followers_count'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userprofile',
+            name='has_pulled_tweets',
+            field=models.BooleanField(default=False),
+        ),
+    ]
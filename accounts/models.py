@@ -1,5 +1,7 @@
 from django.db import models
+from django.db.models.signals import post_delete, post_save
 from django.contrib.auth.models import User
+from accounts.listeners import invalidate_user_cache
 
 
 class UserProfile(models.Model):
@@ -13,6 +15,12 @@ class UserProfile(models.Model):
     # 当一个 user 被创建之后，会创建一个 user profile 的 object
     # 此时用户还来不及去设置 nickname 等信息，因此设置 null=True
     nickname = models.CharField(null=True, max_length=200)
+    # 冗余存储的粉丝数 -> 关注/取关的时候由 friendships/listeners.py 更新
+    # 用来判断一个用户是不是大V(粉丝数超过阈值的用户发帖不做 push fanout)，避免每次都 COUNT
+    followers_count = models.IntegerField(default=0)
+    # 有没有以大V身份发过没有 push 给粉丝的 tweet -> 粉丝读 newsfeed 的时候要 pull 这个用户的 tweets
+    # 粉丝数降到阈值以下之后，把最近的 tweets 补 push 给粉丝(见 push_pulled_tweets_task)才清掉
+    has_pulled_tweets = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -44,3 +52,7 @@ def get_profile(user):
 #     def profile():
 #       ...
 User.profile = property(get_profile)
+
+# 改用户名 / 删除用户的时候让 UserService 的对象缓存失效
+post_save.connect(invalidate_user_cache, sender=User)
+post_delete.connect(invalidate_user_cache, sender=User)
@@ -0,0 +1,57 @@
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import caches
+
+from accounts import constants
+
+
+class UserService(object):
+
+    # ---------------------------------------------------------------------
+    # user 对象缓存 (cache-aside): users:v<version>:<id> -> User 对象，和 TweetService 的 tweet 缓存一样
+    # 不缓存密码的 hash (defer 掉了，真的用到的时候才会再查一次)
+    # post_save / post_delete 会让缓存失效(见 accounts/listeners.py)，
+    # 用 queryset.update() 改 User 的地方要自己调用 invalidate_cache
+    # ---------------------------------------------------------------------
+    @classmethod
+    def get_cache(cls):
+        return caches[getattr(settings, 'USER_CACHE_ALIAS', constants.USER_CACHE_ALIAS)]
+
+    @classmethod
+    def get_cache_key(cls, user_id):
+        return 'users:v{}:{}'.format(
+            getattr(settings, 'USER_CACHE_VERSION', constants.USER_CACHE_VERSION),
+            user_id,
+        )
+
+    @classmethod
+    def get_by_ids(cls, user_ids):
+        """
+        返回 {user_id: user}，已经被删掉的 user 不在结果里
+        不管多少个 user，最多一次 get_many + 一条 query + 一次 set_many
+        """
+        user_ids = {user_id for user_id in user_ids if user_id is not None}
+        if not user_ids:
+            return {}
+        cache = cls.get_cache()
+        keys = {cls.get_cache_key(user_id): user_id for user_id in user_ids}
+        users = {keys[key]: user for key, user in cache.get_many(keys.keys()).items()}
+
+        missing_ids = user_ids - users.keys()
+        if missing_ids:
+            missing = User.objects.defer('password').in_bulk(missing_ids)
+            cache.set_many(
+                {cls.get_cache_key(user_id): user for user_id, user in missing.items()},
+                getattr(settings, 'USER_CACHE_TIMEOUT', constants.USER_CACHE_TIMEOUT),
+            )
+            users.update(missing)
+        return users
+
+    @classmethod
+    def get_by_id(cls, user_id):
+        # user 不存在的时候返回 None
+        return cls.get_by_ids([user_id]).get(user_id)
+
+    @classmethod
+    def invalidate_cache(cls, user_ids):
+        cls.get_cache().delete_many([cls.get_cache_key(user_id) for user_id in user_ids])
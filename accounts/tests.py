@@ -1,4 +1,5 @@
 from accounts.models import UserProfile
+from accounts.services import UserService
 from testing.testcases import TestCase
 
 
@@ -10,3 +11,31 @@ class UserProfileTests(TestCase):
         p = test_user.profile
         self.assertEqual(isinstance(p, UserProfile), True)
         self.assertEqual(UserProfile.objects.count(), 1)
+
+
+class UserCacheTests(TestCase):
+
+    def setUp(self):
+        self.users = [self.create_user('cacheuser{}'.format(i)) for i in range(3)]
+
+    def test_get_by_ids(self):
+        user_ids = [user.id for user in self.users]
+        with self.assertNumQueries(1):
+            users = UserService.get_by_ids(user_ids + [0, None])
+        self.assertEqual(sorted(users), sorted(user_ids))
+        self.assertEqual(users[user_ids[0]].username, 'cacheuser0')
+        # 第二次全部从缓存里取
+        with self.assertNumQueries(0):
+            users = UserService.get_by_ids(user_ids)
+        self.assertEqual(users[user_ids[1]].username, 'cacheuser1')
+        self.assertIsNone(UserService.get_by_id(0))
+
+    def test_invalidate_on_save_and_delete(self):
+        user = self.users[0]
+        UserService.get_by_id(user.id)
+        user.username = 'renamed'
+        user.save()
+        self.assertEqual(UserService.get_by_id(user.id).username, 'renamed')
+        user.delete()
+        self.assertIsNone(UserService.get_by_id(user.id))
+
@@ -1,8 +1,9 @@
 from rest_framework import serializers
 from accounts.api.serializers import UserSerializerForComments
 from comments.models import Comment
+from comments.services import CommentService
 from likes.services import LikeService
-from tweets.models import Tweet
+from tweets.services import TweetService
 from rest_framework.exceptions import ValidationError
 
 
@@ -11,10 +12,12 @@ class CommentSerializerForCreate(serializers.ModelSerializer):
     # 手动添加user_id和tweet_id 默认只能添加user和tweet
     user_id = serializers.IntegerField()
     tweet_id = serializers.IntegerField()
+    # 回复某条 comment 的时候带上它的 id
+    parent_id = serializers.IntegerField(required=False, allow_null=True)
 
     class Meta:
         model = Comment
-        fields = ('id', 'user_id', 'tweet_id', 'content')
+        fields = ('id', 'user_id', 'tweet_id', 'parent_id', 'content')
 
     # call validated_data 和 is_valid()时候会调用
     # 入参是data -> return validated_data
@@ -25,18 +28,30 @@ class CommentSerializerForCreate(serializers.ModelSerializer):
         tweet_id = data['tweet_id']
         # 判断id是否存在用 filter().exist()
         # 注！！！filter里是id=... 不是tweet_id=...
-        if not Tweet.objects.filter(id=tweet_id).exists():
+        # 现在走 tweet 的对象缓存，命中的时候不需要查数据库
+        if TweetService.get_by_id(tweet_id) is None:
             # validate过程出现的异常都raise ValidationError
             # 要从rest_framework.exceptions里import, 返回的是object
             raise ValidationError({"message": "the tweet is not exist"})
+
+        # 回复的 comment 要存在，属于同一条 tweet，并且回复串不能太深
+        if data.get('parent_id') is not None:
+            parent = Comment.objects.filter(id=data['parent_id']).first()
+            if parent is None or parent.tweet_id != tweet_id:
+                raise ValidationError({"message": "the parent comment is not exist"})
+            if parent.depth >= CommentService.get_max_depth():
+                raise ValidationError({"message": "the reply thread is too deep"})
+            data['parent'] = parent
         return data
 
     # 在SerializerForCreate里调用objects.create方法
+    # 现在由 CommentService 创建，顺便维护 path 和冗余的评论数 / 回复数
     def create(self, validated_data):
-        return Comment.objects.create(
+        return CommentService.create_comment(
             user_id=validated_data['user_id'],
             tweet_id=validated_data['tweet_id'],
             content=validated_data['content'],
+            parent=validated_data.get('parent'),
         )
 
 
@@ -51,19 +66,30 @@ class CommentSerializer(serializers.ModelSerializer):
             'id',
             'user',
             'tweet_id',
+            'parent_id',
+            'root_id',
+            'depth',
+            'path',
             'content',
             'created_at',
             'updated_at',
             'likes_count',
+            'replies_count',
             'has_liked',
         )
 
+    # 列表类的接口会用 CommentService.hydrate 把整页的数据批量查好放在 context 里
+    # context 里没有的时候(比如单条 comment)再单独查
     def get_has_liked(self, obj):
+        if 'liked_comment_ids' in self.context:
+            return obj.id in self.context['liked_comment_ids']
         return LikeService.has_liked(self.context['request'].user, obj)
 
     def get_likes_count(self, obj):
-        # like_set是一个queryset, 调用其count方法 -> 获得数量
-        return obj.like_set.count()
+        # 冗余存储的点赞数(+ 还没有写回数据库的增量)，不需要 COUNT like_set
+        if obj.id in self.context.get('likes_count_by_comment_id', {}):
+            return self.context['likes_count_by_comment_id'][obj.id]
+        return LikeService.get_likes_count(obj)
 
 
 class CommentSerializerForUpdate(serializers.ModelSerializer):
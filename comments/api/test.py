@@ -1,3 +1,6 @@
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
 from rest_framework.test import APIClient
 from comments.models import Comment
 from testing.testcases import TestCase
@@ -53,6 +56,8 @@ class CommentApiTest(TestCase):
         self.assertEqual(response.data['user']['id'], self.user1.id)
         self.assertEqual(response.data['tweet_id'], self.tweet.id)
         self.assertEqual(response.data['content'], 'test content')
+        self.tweet.refresh_from_db()
+        self.assertEqual(self.tweet.comments_count, 1)
 
     def test_update(self):
         comment = self.create_comment(self.user1, self.tweet, 'original')
@@ -107,6 +112,8 @@ class CommentApiTest(TestCase):
         response = self.user1_client.delete(url)
         self.assertEqual(response.status_code, 200)
         self.assertEqual(Comment.objects.count(), count - 1)
+        self.tweet.refresh_from_db()
+        self.assertEqual(self.tweet.comments_count, 0)
 
     def test_list(self):
         # 必须带 tweet_id
@@ -134,6 +141,11 @@ class CommentApiTest(TestCase):
         # 因为list返回的时候order_by('created_at') -> 最上面是最旧的评论
         self.assertEqual(response.data['comments'][0]['content'], '1')
         self.assertEqual(response.data['comments'][1]['content'], '2')
+        self.assertEqual(response.data['has_next_page'], False)
+
+        # tweet_id 不是数字
+        response = self.anonymous_client.get(COMMENT_URL, {'tweet_id': 'abc'})
+        self.assertEqual(response.status_code, 400)
 
         # 同时提供 user_id 和 tweet_id 只有 tweet_id 会在 filter 中生效
         response = self.anonymous_client.get(COMMENT_URL, {
@@ -142,6 +154,67 @@ class CommentApiTest(TestCase):
         })
         self.assertEqual(len(response.data['comments']), 2)
 
+    def test_list_query_count(self):
+        comment = self.create_comment(self.user1, self.tweet)
+        self.create_like(self.user2, comment)
+        with CaptureQueriesContext(connection) as few:
+            self.user2_client.get(COMMENT_URL, {'tweet_id': self.tweet.id})
+        for i in range(10):
+            self.create_comment(self.user2, self.tweet, str(i))
+        with CaptureQueriesContext(connection) as many:
+            response = self.user2_client.get(COMMENT_URL, {'tweet_id': self.tweet.id})
+        # 是否点过赞 / 作者 都是整页批量查的，query 数量和 comment 的数量无关
+        self.assertEqual(len(few), len(many))
+        self.assertEqual(
+            [comment['has_liked'] for comment in response.data['comments']],
+            [True] + [False] * 10,
+        )
+        self.assertEqual(response.data['comments'][0]['likes_count'], 1)
+
+    def test_list_pagination(self):
+        # 最旧的在前面
+        comments = [self.create_comment(self.user1, self.tweet, str(i)) for i in range(25)]
+
+        response = self.anonymous_client.get(COMMENT_URL, {'tweet_id': self.tweet.id})
+        self.assertEqual(
+            [item['id'] for item in response.data['comments']],
+            [comment.id for comment in comments[:20]],
+        )
+        self.assertEqual(response.data['has_next_page'], True)
+
+        # 用这一页最后一条做 cursor 往下翻
+        last = response.data['comments'][-1]
+        response = self.anonymous_client.get(COMMENT_URL, {
+            'tweet_id': self.tweet.id,
+            'created_at__gt': last['created_at'],
+            'id__gt': last['id'],
+        })
+        self.assertEqual(
+            [item['id'] for item in response.data['comments']],
+            [comment.id for comment in comments[20:]],
+        )
+        self.assertEqual(response.data['has_next_page'], False)
+
+        # 同一个 created_at 的评论靠 id 区分，不会漏也不会重复
+        Comment.objects.filter(tweet=self.tweet).update(created_at=comments[0].created_at)
+        seen = []
+        params = {'tweet_id': self.tweet.id, 'page_size': 7}
+        while True:
+            response = self.anonymous_client.get(COMMENT_URL, params)
+            seen.extend(item['id'] for item in response.data['comments'])
+            if not response.data['has_next_page']:
+                break
+            last = response.data['comments'][-1]
+            params.update({'created_at__gt': last['created_at'], 'id__gt': last['id']})
+        self.assertEqual(seen, sorted(comment.id for comment in comments))
+
+        # 只能往下翻
+        response = self.anonymous_client.get(COMMENT_URL, {
+            'tweet_id': self.tweet.id,
+            'created_at__lt': last['created_at'],
+        })
+        self.assertEqual(response.status_code, 400)
+
     def test_comments_count(self):
         # test tweet detail api
         tweet = self.create_tweet(self.user1)
@@ -162,3 +235,148 @@ class CommentApiTest(TestCase):
         response = self.user2_client.get(NEWSFEED_LIST_API)
         self.assertEqual(response.status_code, 200)
         self.assertEqual(response.data['newsfeeds'][0]['tweet']['comments_count'], 2)
+
+    def test_reply(self):
+        comment = self.create_comment(self.user1, self.tweet, 'root')
+        response = self.user2_client.post(COMMENT_URL, {
+            'tweet_id': self.tweet.id,
+            'parent_id': comment.id,
+            'content': 'reply',
+        })
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['parent_id'], comment.id)
+        self.assertEqual(response.data['root_id'], comment.id)
+        self.assertEqual(response.data['depth'], 1)
+        reply_id = response.data['id']
+
+        # 回复的回复属于同一个回复串
+        response = self.user1_client.post(COMMENT_URL, {
+            'tweet_id': self.tweet.id,
+            'parent_id': reply_id,
+            'content': 'reply to reply',
+        })
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['root_id'], comment.id)
+        self.assertEqual(response.data['depth'], 2)
+
+        # 回复也算在 tweet 的评论数里，顶层评论上有冗余的回复数
+        comment.refresh_from_db()
+        self.assertEqual(comment.replies_count, 2)
+        self.tweet.refresh_from_db()
+        self.assertEqual(self.tweet.comments_count, 3)
+
+        # parent 不存在 / 不是这条 tweet 的评论
+        other = self.create_comment(self.user1, self.create_tweet(self.user1))
+        for parent_id in [0, other.id]:
+            response = self.user1_client.post(COMMENT_URL, {
+                'tweet_id': self.tweet.id,
+                'parent_id': parent_id,
+                'content': 'reply',
+            })
+            self.assertEqual(response.status_code, 400)
+
+        # 回复串太深
+        with override_settings(COMMENT_MAX_DEPTH=2):
+            response = self.user1_client.post(COMMENT_URL, {
+                'tweet_id': self.tweet.id,
+                'parent_id': Comment.objects.get(depth=2).id,
+                'content': 'too deep',
+            })
+        self.assertEqual(response.status_code, 400)
+
+    def test_list_replies(self):
+        root1 = self.create_comment(self.user1, self.tweet, 'root1')
+        root2 = self.create_comment(self.user1, self.tweet, 'root2')
+        a = self.create_comment(self.user2, self.tweet, 'a', parent=root1)
+        b = self.create_comment(self.user2, self.tweet, 'b', parent=root1)
+        a1 = self.create_comment(self.user1, self.tweet, 'a1', parent=a)
+        self.create_comment(self.user1, self.tweet, 'c', parent=root2)
+        b1 = self.create_comment(self.user1, self.tweet, 'b1', parent=b)
+        a2 = self.create_comment(self.user1, self.tweet, 'a2', parent=a)
+        a11 = self.create_comment(self.user2, self.tweet, 'a11', parent=a1)
+
+        # 不带 root 只有顶层评论
+        response = self.anonymous_client.get(COMMENT_URL, {'tweet_id': self.tweet.id})
+        self.assertEqual(
+            [(item['content'], item['replies_count']) for item in response.data['comments']],
+            [('root1', 6), ('root2', 1)],
+        )
+
+        # 带 root 是整个回复串，按回复的层级顺序
+        response = self.anonymous_client.get(COMMENT_URL, {'tweet_id': self.tweet.id, 'root': root1.id})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [item['id'] for item in response.data['comments']],
+            [a.id, a1.id, a11.id, a2.id, b.id, b1.id],
+        )
+        self.assertEqual(
+            [item['depth'] for item in response.data['comments']],
+            [1, 2, 3, 2, 1, 2],
+        )
+        self.assertEqual(response.data['has_next_page'], False)
+
+        # 前 N 条回复，用最后一条的 path 往下翻
+        response = self.anonymous_client.get(COMMENT_URL, {
+            'tweet_id': self.tweet.id,
+            'root': root1.id,
+            'page_size': 4,
+        })
+        self.assertEqual([item['id'] for item in response.data['comments']], [a.id, a1.id, a11.id, a2.id])
+        self.assertEqual(response.data['has_next_page'], True)
+        response = self.anonymous_client.get(COMMENT_URL, {
+            'tweet_id': self.tweet.id,
+            'root': root1.id,
+            'page_size': 4,
+            'path__gt': response.data['comments'][-1]['path'],
+        })
+        self.assertEqual([item['id'] for item in response.data['comments']], [b.id, b1.id])
+        self.assertEqual(response.data['has_next_page'], False)
+
+        # root 不是这条 tweet 的评论
+        response = self.anonymous_client.get(COMMENT_URL, {
+            'tweet_id': self.create_tweet(self.user1).id,
+            'root': root1.id,
+        })
+        self.assertEqual(response.data['comments'], [])
+        response = self.anonymous_client.get(COMMENT_URL, {'tweet_id': self.tweet.id, 'root': 'abc'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_list_replies_query_count(self):
+        root = self.create_comment(self.user1, self.tweet)
+        reply = self.create_comment(self.user2, self.tweet, parent=root)
+        params = {'tweet_id': self.tweet.id, 'root': root.id}
+        with CaptureQueriesContext(connection) as few:
+            self.user2_client.get(COMMENT_URL, params)
+        for _ in range(5):
+            reply = self.create_comment(self.user2, self.tweet, parent=reply)
+        with CaptureQueriesContext(connection) as many:
+            response = self.user2_client.get(COMMENT_URL, params)
+        # 不会一层一层地查
+        self.assertEqual(len(few), len(many))
+        self.assertEqual(len(response.data['comments']), 6)
+
+    def test_destroy_with_replies(self):
+        root = self.create_comment(self.user1, self.tweet)
+        reply = self.create_comment(self.user2, self.tweet, parent=root)
+        self.create_comment(self.user1, self.tweet, parent=reply)
+        sibling = self.create_comment(self.user1, self.tweet, parent=root)
+
+        # 删除回复的时候它下面的回复一起删掉
+        response = self.user2_client.delete('{}{}/'.format(COMMENT_URL, reply.id))
+        self.assertEqual(response.status_code, 200)
+        root.refresh_from_db()
+        self.assertEqual(root.replies_count, 1)
+        self.tweet.refresh_from_db()
+        self.assertEqual(self.tweet.comments_count, 2)
+        self.assertEqual(
+            list(Comment.objects.filter(tweet=self.tweet).values_list('id', flat=True).order_by('id')),
+            [root.id, sibling.id],
+        )
+
+        # 删除顶层评论的时候整个回复串一起删掉
+        response = self.user1_client.delete('{}{}/'.format(COMMENT_URL, root.id))
+        self.assertEqual(response.status_code, 200)
+        self.tweet.refresh_from_db()
+        self.assertEqual(self.tweet.comments_count, 0)
+        self.assertFalse(Comment.objects.filter(tweet=self.tweet).exists())
+
@@ -8,8 +8,11 @@ from comments.api.serializers import (
 )
 from comments.models import Comment
 from comments.api.permissions import IsObjectOwner
+from comments.services import CommentService
 from inbox.services import NotificationService
+from tweets.services import TweetService
 from utils.decorators import required_params
+from utils.paginations import EndlessPagination
 
 
 class CommentViewSet(viewsets.GenericViewSet):
@@ -21,10 +24,11 @@ class CommentViewSet(viewsets.GenericViewSet):
     # serializer_class -> 当用django rest-framework的UI的时候
     serializer_class = CommentSerializerForCreate
     queryset = Comment.objects.all()
-    filterset_fields = ('tweet_id',)
+    pagination_class = EndlessPagination
 
     # POST /api/comments/ -> create
     # GET /api/comments/?tweet_id=1  -> list
+    # GET /api/comments/?tweet_id=1&root=2  -> list 顶层评论 2 下面的回复串
     # GET /api/comments/1/ -> retrieve
     # DELETE /api/comments/1/ -> destroy
     # PATCH /api/comments/1/ -> partial_update
@@ -53,6 +57,8 @@ class CommentViewSet(viewsets.GenericViewSet):
             # 通过request获取tweet_id
             "tweet_id": request.data.get("tweet_id"),
             "content": request.data.get("content"),
+            # 回复某条 comment 的时候才有
+            "parent_id": request.data.get("parent_id"),
         }
         # 2. 将数据传入SerializerForCreate
         serializer = CommentSerializerForCreate(data=data)
@@ -65,6 +71,7 @@ class CommentViewSet(viewsets.GenericViewSet):
             }, status=status.HTTP_400_BAD_REQUEST)
 
         # 通过save调用serializer里的create方法
+        # 评论和 tweet 的评论数(回复串的回复数)在同一个事务里，见 CommentService.create_comment
         comment = serializer.save()
 
         # send comment notification
@@ -95,17 +102,53 @@ class CommentViewSet(viewsets.GenericViewSet):
         # approach 2: 3rd party lib django-filter
         # 注：settings里的名字是django_filters
         # 注意：安装第三方库(大部分)都要在settings里更新！
-        queryset = self.get_queryset()
-        # filter_queryset -> 用到filterset_fields
-        comments = self.filter_queryset(queryset).order_by('created_at')
+        # queryset = self.filter_queryset(self.get_queryset()).order_by('created_at')
+
+        # 现在不再一次返回全部评论，还是和原来一样最上面是最旧的评论，按 (created_at, id) 正序做 cursor 翻页
+        # 往下翻: ?tweet_id=1&created_at__gt=...&id__gt=...，走 (tweet, depth, created_at) 联合索引
+        try:
+            tweet_id = int(request.query_params['tweet_id'])
+        except ValueError:
+            return Response({
+                'success': False,
+                'message': 'tweet_id should be an integer',
+            }, status=status.HTTP_400_BAD_REQUEST)
+        if 'root' in request.query_params:
+            # ?tweet_id=1&root=<顶层评论 id> -> 整个回复串，按回复的层级顺序(path)排好
+            # 往下翻: &path__gt=<上一页最后一条的 path>，page_size 就是取前 N 条回复
+            try:
+                root_id = int(request.query_params['root'])
+            except ValueError:
+                return Response({
+                    'success': False,
+                    'message': 'root should be an integer',
+                }, status=status.HTTP_400_BAD_REQUEST)
+            queryset = CommentService.get_replies_queryset(
+                tweet_id,
+                root_id,
+                request.query_params.get('path__gt'),
+            )
+            comments = self.paginator.paginate_ordered_list(
+                list(queryset[:self.paginator.get_page_size(request) + 1]),
+                request,
+            )
+        else:
+            # 只有顶层评论，每条带着冗余的 replies_count
+            comments = self.paginator.paginate_queryset_ascending(
+                TweetService.get_comments_queryset(tweet_id),
+                request,
+            )
+        # 作者 / 是否点过赞 / 点赞数 批量查好，避免每条 comment 都查一遍
+        context = CommentService.hydrate(comments, request.user)
         serializer = CommentSerializer(
             comments,
-            context={'request': request},
+            context={'request': request, **context},
             many=True,
         )
 
         return Response({
             'comments': serializer.data,
+            'has_next_page': self.paginator.has_next_page,
         }, status=status.HTTP_200_OK)
 
     def update(self, request, *args, **kwargs):
@@ -130,7 +173,8 @@ class CommentViewSet(viewsets.GenericViewSet):
 
     def destroy(self, request, *args, **kwargs):
         comment = self.get_object()
-        comment.delete()
+        # 下面的回复一起删掉，评论数 / 回复数减去删掉的条数
+        CommentService.delete_comment(comment)
 
         # DRF 里默认 destroy 返回的是 status code = 204 no content
         # 这里 return 了 success=True 更直观的让前端去做判断，所以 return 200 更合适
@@ -0,0 +1,4 @@
+# comments 相关配置的默认值，都可以在 settings 里用同名的配置覆盖
+
+# 回复最多嵌套几层(顶层评论是第 0 层)，path 的长度是 (层数 + 1) * 13，不能超过 Comment.path 的 max_length
+COMMENT_MAX_DEPTH = 8
@@ -0,0 +1,52 @@
+# Generated by Django 3.1.3 on 2026-10-18 10:46
+
+from django.db import migrations, models
+from django.db.models import Count
+
+BATCH_SIZE = 1000
+
+
+def backfill_likes_count(apps, schema_editor):
+    Comment = apps.get_model('comments', 'Comment')
+    Like = apps.get_model('likes', 'Like')
+    ContentType = apps.get_model('contenttypes', 'ContentType')
+    content_type = ContentType.objects.filter(app_label='comments', model='comment').first()
+    if content_type is None:
+        return
+
+    # 按主键分批，每批 comment 的点赞数一条 GROUP BY query
+    last_id = 0
+    while True:
+        comment_ids = list(Comment.objects.filter(
+            id__gt=last_id,
+        ).order_by('id').values_list('id', flat=True)[:BATCH_SIZE])
+        if not comment_ids:
+            break
+        last_id = comment_ids[-1]
+
+        likes_count = dict(Like.objects.filter(
+            content_type=content_type,
+            object_id__in=comment_ids,
+        ).values('object_id').annotate(count=Count('id')).values_list('object_id', 'count'))
+        Comment.objects.bulk_update([
+            Comment(id=comment_id, likes_count=likes_count.get(comment_id, 0))
+            for comment_id in comment_ids
+        ], ['likes_count'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('likes', '0001_initial'),
+        ('comments', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comment',
+            name='likes_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_likes_count, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,77 @@
+# Generated by Django 3.1.3 on 2026-10-18 11:24
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+BATCH_SIZE = 1000
+
+
+# 迁移里不引用 comments.models 里的代码，以后那边改了这里写出来的 path 格式也不会变
+PATH_SEGMENT_WIDTH = 13
+PATH_SEGMENT_DIGITS = '0123456789abcdefghijklmnopqrstuvwxyz'
+
+
+def get_path_segment(comment_id):
+    digits = []
+    while comment_id:
+        comment_id, remainder = divmod(comment_id, 36)
+        digits.append(PATH_SEGMENT_DIGITS[remainder])
+    return ''.join(reversed(digits)).rjust(PATH_SEGMENT_WIDTH, '0')
+
+
+def backfill_path(apps, schema_editor):
+    Comment = apps.get_model('comments', 'Comment')
+    # 已有的评论都是顶层评论，path 就是自己的 id，按主键分批写
+    last_id = 0
+    while True:
+        comment_ids = list(Comment.objects.filter(
+            id__gt=last_id,
+        ).order_by('id').values_list('id', flat=True)[:BATCH_SIZE])
+        if not comment_ids:
+            break
+        last_id = comment_ids[-1]
+        Comment.objects.bulk_update([
+            Comment(id=comment_id, path=get_path_segment(comment_id))
+            for comment_id in comment_ids
+        ], ['path'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tweets', '0006_tweetphoto'),
+        ('comments', '0002_comment_likes_count'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comment',
+            name='depth',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='parent',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='comments.comment'),
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='path',
+            field=models.CharField(db_index=True, default='', max_length=255),
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='replies_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='root',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='comments.comment'),
+        ),
+        migrations.RunPython(backfill_path, migrations.RunPython.noop),
+        migrations.AlterIndexTogether(
+            name='comment',
+            index_together={('tweet', 'depth', 'created_at')},
+        ),
+    ]
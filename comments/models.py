@@ -5,22 +5,57 @@ from django.db import models
 from likes.models import Like
 from tweets.models import Tweet
 
+# path 里每一层是定长(13 位)补零的 36 进制 id，64 位的 id 也放得下，字符串的顺序和 id 的顺序一致
+PATH_SEGMENT_WIDTH = 13
+PATH_SEGMENT_DIGITS = '0123456789abcdefghijklmnopqrstuvwxyz'
+
+
+def get_path_segment(comment_id):
+    digits = []
+    while comment_id:
+        comment_id, remainder = divmod(comment_id, 36)
+        digits.append(PATH_SEGMENT_DIGITS[remainder])
+    return ''.join(reversed(digits)).rjust(PATH_SEGMENT_WIDTH, '0')
+
 
 class Comment(models.Model):
     """
-    在这个版本中，先只实现简单的评论
-    即：只评论某条tweet，而不能评论某条comment
+    评论可以直接评论某条tweet(顶层评论)，也可以回复某条comment
+    回复串用 materialized path 存: path 是从顶层评论到自己的每一层 id 拼起来的，
+    一个顶层评论下面的整个回复串就是 path 以它开头的一段连续范围，一条范围查询就可以取出来，
+    按 path 排序正好是按回复串展示的顺序(先序遍历)
     """
     user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True)
     tweet = models.ForeignKey(Tweet, on_delete=models.SET_NULL, null=True)
+    # 回复的是哪条 comment / 属于哪个顶层评论的回复串，顶层评论这两个都是 null
+    # 删除的时候整个子树一起删(见 CommentViewSet.destroy)
+    parent = models.ForeignKey('self', on_delete=models.SET_NULL, null=True, related_name='+')
+    root = models.ForeignKey('self', on_delete=models.SET_NULL, null=True, related_name='+')
+    # 由 save() 生成，不能手动填
+    path = models.CharField(max_length=255, default='', db_index=True, editable=False)
+    depth = models.PositiveSmallIntegerField(default=0)
     content = models.TextField(max_length=140)
+    # 冗余存储的点赞数，点赞/取消点赞的时候用 F() 原子地更新
+    likes_count = models.IntegerField(default=0)
+    # 冗余存储的回复串里的回复数(只有顶层评论上有)，回复/删除回复的时候用 F() 原子地更新
+    replies_count = models.IntegerField(default=0)
     # 创建用auto_now_add, 更新用auto_now
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
-        # 对于每条tweet，用创建时间排序 -> 联合索引
-        index_together = (('tweet', 'created_at'),)
+        # 对于每条tweet，顶层评论用创建时间排序 -> 联合索引
+        index_together = (('tweet', 'depth', 'created_at'),)
+
+    def save(self, *args, **kwargs):
+        super(Comment, self).save(*args, **kwargs)
+        if self.path:
+            return
+        # id 插入之后才有，再把自己这一层拼到 parent 的 path 上
+        # 不管是从 CommentService / admin / Comment.objects.create 创建的都会有 path
+        self.path = ('' if self.parent is None else self.parent.path) + get_path_segment(self.id)
+        # 用 update 而不是再 save 一次，不会因为 create() 传的 force_insert 再插入一遍
+        Comment.objects.filter(id=self.id).update(path=self.path)
 
     def __str__(self):
         return '{} - {} says {} at tweet {}'.format(
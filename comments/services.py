@@ -0,0 +1,107 @@
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import F
+
+from comments import constants
+from comments.models import Comment, get_path_segment
+from likes.services import LikeService
+from tweets.models import Tweet
+
+
+class CommentService(object):
+
+    @classmethod
+    def get_max_depth(cls):
+        return getattr(settings, 'COMMENT_MAX_DEPTH', constants.COMMENT_MAX_DEPTH)
+
+    @classmethod
+    def create_comment(cls, user_id, tweet_id, content, parent=None):
+        """
+        评论 tweet(parent=None) 或者回复 parent
+        tweet 的评论数(包括回复)和回复串的回复数在同一个事务里用 F() 更新，并发评论的时候不会互相覆盖
+        """
+        # import 写在里面避免循环依赖
+        from tweets.services import TweetService
+
+        with transaction.atomic():
+            # path 在 Comment.save 里补上
+            comment = Comment.objects.create(
+                user_id=user_id,
+                tweet_id=tweet_id,
+                content=content,
+                parent=parent,
+                root_id=None if parent is None else (parent.root_id or parent.id),
+                depth=0 if parent is None else parent.depth + 1,
+            )
+            if comment.root_id is not None:
+                Comment.objects.filter(id=comment.root_id).update(
+                    replies_count=F('replies_count') + 1,
+                )
+            Tweet.objects.filter(id=tweet_id).update(comments_count=F('comments_count') + 1)
+        TweetService.invalidate_cache([tweet_id])
+        return comment
+
+    @classmethod
+    def delete_comment(cls, comment):
+        """
+        删除 comment 和它下面所有的回复(path 的一段范围，一条 DELETE)，返回删掉了几条
+        并发删除同一条评论的时候只有真正删掉的那个请求去减评论数 / 回复数
+        """
+        # import 写在里面避免循环依赖
+        from tweets.services import TweetService
+
+        if comment.path:
+            queryset = Comment.objects.filter(tweet_id=comment.tweet_id, path__startswith=comment.path)
+        else:
+            # 没有 path 的时候 path__startswith='' 会匹配所有的评论，只删它自己
+            queryset = Comment.objects.filter(id=comment.id)
+        with transaction.atomic():
+            _, deleted_by_model = queryset.delete()
+            deleted = deleted_by_model.get(Comment._meta.label, 0)
+            if deleted:
+                if comment.root_id is not None:
+                    Comment.objects.filter(id=comment.root_id).update(
+                        replies_count=F('replies_count') - deleted,
+                    )
+                Tweet.objects.filter(id=comment.tweet_id).update(
+                    comments_count=F('comments_count') - deleted,
+                )
+        if deleted:
+            TweetService.invalidate_cache([comment.tweet_id])
+        return deleted
+
+    @classmethod
+    def get_replies_queryset(cls, tweet_id, root_id, path_cursor=None):
+        """
+        顶层评论 root_id 下面的整个回复串，按 path 排序(先序遍历)，path_cursor 之后的部分
+        顶层评论的 path 就是它自己的 id，不需要先把它查出来，一条 path 索引上的范围查询
+        """
+        prefix = get_path_segment(root_id)
+        return Comment.objects.filter(
+            tweet_id=tweet_id,
+            path__startswith=prefix,
+            path__gt=max(prefix, path_cursor or ''),
+        ).order_by('path')
+
+    @classmethod
+    def hydrate(cls, comments, viewer):
+        """
+        和 TweetService.hydrate 一样，一次性查好一组 comments 序列化要用的数据
+        - 作者: 1 条 query，直接挂到 comment.user 上
+        - 当前用户点过赞的 comments: 1 条 query
+        - 点赞数(write-behind 的增量): 最多 1 次 cache get_many
+        返回的 dict 要放进 serializer 的 context 里，CommentSerializer 会优先从 context 里读
+        """
+        comment_ids = [comment.id for comment in comments]
+
+        user_ids = {comment.user_id for comment in comments if comment.user_id is not None}
+        users = User.objects.in_bulk(user_ids)
+        for comment in comments:
+            if comment.user_id is not None:
+                comment.user = users.get(comment.user_id)
+
+        return {
+            'liked_comment_ids': LikeService.get_liked_object_ids(viewer, Comment, comment_ids),
+            'likes_count_by_comment_id': LikeService.get_likes_counts(comments),
+        }
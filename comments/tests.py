@@ -1,3 +1,5 @@
+from comments.models import Comment, get_path_segment
+from comments.services import CommentService
 from testing.testcases import TestCase
 
 
@@ -9,3 +11,46 @@ class CommentModelTest(TestCase):
         create_comment = self.create_comment(user, tweet)
         # create_comment 创建成功之后 什么都不会返回 -> None
         self.assertNotEqual(create_comment.__str__(), None)
+
+    def test_path(self):
+        # 定长，字符串的顺序和 id 的顺序一样
+        self.assertEqual(get_path_segment(0), '0' * 13)
+        self.assertEqual(get_path_segment(35), '0' * 12 + 'z')
+        self.assertEqual(len(get_path_segment(2 ** 63 - 1)), 13)
+        ids = [1, 9, 10, 35, 36, 1295, 1296, 2 ** 40, 2 ** 63 - 1]
+        self.assertEqual(sorted(ids, key=get_path_segment), ids)
+
+        user = self.create_user('pathUser')
+        tweet = self.create_tweet(user)
+        root = self.create_comment(user, tweet)
+        reply = self.create_comment(user, tweet, parent=root)
+        self.assertEqual(root.path, get_path_segment(root.id))
+        self.assertEqual(reply.path, root.path + get_path_segment(reply.id))
+
+        # 不经过 CommentService 创建的也有 path
+        comment = Comment.objects.create(user=user, tweet=tweet, content='admin')
+        self.assertEqual(comment.path, get_path_segment(comment.id))
+        self.assertEqual(Comment.objects.get(id=comment.id).path, comment.path)
+        child = Comment.objects.create(user=user, tweet=tweet, content='child', parent=root)
+        self.assertEqual(child.path, root.path + get_path_segment(child.id))
+
+    def test_delete_comment(self):
+        user = self.create_user('deleteUser')
+        tweet = self.create_tweet(user)
+        other_tweet = self.create_tweet(user)
+        root = self.create_comment(user, tweet)
+        self.create_comment(user, tweet, parent=root)
+        other = self.create_comment(user, other_tweet)
+
+        # 没有 path 的评论(比如 backfill 之前的旧数据)只删它自己
+        broken = self.create_comment(user, tweet)
+        Comment.objects.filter(id=broken.id).update(path='')
+        broken.path = ''
+        self.assertEqual(CommentService.delete_comment(broken), 1)
+        self.assertEqual(Comment.objects.count(), 3)
+
+        self.assertEqual(CommentService.delete_comment(root), 2)
+        self.assertEqual(list(Comment.objects.values_list('id', flat=True)), [other.id])
+        tweet.refresh_from_db()
+        self.assertEqual(tweet.comments_count, 0)
+
@@ -1,31 +1,53 @@
 from django.contrib.auth.models import User
 from accounts.api.serializers import UserSerializerForFriendship
 from friendships.models import Friendship
+from friendships.services import FriendshipService
 from rest_framework import serializers
 from rest_framework.exceptions import ValidationError
 
 
+class FriendshipSerializerMixin(object):
+    """
+    列表接口会用 FriendshipService.hydrate 把整页的 followed_user_ids 放在 context 里
+    context 里没有的时候(比如 follow 接口返回的单条)再单独查
+    """
+    user_field = None
+
+    def get_has_followed(self, obj):
+        user_id = getattr(obj, '{}_id'.format(self.user_field))
+        if 'followed_user_ids' in self.context:
+            return user_id in self.context['followed_user_ids']
+        request = self.context.get('request')
+        viewer = request.user if request is not None else None
+        return user_id in FriendshipService.get_followed_user_ids(viewer, [user_id])
+
+
 # 可以通过source='to_user'去指定访问每个model instance的 to_user 方法
 # 即 通过model_instance.to_user获得数据
-class FollowingSerializer(serializers.ModelSerializer):
+class FollowingSerializer(FriendshipSerializerMixin, serializers.ModelSerializer):
     user = UserSerializerForFriendship(source='to_user')
+    # 当前登录的用户有没有关注这个人
+    has_followed = serializers.SerializerMethodField()
     # 注：这里可以不写created_at -> 因为如果这里没有 field会去model里找
     # created_at = serializers.DateTimeField()
+    user_field = 'to_user'
 
     class Meta:
         model = Friendship
         # fields会先去👆找是否有对应的field
         # serializer里没有的情况下才会去model里找
-        fields = ('user', 'created_at')
+        fields = ('user', 'created_at', 'has_followed')
 
 
-class FollowerSerializer(serializers.ModelSerializer):
+class FollowerSerializer(FriendshipSerializerMixin, serializers.ModelSerializer):
     user = UserSerializerForFriendship(source='from_user')
+    has_followed = serializers.SerializerMethodField()
     created_at = serializers.DateTimeField()
+    user_field = 'from_user'
 
     class Meta:
         model = Friendship
-        fields = ('user', 'created_at')
+        fields = ('user', 'created_at', 'has_followed')
 
 
 # 注意：POST请求的serializer是希望前端提供的信息 -> 与Get请求不一样
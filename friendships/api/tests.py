@@ -1,3 +1,5 @@
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from friendships.models import Friendship
 from rest_framework.test import APIClient
 from testing.testcases import TestCase
@@ -138,3 +140,86 @@ class FriendshipApiTests(TestCase):
             response.data['followers'][1]['user']['username'],
             'user2_follower0',
         )
+
+    def test_followers_pagination(self):
+        followers = [self.create_user('follower{}'.format(i)) for i in range(25)]
+        for follower in followers:
+            Friendship.objects.create(from_user=follower, to_user=self.user1)
+        # 最新关注的在前面
+        followers.reverse()
+        url = FOLLOWERS_URL.format(self.user1.id)
+
+        response = self.anonymous_client.get(url)
+        self.assertEqual(
+            [item['user']['id'] for item in response.data['followers']],
+            [follower.id for follower in followers[:20]],
+        )
+        self.assertEqual(response.data['has_next_page'], True)
+
+        # 同一个 created_at 的靠 id 区分，不会漏也不会重复
+        Friendship.objects.filter(to_user=self.user1).update(
+            created_at=Friendship.objects.filter(to_user=self.user1).first().created_at,
+        )
+        seen = []
+        params = {'page_size': 7}
+        while True:
+            response = self.anonymous_client.get(url, params)
+            seen.extend(item['user']['id'] for item in response.data['followers'])
+            if not response.data['has_next_page']:
+                break
+            last = Friendship.objects.get(
+                from_user_id=response.data['followers'][-1]['user']['id'],
+                to_user=self.user1,
+            )
+            params.update({'created_at__lt': last.created_at.isoformat(), 'id__lt': last.id})
+        self.assertEqual(sorted(seen), sorted(follower.id for follower in followers))
+
+        # followings 也一样
+        for follower in followers[:3]:
+            Friendship.objects.create(from_user=self.user1, to_user=follower)
+        response = self.anonymous_client.get(FOLLOWINGS_URL.format(self.user1.id), {'page_size': 2})
+        self.assertEqual(
+            [item['user']['id'] for item in response.data['followings']],
+            [followers[2].id, followers[1].id],
+        )
+        self.assertEqual(response.data['has_next_page'], True)
+
+    def test_has_followed(self):
+        # user1 关注了 user2 的一个 follower 和一个 following
+        follower = Friendship.objects.filter(to_user=self.user2).order_by('-id').first().from_user
+        following = Friendship.objects.filter(from_user=self.user2).order_by('-id').first().to_user
+        Friendship.objects.create(from_user=self.user1, to_user=follower)
+        Friendship.objects.create(from_user=self.user1, to_user=following)
+
+        response = self.user1_client.get(FOLLOWERS_URL.format(self.user2.id))
+        self.assertEqual(
+            [item['has_followed'] for item in response.data['followers']],
+            [True, False],
+        )
+        response = self.user1_client.get(FOLLOWINGS_URL.format(self.user2.id))
+        self.assertEqual(
+            [item['has_followed'] for item in response.data['followings']],
+            [True, False, False],
+        )
+        # 匿名用户都是 False
+        response = self.anonymous_client.get(FOLLOWINGS_URL.format(self.user2.id))
+        self.assertEqual(
+            [item['has_followed'] for item in response.data['followings']],
+            [False, False, False],
+        )
+
+    def test_followers_query_count(self):
+        url = FOLLOWERS_URL.format(self.user2.id)
+        # 第一次请求把用户放进缓存
+        self.user1_client.get(url)
+        with CaptureQueriesContext(connection) as few:
+            self.user1_client.get(url)
+        for i in range(10):
+            Friendship.objects.create(from_user=self.create_user('more{}'.format(i)), to_user=self.user2)
+        self.user1_client.get(url)
+        with CaptureQueriesContext(connection) as many:
+            response = self.user1_client.get(url)
+        # 用户从缓存里取，是否关注批量查，query 数量和粉丝的数量无关
+        self.assertEqual(len(few), len(many))
+        self.assertEqual(len(response.data['followers']), 12)
+
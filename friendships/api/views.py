@@ -9,6 +9,9 @@ from friendships.api.serializers import (
     FriendshipSerializerForCreate,
 )
 from friendships.models import Friendship
+from friendships.services import FriendshipService
+from newsfeeds.services import NewsFeedServices
+from utils.paginations import EndlessPagination
 
 """
 实现四个接口API
@@ -28,25 +31,46 @@ class FriendshipViewSet(viewsets.GenericViewSet):
     queryset = User.objects.all()
     # 当有POST请求的时候，需要指定serializer_class去显示网页上的表单
     serializer_class = FriendshipSerializerForCreate
+    # 粉丝列表可能有几百万条，按 (created_at, id) 倒序做 cursor 翻页
+    pagination_class = EndlessPagination
+    # pk 只能是数字，其它的直接 404
+    lookup_value_regex = r'\d+'
 
     # 所有 detail=True 的 action，都要传入一个pk参数
     # permission_classes -> 许可访问的 AllowAny -> 任何人都允许访问
     @action(methods=['GET'], detail=True, permission_classes=[AllowAny])
     def followings(self, request, pk):
         # API地址 -> api/friendships/1(用户的pk)/followings/
-        friendships = Friendship.objects.filter(from_user_id=pk).order_by('-created_at')  # 倒叙排列:后关注的在前
+        # 往下翻: ?created_at__lt=<上一页最后一条的 created_at>，走 (from_user, created_at) 联合索引
+        friendships = self.paginate_queryset(
+            Friendship.objects.filter(from_user_id=pk),  # 倒叙排列:后关注的在前
+        )
+        # 用户从缓存里批量取，当前用户是否关注了他们一条 query 查好
+        context = FriendshipService.hydrate(friendships, 'to_user', request.user)
         # 把查询出来的数据放入serializer，多条数据用many=True
-        serializer = FollowingSerializer(friendships, many=True)
+        serializer = FollowingSerializer(
+            friendships,
+            context={'request': request, **context},
+            many=True,
+        )
         return Response({
-            'followings': serializer.data
+            'followings': serializer.data,
+            'has_next_page': self.paginator.has_next_page,
         }, status=status.HTTP_200_OK,)
 
     @action(methods=['GET'], detail=True, permission_classes=[AllowAny])
     def followers(self, request, pk):
-        friendships = Friendship.objects.filter(to_user=pk).order_by('-created_at')
-        serializer = FollowerSerializer(friendships, many=True)
+        # 走 (to_user, created_at) 联合索引
+        friendships = self.paginate_queryset(Friendship.objects.filter(to_user_id=pk))
+        context = FriendshipService.hydrate(friendships, 'from_user', request.user)
+        serializer = FollowerSerializer(
+            friendships,
+            context={'request': request, **context},
+            many=True,
+        )
         return Response({
             'followers': serializer.data,
+            'has_next_page': self.paginator.has_next_page,
         }, status=status.HTTP_200_OK)
 
     # permission_class -> IsAuthenticated 必须是已经登陆的用户
@@ -80,8 +104,10 @@ class FriendshipViewSet(viewsets.GenericViewSet):
             }, status=status.HTTP_400_BAD_REQUEST)
 
         instance = serializer.save()
+        # 把被关注的人最近的 tweets 补到自己的 newsfeed 里 (异步)
+        NewsFeedServices.backfill_newsfeeds_on_follow(request.user.id, int(pk))
         return Response(
-            FollowingSerializer(instance).data,
+            FollowingSerializer(instance, context={'request': request}).data,
             status=status.HTTP_201_CREATED
         )
 
@@ -108,6 +134,9 @@ class FriendshipViewSet(viewsets.GenericViewSet):
             to_user=pk,
         ).delete()
         # deleted：一共删除了多少数据 后一个参数是一个哈希表
+        if deleted:
+            # 把被取关的人的 tweets 从自己的 newsfeed 里删掉 (异步)
+            NewsFeedServices.remove_newsfeeds_on_unfollow(request.user.id, int(pk))
         return Response({
             'success': True,
             'deleted': deleted
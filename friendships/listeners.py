@@ -0,0 +1,33 @@
+from django.db.models import F
+
+from accounts.models import UserProfile
+
+
+def _change_followers_count(friendship_model, user_id, delta):
+    if user_id is None:
+        return
+    # 用 F() 在数据库里原子地 +1/-1，不会因为并发的关注/取关覆盖掉彼此的结果
+    updated = UserProfile.objects.filter(user_id=user_id).update(
+        followers_count=F('followers_count') + delta,
+    )
+    if updated:
+        return
+    # profile 是懒创建的(见 accounts/models.py)，还没有的时候用真实的数量初始化
+    UserProfile.objects.get_or_create(
+        user_id=user_id,
+        defaults={
+            'followers_count': friendship_model.objects.filter(
+                to_user_id=user_id,
+            ).count(),
+        },
+    )
+
+
+def increase_followers_count(sender, instance, created, **kwargs):
+    if not created:
+        return
+    _change_followers_count(sender, instance.to_user_id, 1)
+
+
+def decrease_followers_count(sender, instance, **kwargs):
+    _change_followers_count(sender, instance.to_user_id, -1)
@@ -1,5 +1,7 @@
 from django.db import models
+from django.db.models.signals import post_delete, post_save
 from django.contrib.auth.models import User
+from friendships.listeners import decrease_followers_count, increase_followers_count
 
 
 class Friendship(models.Model):
@@ -35,3 +37,9 @@ class Friendship(models.Model):
     def __str__(self):
         # 等价形式 -> '{} followed {}'.format(self.from_user, self.to_user)
         return f'{self.from_user} followed {self.to_user}'
+
+
+# 关注/取关的时候更新被关注者的粉丝数
+# queryset.delete() 也会对每一条数据触发 post_delete
+post_save.connect(increase_followers_count, sender=Friendship)
+post_delete.connect(decrease_followers_count, sender=Friendship)
@@ -1,3 +1,4 @@
+from accounts.services import UserService
 from friendships.models import Friendship
 
 
@@ -34,3 +35,52 @@ class FriendshipService(object):
             to_user=user
         ).prefetch_related('from_user')
         return [friendship.from_user for friendship in friendships]
+
+    # 只需要 follower 的 id 的时候(比如 fanout)，不要把每个 User 都加载进内存
+    # MySQL 的 iterator() 不是流式的(会把整个结果读进内存)，按 id 做 keyset 分页，每次只取 chunk_size 条
+    # 不用 offset，翻到后面也不会越来越慢
+    @classmethod
+    def iter_follower_ids(cls, user_id, chunk_size=2000):
+        last_id = 0
+        while True:
+            rows = list(Friendship.objects.filter(
+                to_user_id=user_id,
+                id__gt=last_id,
+            ).order_by('id').values_list('id', 'from_user_id')[:chunk_size])
+            for _, from_user_id in rows:
+                yield from_user_id
+            if len(rows) < chunk_size:
+                return
+            last_id = rows[-1][0]
+
+    # 一页用户里当前用户关注了哪些，一条 query，走 from_user + to_user 的唯一索引
+    @classmethod
+    def get_followed_user_ids(cls, viewer, user_ids):
+        if viewer is None or not viewer.is_authenticated or not user_ids:
+            return set()
+        return set(Friendship.objects.filter(
+            from_user_id=viewer.id,
+            to_user_id__in=user_ids,
+        ).values_list('to_user_id', flat=True))
+
+    @classmethod
+    def hydrate(cls, friendships, user_field, viewer):
+        """
+        和 TweetService.hydrate 一样，一次性查好一页 friendships 序列化要用的数据
+        user_field 是要展示的那一边: followings 是 'to_user'，followers 是 'from_user'
+        - 用户: UserService 的对象缓存，一次 get_many (没命中的一条 query)，直接挂到 friendship 上
+        - 当前用户关注了这一页里的哪些人: 1 条 query
+        返回的 dict 要放进 serializer 的 context 里
+        """
+        user_id_field = '{}_id'.format(user_field)
+        user_ids = [getattr(friendship, user_id_field) for friendship in friendships]
+        users = UserService.get_by_ids(user_ids)
+        for friendship in friendships:
+            if getattr(friendship, user_id_field) is not None:
+                setattr(friendship, user_field, users.get(getattr(friendship, user_id_field)))
+        return {
+            'followed_user_ids': cls.get_followed_user_ids(viewer, [
+                user_id for user_id in user_ids if user_id is not None
+            ]),
+        }
+
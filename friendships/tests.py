@@ -1,3 +1,28 @@
-from django.test import TestCase
+from friendships.models import Friendship
+from friendships.services import FriendshipService
+from testing.testcases import TestCase
 
-# Create your tests here.
+
+class FriendshipServiceTests(TestCase):
+
+    def setUp(self):
+        self.user1 = self.create_user('user1')
+        self.user2 = self.create_user('user2')
+
+    def test_iter_follower_ids(self):
+        self.assertEqual(list(FriendshipService.iter_follower_ids(self.user1.id)), [])
+
+        followers = [self.create_user('follower{}'.format(i)) for i in range(5)]
+        for follower in followers:
+            Friendship.objects.create(from_user=follower, to_user=self.user1)
+        # 关注 user2 的不应该出现
+        Friendship.objects.create(from_user=self.user1, to_user=self.user2)
+
+        # 5 个 follower，每次取 2 条: 2 + 2 + 1，最后一页不满就不再查
+        with self.assertNumQueries(3):
+            follower_ids = list(FriendshipService.iter_follower_ids(self.user1.id, chunk_size=2))
+        self.assertEqual(follower_ids, [follower.id for follower in followers])
+        self.assertEqual(
+            list(FriendshipService.iter_follower_ids(self.user2.id)),
+            [self.user1.id],
+        )
@@ -0,0 +1,17 @@
+from django.contrib import admin
+from jobs.models import Job
+
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    list_display = (
+        'id',
+        'name',
+        'status',
+        'attempts',
+        'max_attempts',
+        'run_at',
+        'created_at',
+    )
+    list_filter = ('status', 'name')
+    date_hierarchy = 'created_at'
@@ -0,0 +1,28 @@
+from jobs import registry
+from jobs.services import JobService
+
+
+def job(name, max_attempts=None):
+    """
+    把一个函数注册成可以异步执行的 job，用法和 celery 的 task 类似:
+
+    @job(name='newsfeeds.fanout')
+    def fanout_newsfeeds_task(tweet_id):
+        ...
+
+    fanout_newsfeeds_task.delay(tweet_id=1)  -> 放进队列，由 worker 执行
+    fanout_newsfeeds_task(tweet_id=1)        -> 直接同步执行
+
+    注意 delay 只接受 kwargs，并且必须可以被 JSON 序列化
+    """
+    def decorator(func):
+        registry.register(name, func)
+
+        def delay(**kwargs):
+            return JobService.enqueue(name, kwargs, max_attempts=max_attempts)
+
+        func.job_name = name
+        func.delay = delay
+        return func
+
+    return decorator
@@ -0,0 +1,46 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.utils.module_loading import autodiscover_modules
+
+from jobs.services import JobService
+
+
+class Command(BaseCommand):
+    help = 'Worker that processes queued jobs from the jobs table'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Process every job that is currently due, then exit',
+        )
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument(
+            '--sleep',
+            type=float,
+            default=1.0,
+            help='Seconds to wait when the queue is empty',
+        )
+
+    def handle(self, *args, **options):
+        # import 每个 app 下的 tasks.py，让 @job 注册好对应的 handler
+        autodiscover_modules('tasks')
+
+        total = 0
+        while True:
+            processed, succeeded = JobService.run_pending_jobs(options['batch_size'])
+            total += processed
+            if processed and options['verbosity'] > 1:
+                self.stdout.write('processed {} jobs, {} succeeded'.format(
+                    processed,
+                    succeeded,
+                ))
+            if processed:
+                continue
+            if options['once']:
+                break
+            time.sleep(options['sleep'])
+
+        if options['verbosity'] > 0:
+            self.stdout.write('Done, processed {} jobs'.format(total))
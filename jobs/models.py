@@ -0,0 +1,46 @@
+from django.db import models
+from django.utils import timezone
+
+
+class Job(models.Model):
+    """
+    用数据库表当作任务队列(broker) -> 不依赖任何外部服务
+    web 进程只负责 insert 一条 Job，worker(python manage.py run_jobs) 负责领取和执行
+    """
+    STATUS_PENDING = 0
+    STATUS_RUNNING = 1
+    STATUS_SUCCEEDED = 2
+    # 重试次数用完之后进入 dead letter 状态，不会再被自动执行，留给人工排查
+    STATUS_DEAD = 3
+    STATUS_CHOICES = (
+        (STATUS_PENDING, 'pending'),
+        (STATUS_RUNNING, 'running'),
+        (STATUS_SUCCEEDED, 'succeeded'),
+        (STATUS_DEAD, 'dead'),
+    )
+
+    # name 对应用 @job 注册的 handler, payload 是调用 handler 时的 kwargs
+    name = models.CharField(max_length=128)
+    payload = models.JSONField(default=dict)
+    status = models.SmallIntegerField(choices=STATUS_CHOICES, default=STATUS_PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=5)
+    # pending 的时候表示最早可以执行的时间(重试的 backoff 就是把它往后推)
+    # running 的时候表示租约(lease)的到期时间，worker 挂掉之后任务会被重新领取
+    run_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        # worker 每次都是查 status + run_at <= now 的任务
+        index_together = (('status', 'run_at'),)
+        ordering = ('run_at',)
+
+    def __str__(self):
+        return '{} {} ({}) attempts={}'.format(
+            self.id,
+            self.name,
+            self.get_status_display(),
+            self.attempts,
+        )
@@ -0,0 +1,17 @@
+# job name -> handler function
+# 由 @job 装饰器在 import 的时候注册，worker 启动时会 import 所有 app 下的 tasks.py
+_handlers = {}
+
+
+class UnknownJobError(Exception):
+    pass
+
+
+def register(name, handler):
+    _handlers[name] = handler
+
+
+def get_handler(name):
+    if name not in _handlers:
+        raise UnknownJobError('No handler registered for job {}'.format(name))
+    return _handlers[name]
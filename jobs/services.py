@@ -0,0 +1,116 @@
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import F
+from django.utils import timezone
+
+from jobs import registry
+from jobs.models import Job
+
+# 所有的配置都可以在 settings 里覆盖
+DEFAULT_MAX_ATTEMPTS = 5
+# 第 n 次失败之后等待 base * 2^(n-1) 秒再重试，最多等待 max 秒
+DEFAULT_RETRY_BACKOFF_SECONDS = 10
+DEFAULT_RETRY_BACKOFF_MAX_SECONDS = 3600
+# worker 领取任务之后的租约时间，超时没有完成会被其他 worker 重新领取
+DEFAULT_LEASE_SECONDS = 300
+
+
+def _get_setting(name, default):
+    return getattr(settings, name, default)
+
+
+class JobService(object):
+
+    @classmethod
+    def enqueue(cls, name, payload, max_attempts=None, countdown=0):
+        # 测试环境(或者本地调试)下直接同步执行，不经过队列
+        if _get_setting('JOBS_ALWAYS_EAGER', False):
+            registry.get_handler(name)(**payload)
+            return None
+
+        if max_attempts is None:
+            max_attempts = _get_setting('JOBS_MAX_ATTEMPTS', DEFAULT_MAX_ATTEMPTS)
+        return Job.objects.create(
+            name=name,
+            payload=payload,
+            max_attempts=max_attempts,
+            run_at=timezone.now() + timedelta(seconds=countdown),
+        )
+
+    @classmethod
+    def get_retry_delay(cls, attempts):
+        base = _get_setting('JOBS_RETRY_BACKOFF_SECONDS', DEFAULT_RETRY_BACKOFF_SECONDS)
+        max_delay = _get_setting(
+            'JOBS_RETRY_BACKOFF_MAX_SECONDS',
+            DEFAULT_RETRY_BACKOFF_MAX_SECONDS,
+        )
+        return timedelta(seconds=min(base * 2 ** max(attempts - 1, 0), max_delay))
+
+    @classmethod
+    def claim_jobs(cls, limit):
+        """
+        领取最多 limit 个到期的任务
+        用 UPDATE ... WHERE run_at <= now 做乐观锁，多个 worker 同时跑的时候
+        同一个任务只有一个 worker 能 update 成功，不依赖 SELECT FOR UPDATE
+        """
+        now = timezone.now()
+        lease_until = now + timedelta(
+            seconds=_get_setting('JOBS_LEASE_SECONDS', DEFAULT_LEASE_SECONDS),
+        )
+        # running 但是租约已经过期的任务说明 worker 挂了，也要重新领取
+        candidate_ids = list(Job.objects.filter(
+            status__in=[Job.STATUS_PENDING, Job.STATUS_RUNNING],
+            run_at__lte=now,
+        ).order_by('run_at').values_list('id', flat=True)[:limit])
+
+        claimed_ids = []
+        for job_id in candidate_ids:
+            updated = Job.objects.filter(
+                id=job_id,
+                status__in=[Job.STATUS_PENDING, Job.STATUS_RUNNING],
+                run_at__lte=now,
+            ).update(
+                status=Job.STATUS_RUNNING,
+                run_at=lease_until,
+                attempts=F('attempts') + 1,
+            )
+            if updated:
+                claimed_ids.append(job_id)
+        return list(Job.objects.filter(id__in=claimed_ids).order_by('id'))
+
+    @classmethod
+    def run_job(cls, job):
+        """
+        执行一个已经被领取(running)的任务，返回是否执行成功
+        更新状态的时候带上 run_at(租约) 作为条件，防止租约过期后覆盖其他 worker 的结果
+        """
+        leased = Job.objects.filter(id=job.id, run_at=job.run_at)
+        try:
+            handler = registry.get_handler(job.name)
+            handler(**job.payload)
+        except registry.UnknownJobError:
+            leased.update(status=Job.STATUS_DEAD, last_error=traceback.format_exc())
+            return False
+        except Exception:
+            error = traceback.format_exc()
+            if job.attempts >= job.max_attempts:
+                leased.update(status=Job.STATUS_DEAD, last_error=error)
+            else:
+                leased.update(
+                    status=Job.STATUS_PENDING,
+                    run_at=timezone.now() + cls.get_retry_delay(job.attempts),
+                    last_error=error,
+                )
+            return False
+
+        leased.update(status=Job.STATUS_SUCCEEDED, last_error=None)
+        return True
+
+    @classmethod
+    def run_pending_jobs(cls, limit=100):
+        # 返回 (处理的任务数, 成功的任务数)
+        jobs = cls.claim_jobs(limit)
+        succeeded = sum(1 for job in jobs if cls.run_job(job))
+        return len(jobs), succeeded
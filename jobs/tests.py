@@ -0,0 +1,111 @@
+from django.core.management import call_command
+from django.test import override_settings
+from django.utils import timezone
+
+from friendships.models import Friendship
+from jobs.decorators import job
+from jobs.models import Job
+from jobs.services import JobService
+from testing.testcases import TestCase
+
+POST_TWEETS_URL = '/api/tweets/'
+
+flaky_calls = []
+
+
+@job(name='jobs.tests.flaky', max_attempts=2)
+def flaky_task(value):
+    flaky_calls.append(value)
+    raise ValueError('flaky')
+
+
+@job(name='jobs.tests.echo')
+def echo_task(value):
+    flaky_calls.append(value)
+
+
+# 这里要测试真正的队列，所以关掉 eager 模式
+@override_settings(JOBS_ALWAYS_EAGER=False)
+class JobServiceTests(TestCase):
+
+    def setUp(self):
+        flaky_calls.clear()
+
+    def test_delay_enqueues_job(self):
+        job_instance = echo_task.delay(value=1)
+        self.assertEqual(Job.objects.count(), 1)
+        self.assertEqual(job_instance.name, 'jobs.tests.echo')
+        self.assertEqual(job_instance.payload, {'value': 1})
+        self.assertEqual(job_instance.status, Job.STATUS_PENDING)
+        self.assertEqual(flaky_calls, [])
+
+        processed, succeeded = JobService.run_pending_jobs()
+        self.assertEqual((processed, succeeded), (1, 1))
+        self.assertEqual(flaky_calls, [1])
+        job_instance.refresh_from_db()
+        self.assertEqual(job_instance.status, Job.STATUS_SUCCEEDED)
+        self.assertEqual(job_instance.attempts, 1)
+
+        # 已经完成的任务不会被重复执行
+        self.assertEqual(JobService.run_pending_jobs(), (0, 0))
+
+    def test_retry_and_dead_letter(self):
+        job_instance = flaky_task.delay(value='x')
+        self.assertEqual(JobService.run_pending_jobs(), (1, 0))
+        job_instance.refresh_from_db()
+        self.assertEqual(job_instance.status, Job.STATUS_PENDING)
+        self.assertEqual(job_instance.attempts, 1)
+        self.assertIn('ValueError', job_instance.last_error)
+        # backoff 之后才会重试
+        self.assertGreater(job_instance.run_at, timezone.now())
+        self.assertEqual(JobService.run_pending_jobs(), (0, 0))
+
+        Job.objects.filter(id=job_instance.id).update(run_at=timezone.now())
+        self.assertEqual(JobService.run_pending_jobs(), (1, 0))
+        job_instance.refresh_from_db()
+        self.assertEqual(job_instance.status, Job.STATUS_DEAD)
+        self.assertEqual(job_instance.attempts, 2)
+        self.assertEqual(flaky_calls, ['x', 'x'])
+
+        # dead letter 不会再被执行
+        Job.objects.filter(id=job_instance.id).update(run_at=timezone.now())
+        self.assertEqual(JobService.run_pending_jobs(), (0, 0))
+
+    def test_unknown_job_goes_to_dead_letter(self):
+        job_instance = JobService.enqueue('jobs.tests.not_registered', {})
+        JobService.run_pending_jobs()
+        job_instance.refresh_from_db()
+        self.assertEqual(job_instance.status, Job.STATUS_DEAD)
+
+    def test_expired_lease_is_reclaimed(self):
+        job_instance = echo_task.delay(value=2)
+        claimed = JobService.claim_jobs(10)
+        self.assertEqual(len(claimed), 1)
+        # 租约没过期之前其他 worker 领取不到
+        self.assertEqual(JobService.claim_jobs(10), [])
+        # 模拟 worker 挂掉，租约过期
+        Job.objects.filter(id=job_instance.id).update(run_at=timezone.now())
+        claimed = JobService.claim_jobs(10)
+        self.assertEqual(len(claimed), 1)
+        self.assertEqual(claimed[0].attempts, 2)
+        self.assertEqual(JobService.run_job(claimed[0]), True)
+
+    def test_tweet_fanout_runs_in_worker(self):
+        user1, user1_client = self.create_user_and_client('user1')
+        user2 = self.create_user('user2')
+        Friendship.objects.create(from_user=user2, to_user=user1)
+
+        response = user1_client.post(POST_TWEETS_URL, {'content': 'Hello World'})
+        self.assertEqual(response.status_code, 201)
+        # 请求返回的时候还没有 fanout
+        self.assertEqual(self.count_newsfeeds(), 0)
+        self.assertEqual(Job.objects.filter(name='newsfeeds.fanout').count(), 1)
+
+        call_command('run_jobs', '--once', verbosity=0)
+        self.assertEqual(self.count_newsfeeds(), 2)
+        self.assertEqual(
+            self.get_newsfeeds(user2).filter(tweet_id=response.data['id']).exists(),
+            True,
+        )
+        job_instance = Job.objects.get(name='newsfeeds.fanout')
+        self.assertEqual(job_instance.status, Job.STATUS_SUCCEEDED)
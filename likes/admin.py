@@ -1,5 +1,5 @@
 from django.contrib import admin
-from likes.models import Like
+from likes.models import Like, LikesCountShard
 
 
 @admin.register(Like)
@@ -13,3 +13,9 @@ class LikeAdmin(admin.ModelAdmin):
     )
     list_filter = ('content_type',)
     date_hierarchy = 'created_at'
+
+
+@admin.register(LikesCountShard)
+class LikesCountShardAdmin(admin.ModelAdmin):
+    list_display = ('content_type', 'object_id', 'shard', 'count')
+    list_filter = ('content_type',)
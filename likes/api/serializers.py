@@ -1,9 +1,11 @@
 from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
 from rest_framework import serializers
 from rest_framework.exceptions import ValidationError
 from accounts.api.serializers import UserSerializer
 from comments.models import Comment
 from likes.models import Like
+from likes.services import LikeService
 from tweets.models import Tweet
 
 
@@ -51,12 +53,17 @@ class LikeSerializerForCreate(BaseLikeSerializerForCreateAndCancel):
     def get_or_create(self):
         validated_data = self.validated_data
         model_class = self._get_model_class(validated_data)
-        return Like.objects.get_or_create(
-            content_type=ContentType.objects.get_for_model(model_class),
-            object_id=validated_data['object_id'],
-            # 从context里取出当前user
-            user=self.context['request'].user,
-        )
+        # like 和点赞数在同一个事务里，不会出现有 like 但是点赞数没有加上的情况
+        with transaction.atomic():
+            instance, created = Like.objects.get_or_create(
+                content_type=ContentType.objects.get_for_model(model_class),
+                object_id=validated_data['object_id'],
+                # 从context里取出当前user
+                user=self.context['request'].user,
+            )
+            if created:
+                LikeService.change_likes_count(model_class, validated_data['object_id'], 1)
+        return instance, created
 
 
 class LikeSerializerForCancel(BaseLikeSerializerForCreateAndCancel):
@@ -67,9 +74,14 @@ class LikeSerializerForCancel(BaseLikeSerializerForCreateAndCancel):
         """
         model_class = self._get_model_class(self.validated_data)
 
-        # filter之后获得了queryset -> 调用delete方法删除Object
-        Like.objects.filter(
-            content_type=ContentType.objects.get_for_model(model_class),
-            object_id=self.validated_data['object_id'],
-            user=self.context['request'].user,
-        ).delete()
+        with transaction.atomic():
+            # filter之后获得了queryset -> 调用delete方法删除Object
+            deleted, _ = Like.objects.filter(
+                content_type=ContentType.objects.get_for_model(model_class),
+                object_id=self.validated_data['object_id'],
+                user=self.context['request'].user,
+            ).delete()
+            # 真的删掉了才减，重复取消不会把点赞数减成负数
+            if deleted:
+                LikeService.change_likes_count(model_class, self.validated_data['object_id'], -deleted)
+        return deleted
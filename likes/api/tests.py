@@ -1,3 +1,4 @@
+from likes.services import LikeService
 from testing.testcases import TestCase
 
 
@@ -135,6 +136,31 @@ class LikeApiTests(TestCase):
         self.assertEqual(tweet.like_set.count(), 0)
         self.assertEqual(comment.like_set.count(), 0)
 
+    def test_likes_count(self):
+        tweet = self.create_tweet(self.user1)
+        comment = self.create_comment(self.user2, tweet)
+        like_tweet_data = {'content_type': 'tweet', 'object_id': tweet.id}
+        like_comment_data = {'content_type': 'comment', 'object_id': comment.id}
+
+        # 重复点赞不会重复计数
+        self.user1_client.post(LIKE_BASE_URL, like_tweet_data)
+        self.user1_client.post(LIKE_BASE_URL, like_tweet_data)
+        self.user2_client.post(LIKE_BASE_URL, like_tweet_data)
+        self.user1_client.post(LIKE_BASE_URL, like_comment_data)
+        tweet.refresh_from_db()
+        comment.refresh_from_db()
+        self.assertEqual(LikeService.get_likes_count(tweet), 2)
+        self.assertEqual(LikeService.get_likes_count(comment), 1)
+
+        # 重复取消不会减成负数
+        self.user1_client.post(LIKE_CANCEL_URL, like_tweet_data)
+        self.user1_client.post(LIKE_CANCEL_URL, like_tweet_data)
+        self.user2_client.post(LIKE_CANCEL_URL, like_comment_data)
+        tweet.refresh_from_db()
+        comment.refresh_from_db()
+        self.assertEqual(LikeService.get_likes_count(tweet), 1)
+        self.assertEqual(LikeService.get_likes_count(comment), 1)
+
     def test_likes_in_comments_api(self):
         tweet = self.create_tweet(self.user1)
         comment = self.create_comment(self.user1, tweet)
@@ -0,0 +1,24 @@
+# likes 相关配置的默认值，都可以在 settings 里用同名的配置覆盖
+
+# 点赞数 write-behind: 点赞/取消点赞的时候不直接 UPDATE 点赞数，先在缓存里累加，
+# 由 flush_likes_count 定期批量写回数据库，避免热门 tweet 的那一行被大量并发 UPDATE 锁住
+LIKES_COUNT_WRITE_BEHIND = False
+# 累加用的是哪个 cache，必须是多个进程共享的(memcached/redis)，并且 incr 是原子的
+LIKES_COUNT_CACHE_ALIAS = 'default'
+# 每次 flush 最多处理多少个有改动的 object，每个 model 一条 UPDATE
+LIKES_COUNT_FLUSH_BATCH_SIZE = 500
+# 有改动的 object 的登记在缓存里保留多久，登记丢了(比如进程在登记到一半的时候挂了)
+# 过期之后下一次点赞会重新登记
+LIKES_COUNT_DIRTY_TIMEOUT = 600
+# 还没有写回的点赞 / 取消点赞次数在缓存里保留多久，每次 flush 之后续期
+# 一定要比 flush 的间隔长很多，flush 停了超过这个时间的话没写回的增量会丢掉
+LIKES_COUNT_PENDING_TIMEOUT = 24 * 3600
+
+# 同一个 tweet 一分钟之内的点赞/取消点赞超过这个数量，之后的点赞数改为记在 LikesCountShard 里
+LIKES_COUNT_SHARDING_THRESHOLD = 300
+# 每个热门 object 的点赞数分散在多少行上
+LIKES_COUNT_SHARDS = 16
+# shard 加起来的总数在缓存里保存多久，热门 object 的点赞数稍微滞后一点没有关系
+LIKES_COUNT_SHARDED_CACHE_TIMEOUT = 5
+# 某个 object 是不是已经切换到 shard 了，在缓存里保存多久
+LIKES_COUNT_SHARDED_FLAG_TIMEOUT = 3600
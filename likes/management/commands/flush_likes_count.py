@@ -0,0 +1,31 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from likes.services import LikeService
+
+
+class Command(BaseCommand):
+    help = 'Write the likes_count deltas buffered in the cache back to the database'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=None)
+        parser.add_argument(
+            '--interval',
+            type=float,
+            default=None,
+            help='Keep flushing every INTERVAL seconds instead of exiting',
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            started_at = time.monotonic()
+            flushed = LikeService.flush_pending_likes_counts(options['batch_size'])
+            if options['verbosity'] > 0:
+                self.stdout.write('Flushed likes_count of {} objects in {:.2f}s'.format(
+                    flushed,
+                    time.monotonic() - started_at,
+                ))
+            if options['interval'] is None:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,23 @@
+# Generated by Django 3.1.3 on 2026-10-18 11:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('likes', '0002_likescountshard'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='like',
+            name='object_id',
+            field=models.PositiveBigIntegerField(),
+        ),
+        migrations.AlterField(
+            model_name='likescountshard',
+            name='object_id',
+            field=models.PositiveBigIntegerField(),
+        ),
+    ]
@@ -5,7 +5,8 @@ from django.db import models
 
 
 class Like(models.Model):
-    object_id = models.PositiveIntegerField()
+    # tweet 的 id 是 64 位的
+    object_id = models.PositiveBigIntegerField()
     content_type = models.ForeignKey(
         ContentType,
         on_delete=models.SET_NULL,
@@ -28,3 +29,30 @@ class Like(models.Model):
             self.content_type,
             self.object_id,
         )
+
+
+class LikesCountShard(models.Model):
+    """
+    热门 object 的点赞数分散记在多行上，每次点赞随机挑一行 +1，避免所有的点赞都去锁同一行
+    object 的点赞数 = object.likes_count + 所有 shard 的 count 之和
+    """
+    content_type = models.ForeignKey(
+        ContentType,
+        on_delete=models.SET_NULL,
+        null=True,
+    )
+    object_id = models.PositiveBigIntegerField()
+    shard = models.PositiveSmallIntegerField()
+    # 取消点赞也是随机挑一行 -1，单独一行可能是负数，加起来是对的
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = (('content_type', 'object_id', 'shard'),)
+
+    def __str__(self):
+        return '{} {} shard {}: {}'.format(
+            self.content_type,
+            self.object_id,
+            self.shard,
+            self.count,
+        )
@@ -1,5 +1,17 @@
-from likes.models import Like
+import random
+import time
+from collections import defaultdict
+
+from django.apps import apps
+from django.conf import settings
+from django.contrib.auth.models import User
 from django.contrib.contenttypes.models import ContentType
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Sum, Value, When
+
+from likes import constants
+from likes.models import Like, LikesCountShard
 
 
 class LikeService(object):
@@ -15,3 +27,345 @@ class LikeService(object):
             object_id=target.id,
             user=user,
         ).exists()
+
+    @classmethod
+    def attach_users(cls, likes):
+        # 一组 likes 的用户一条 query 查出来，直接挂到 like.user 上，序列化的时候不用每个 like 都查一遍
+        users = User.objects.in_bulk({like.user_id for like in likes if like.user_id is not None})
+        for like in likes:
+            if like.user_id is not None:
+                like.user = users.get(like.user_id)
+
+    @classmethod
+    def get_liked_object_ids(cls, user, model_class, object_ids):
+        """
+        批量判断 user 有没有点赞 -> 一条 query 返回 object_ids 里 user 点过赞的 id 的 set
+        走 unique_together(user, content_type, object_id) 的索引
+        """
+        if user.is_anonymous or not object_ids:
+            return set()
+
+        return set(Like.objects.filter(
+            content_type=ContentType.objects.get_for_model(model_class),
+            object_id__in=object_ids,
+            user=user,
+        ).values_list('object_id', flat=True))
+
+    # ---------------------------------------------------------------------
+    # 点赞数 write-behind (LIKES_COUNT_WRITE_BEHIND 打开的时候)
+    # likes:pending:incr:<model>:<id> / likes:pending:decr:<model>:<id>
+    #                            -> 还没有写回数据库的点赞 / 取消点赞次数，cache.incr 原子累加
+    #                               增量 = incr - decr，分成两个只增不减的计数器是因为 memcached 的
+    #                               decr 减到 0 以下会变成 0，一个计数器存负数会丢掉取消点赞
+    # likes:dirty:<model>:<id>   -> 这个 object 已经登记过有增量了
+    # likes:slot:<n>             -> 第 n 个登记的 (model, id)，n 由 likes:seq 递增得到
+    # flush 的时候从 likes:flushed 往后按顺序处理登记，每个 model 一条 UPDATE 写回，再把读到的次数减掉
+    # 计数器有过期时间(LIKES_COUNT_PENDING_TIMEOUT)，每次 flush 之后续期，不再有改动的 object 的 key 会自己过期
+    # 注意: 写回数据库之后、减掉增量之前进程挂掉的话，这部分增量会被重复写回一次
+    # ---------------------------------------------------------------------
+    SEQ_KEY = 'likes:seq'
+    FLUSHED_KEY = 'likes:flushed'
+
+    @classmethod
+    def is_write_behind(cls):
+        return getattr(
+            settings,
+            'LIKES_COUNT_WRITE_BEHIND',
+            constants.LIKES_COUNT_WRITE_BEHIND,
+        )
+
+    @classmethod
+    def get_cache(cls):
+        return caches[getattr(
+            settings,
+            'LIKES_COUNT_CACHE_ALIAS',
+            constants.LIKES_COUNT_CACHE_ALIAS,
+        )]
+
+    @classmethod
+    def _get_pending_keys(cls, label, object_id):
+        # (点赞次数的 key, 取消点赞次数的 key)
+        return (
+            'likes:pending:incr:{}:{}'.format(label, object_id),
+            'likes:pending:decr:{}:{}'.format(label, object_id),
+        )
+
+    @classmethod
+    def _get_dirty_key(cls, label, object_id):
+        return 'likes:dirty:{}:{}'.format(label, object_id)
+
+    @classmethod
+    def _get_slot_key(cls, seq):
+        return 'likes:slot:{}'.format(seq)
+
+    @classmethod
+    def change_likes_count(cls, model_class, object_id, delta):
+        # 点赞太快的热门 object 改为随机更新一个 shard，分散行锁
+        if cls._supports_sharding(model_class) and (
+            cls.is_likes_count_sharded(model_class, object_id)
+            or cls._passes_sharding_threshold(model_class, object_id)
+        ):
+            cls._change_sharded_likes_count(model_class, object_id, delta)
+            return
+
+        if not cls.is_write_behind():
+            # F() -> UPDATE ... SET likes_count = likes_count + 1，并发点赞不会互相覆盖
+            model_class.objects.filter(id=object_id).update(
+                likes_count=F('likes_count') + delta,
+            )
+            cls._invalidate_object_cache(model_class, [object_id])
+            return
+
+        # like 的写入回滚了的话增量不能留在缓存里(flush 的时候会写进数据库)，所以等事务提交之后再加
+        # 不在事务里的时候 on_commit 会立即执行
+        transaction.on_commit(lambda: cls._add_pending_likes_count(model_class, object_id, delta))
+
+    @classmethod
+    def _add_pending_likes_count(cls, model_class, object_id, delta):
+        cache = cls.get_cache()
+        label = model_class._meta.label_lower
+        incr_key, decr_key = cls._get_pending_keys(label, object_id)
+        key = incr_key if delta > 0 else decr_key
+        cache.add(key, 0, timeout=cls._get_setting('LIKES_COUNT_PENDING_TIMEOUT'))
+        try:
+            cache.incr(key, abs(delta))
+        except ValueError:
+            # add 和 incr 之间 key 被淘汰了，直接写数据库
+            model_class.objects.filter(id=object_id).update(
+                likes_count=F('likes_count') + delta,
+            )
+            cls._invalidate_object_cache(model_class, [object_id])
+            return
+
+        # 每个 object 在两次 flush 之间只登记一次
+        dirty_timeout = getattr(
+            settings,
+            'LIKES_COUNT_DIRTY_TIMEOUT',
+            constants.LIKES_COUNT_DIRTY_TIMEOUT,
+        )
+        if cache.add(cls._get_dirty_key(label, object_id), 1, timeout=dirty_timeout):
+            cache.add(cls.SEQ_KEY, 0, timeout=None)
+            seq = cache.incr(cls.SEQ_KEY)
+            cache.set(cls._get_slot_key(seq), (label, object_id), timeout=None)
+
+    @classmethod
+    def _invalidate_object_cache(cls, model_class, object_ids):
+        # Tweet 整个对象是缓存起来的(TweetService.get_by_ids)，数据库里的点赞数变了要让缓存失效
+        # import 写在里面避免循环依赖
+        from tweets.models import Tweet
+        from tweets.services import TweetService
+        if model_class is Tweet:
+            TweetService.invalidate_cache(object_ids)
+
+    @classmethod
+    def get_pending_likes_counts(cls, model_class, object_ids):
+        # {object_id: 还没有写回数据库的增量}，读点赞数的时候要加上
+        if not cls.is_write_behind() or not object_ids:
+            return {}
+        label = model_class._meta.label_lower
+        keys = {object_id: cls._get_pending_keys(label, object_id) for object_id in object_ids}
+        counts = cls.get_cache().get_many([key for pair in keys.values() for key in pair])
+        pending = {}
+        for object_id, (incr_key, decr_key) in keys.items():
+            delta = counts.get(incr_key, 0) - counts.get(decr_key, 0)
+            if delta:
+                pending[object_id] = delta
+        return pending
+
+    @classmethod
+    def get_likes_counts(cls, objects):
+        """
+        objects 是同一个 model 的一组 object，返回 {id: 点赞数}
+        点赞数 = likes_count + 还没有写回数据库的增量 + shard 加起来的总数
+        不管多少个 object，最多一次 get_many 加上一条 query
+        """
+        if not objects:
+            return {}
+        model_class = objects[0].__class__
+        pending = cls.get_pending_likes_counts(model_class, [obj.id for obj in objects])
+        sharded = cls.get_sharded_likes_counts(model_class, [
+            obj.id
+            for obj in objects
+            if getattr(obj, 'likes_count_sharded', False)
+        ])
+        return {
+            obj.id: obj.likes_count + pending.get(obj.id, 0) + sharded.get(obj.id, 0)
+            for obj in objects
+        }
+
+    @classmethod
+    def get_likes_count(cls, obj):
+        return cls.get_likes_counts([obj])[obj.id]
+
+    @classmethod
+    def flush_pending_likes_counts(cls, batch_size=None):
+        """
+        把缓存里累加的点赞数增量批量写回数据库，返回写回了多少个 object
+        同一时间只能有一个 flush 在跑(由定时任务 python manage.py flush_likes_count 调用)
+        """
+        if batch_size is None:
+            batch_size = getattr(
+                settings,
+                'LIKES_COUNT_FLUSH_BATCH_SIZE',
+                constants.LIKES_COUNT_FLUSH_BATCH_SIZE,
+            )
+        cache = cls.get_cache()
+        seq = cache.get(cls.SEQ_KEY) or 0
+        flushed = cache.get(cls.FLUSHED_KEY) or 0
+        if seq < flushed:
+            # likes:seq 被淘汰之后重新从 1 开始计数了
+            flushed = 0
+        total = 0
+        while flushed < seq:
+            end = min(seq, flushed + batch_size)
+            slot_keys = [cls._get_slot_key(n) for n in range(flushed + 1, end + 1)]
+            targets = set(cache.get_many(slot_keys).values())
+            # 先去掉登记再读增量: 读完之后的点赞会重新登记，下一次 flush 再处理
+            cache.delete_many([cls._get_dirty_key(label, object_id) for label, object_id in targets])
+            pending_keys = {target: cls._get_pending_keys(*target) for target in targets}
+            counts = cache.get_many([key for pair in pending_keys.values() for key in pair])
+            deltas_by_label = defaultdict(dict)
+            for (label, object_id), (incr_key, decr_key) in pending_keys.items():
+                delta = counts.get(incr_key, 0) - counts.get(decr_key, 0)
+                if delta:
+                    deltas_by_label[label][object_id] = delta
+
+            for label, deltas in deltas_by_label.items():
+                # 一条 UPDATE: likes_count = likes_count + CASE id WHEN ... THEN delta END
+                apps.get_model(label).objects.filter(id__in=deltas.keys()).update(
+                    likes_count=F('likes_count') + Case(
+                        *[When(id=object_id, then=Value(delta)) for object_id, delta in deltas.items()],
+                        default=Value(0),
+                        output_field=IntegerField(),
+                    ),
+                )
+                cls._invalidate_object_cache(apps.get_model(label), deltas.keys())
+                total += len(deltas)
+
+            # 只减掉读到的次数，flush 过程中新增的点赞留到下一次
+            # 两个计数器都只增不减，读到的次数不会比现在的值大，不会被 memcached 截断到 0
+            pending_timeout = cls._get_setting('LIKES_COUNT_PENDING_TIMEOUT')
+            for key, count in counts.items():
+                if not count:
+                    continue
+                try:
+                    cache.decr(key, count)
+                except ValueError:
+                    # 过期了，说明 flush 太久没有跑，这部分增量已经丢了
+                    continue
+                cache.touch(key, pending_timeout)
+
+            cache.delete_many(slot_keys)
+            cache.set(cls.FLUSHED_KEY, end, timeout=None)
+            flushed = end
+        return total
+
+    # ---------------------------------------------------------------------
+    # 热门 object 的点赞数分散记在 LikesCountShard 的多行上
+    # likes:rate:<model>:<id>:<minute>  -> 这一分钟的点赞/取消点赞次数，超过阈值就切换到 shard
+    # likes:sharded:<model>:<id>        -> 是否已经切换到 shard 了(object.likes_count_sharded 的缓存)
+    # likes:sharded_total:<model>:<id>  -> shard 加起来的总数
+    # 切换之前的点赞数留在 object.likes_count 里，之后的记在 shard 上，所以切换的时候不需要搬数据
+    # ---------------------------------------------------------------------
+    @classmethod
+    def _supports_sharding(cls, model_class):
+        # 只有有 likes_count_sharded 字段的 model(Tweet)会自动切换
+        return any(field.name == 'likes_count_sharded' for field in model_class._meta.fields)
+
+    @classmethod
+    def _get_setting(cls, name):
+        return getattr(settings, name, getattr(constants, name))
+
+    @classmethod
+    def is_likes_count_sharded(cls, model_class, object_id):
+        cache = cls.get_cache()
+        key = 'likes:sharded:{}:{}'.format(model_class._meta.label_lower, object_id)
+        sharded = cache.get(key)
+        if sharded is None:
+            sharded = model_class.objects.filter(
+                id=object_id,
+                likes_count_sharded=True,
+            ).exists()
+            cache.set(key, sharded, cls._get_setting('LIKES_COUNT_SHARDED_FLAG_TIMEOUT'))
+        return sharded
+
+    @classmethod
+    def _passes_sharding_threshold(cls, model_class, object_id):
+        cache = cls.get_cache()
+        key = 'likes:rate:{}:{}:{}'.format(
+            model_class._meta.label_lower,
+            object_id,
+            int(time.time() // 60),
+        )
+        cache.add(key, 0, timeout=120)
+        try:
+            rate = cache.incr(key)
+        except ValueError:
+            return False
+        if rate < cls._get_setting('LIKES_COUNT_SHARDING_THRESHOLD'):
+            return False
+        cls.start_sharding(model_class, object_id)
+        return True
+
+    @classmethod
+    def start_sharding(cls, model_class, object_id):
+        model_class.objects.filter(id=object_id).update(likes_count_sharded=True)
+        cls._invalidate_object_cache(model_class, [object_id])
+        cls._create_shards(model_class, object_id)
+        cls.get_cache().set(
+            'likes:sharded:{}:{}'.format(model_class._meta.label_lower, object_id),
+            True,
+            cls._get_setting('LIKES_COUNT_SHARDED_FLAG_TIMEOUT'),
+        )
+
+    @classmethod
+    def _create_shards(cls, model_class, object_id):
+        content_type = ContentType.objects.get_for_model(model_class)
+        LikesCountShard.objects.bulk_create([
+            LikesCountShard(content_type=content_type, object_id=object_id, shard=shard)
+            for shard in range(cls._get_setting('LIKES_COUNT_SHARDS'))
+        ], ignore_conflicts=True)
+
+    @classmethod
+    def _change_sharded_likes_count(cls, model_class, object_id, delta):
+        queryset = LikesCountShard.objects.filter(
+            content_type=ContentType.objects.get_for_model(model_class),
+            object_id=object_id,
+            shard=random.randrange(cls._get_setting('LIKES_COUNT_SHARDS')),
+        )
+        if queryset.update(count=F('count') + delta):
+            return
+        # shard 的行还没有建好(比如调大了 LIKES_COUNT_SHARDS)
+        cls._create_shards(model_class, object_id)
+        queryset.update(count=F('count') + delta)
+
+    @classmethod
+    def get_sharded_likes_counts(cls, model_class, object_ids):
+        # {object_id: shard 加起来的总数}，缓存里没有的一条 GROUP BY query 查出来
+        if not object_ids:
+            return {}
+        cache = cls.get_cache()
+        label = model_class._meta.label_lower
+        keys = {
+            'likes:sharded_total:{}:{}'.format(label, object_id): object_id
+            for object_id in object_ids
+        }
+        totals = {keys[key]: total for key, total in cache.get_many(keys.keys()).items()}
+        missing_ids = [object_id for object_id in object_ids if object_id not in totals]
+        if not missing_ids:
+            return totals
+
+        rows = dict(LikesCountShard.objects.filter(
+            content_type=ContentType.objects.get_for_model(model_class),
+            object_id__in=missing_ids,
+        ).values('object_id').annotate(total=Sum('count')).values_list('object_id', 'total'))
+        missing = {object_id: rows.get(object_id) or 0 for object_id in missing_ids}
+        cache.set_many(
+            {
+                'likes:sharded_total:{}:{}'.format(label, object_id): total
+                for object_id, total in missing.items()
+            },
+            cls._get_setting('LIKES_COUNT_SHARDED_CACHE_TIMEOUT'),
+        )
+        totals.update(missing)
+        return totals
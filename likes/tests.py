@@ -1,3 +1,131 @@
-from django.test import TestCase
+from io import StringIO
 
-# Create your tests here.
+from django.core.management import call_command
+from django.db import transaction
+from django.test import override_settings
+
+from likes.models import LikesCountShard
+from likes.services import LikeService
+from testing.testcases import TestCase
+
+
+@override_settings(LIKES_COUNT_WRITE_BEHIND=True)
+class LikesCountWriteBehindTests(TestCase):
+
+    def setUp(self):
+        self.user1 = self.create_user('user1')
+        self.user2 = self.create_user('user2')
+        self.tweet = self.create_tweet(self.user1)
+        self.comment = self.create_comment(self.user2, self.tweet)
+
+    def test_buffer_and_flush(self):
+        self.create_like(self.user1, self.tweet)
+        self.create_like(self.user2, self.tweet)
+        self.create_like(self.user1, self.comment)
+        LikeService.change_likes_count(self.tweet.__class__, self.tweet.id, -1)
+
+        # 还没有写回数据库，读的时候加上增量
+        self.tweet.refresh_from_db()
+        self.assertEqual(self.tweet.likes_count, 0)
+        self.assertEqual(LikeService.get_likes_count(self.tweet), 1)
+        self.assertEqual(LikeService.get_likes_count(self.comment), 1)
+
+        with self.assertNumQueries(2):
+            self.assertEqual(LikeService.flush_pending_likes_counts(), 2)
+        self.tweet.refresh_from_db()
+        self.comment.refresh_from_db()
+        self.assertEqual(self.tweet.likes_count, 1)
+        self.assertEqual(self.comment.likes_count, 1)
+        self.assertEqual(LikeService.get_likes_count(self.tweet), 1)
+
+        # 没有新的增量的时候什么都不做，新的增量会重新登记
+        self.assertEqual(LikeService.flush_pending_likes_counts(), 0)
+        self.create_like(self.user2, self.comment)
+        out = StringIO()
+        call_command('flush_likes_count', stdout=out)
+        self.assertIn('Flushed likes_count of 1 objects', out.getvalue())
+        self.comment.refresh_from_db()
+        self.assertEqual(self.comment.likes_count, 2)
+
+    def test_unlike_after_flush(self):
+        # 点赞的 +1 已经写回数据库之后再取消点赞，-1 不能丢
+        self.create_like(self.user2, self.tweet)
+        self.assertEqual(LikeService.flush_pending_likes_counts(), 1)
+        LikeService.change_likes_count(self.tweet.__class__, self.tweet.id, -1)
+        self.tweet.refresh_from_db()
+        self.assertEqual(self.tweet.likes_count, 1)
+        self.assertEqual(LikeService.get_likes_count(self.tweet), 0)
+
+        # 两个计数器都不会小于 0 (memcached 会把负数截断成 0)
+        cache = LikeService.get_cache()
+        keys = LikeService._get_pending_keys('tweets.tweet', self.tweet.id)
+        self.assertEqual([cache.get(key) for key in keys], [0, 1])
+
+        self.assertEqual(LikeService.flush_pending_likes_counts(), 1)
+        self.tweet.refresh_from_db()
+        self.assertEqual(self.tweet.likes_count, 0)
+        self.assertEqual([cache.get(key) for key in keys], [0, 0])
+        self.assertEqual(LikeService.get_likes_count(self.tweet), 0)
+
+    def test_rollback_discards_pending_delta(self):
+        # 点赞的事务回滚了，增量不能留在缓存里
+        with self.assertRaises(RuntimeError):
+            with transaction.atomic():
+                self.create_like(self.user2, self.tweet)
+                self.assertEqual(LikeService.get_likes_count(self.tweet), 0)
+                raise RuntimeError()
+        self.assertEqual(LikeService.get_likes_count(self.tweet), 0)
+        self.assertEqual(LikeService.flush_pending_likes_counts(), 0)
+
+        # 事务提交之后才加上增量
+        with transaction.atomic():
+            self.create_like(self.user2, self.tweet)
+            self.assertEqual(LikeService.get_likes_count(self.tweet), 0)
+        self.assertEqual(LikeService.get_likes_count(self.tweet), 1)
+
+    def test_flush_in_batches(self):
+        tweets = [self.create_tweet(self.user1) for _ in range(5)]
+        for tweet in tweets:
+            self.create_like(self.user2, tweet)
+        self.assertEqual(LikeService.flush_pending_likes_counts(batch_size=2), 5)
+        for tweet in tweets:
+            tweet.refresh_from_db()
+            self.assertEqual(tweet.likes_count, 1)
+
+
+@override_settings(
+    LIKES_COUNT_WRITE_BEHIND=False,
+    LIKES_COUNT_SHARDING_THRESHOLD=3,
+    LIKES_COUNT_SHARDS=4,
+)
+class LikesCountShardingTests(TestCase):
+
+    def setUp(self):
+        self.user1 = self.create_user('user1')
+        self.tweet = self.create_tweet(self.user1)
+        self.likers = [self.create_user('liker{}'.format(i)) for i in range(10)]
+
+    def test_switch_to_shards(self):
+        for liker in self.likers[:2]:
+            self.create_like(liker, self.tweet)
+        self.tweet.refresh_from_db()
+        self.assertFalse(self.tweet.likes_count_sharded)
+        self.assertEqual(self.tweet.likes_count, 2)
+        self.assertEqual(LikesCountShard.objects.count(), 0)
+
+        # 一分钟之内第 3 次点赞开始记在 shard 上
+        for liker in self.likers[2:]:
+            self.create_like(liker, self.tweet)
+        self.tweet.refresh_from_db()
+        self.assertTrue(self.tweet.likes_count_sharded)
+        self.assertEqual(self.tweet.likes_count, 2)
+        self.assertEqual(LikesCountShard.objects.filter(object_id=self.tweet.id).count(), 4)
+        self.assertEqual(LikeService.get_likes_count(self.tweet), 10)
+
+        # 总数有缓存，不会每次都 SUM
+        with self.assertNumQueries(0):
+            self.assertEqual(LikeService.get_likes_count(self.tweet), 10)
+
+        LikeService.change_likes_count(self.tweet.__class__, self.tweet.id, -1)
+        self.clear_cache()
+        self.assertEqual(LikeService.get_likes_count(self.tweet), 9)
@@ -1,8 +1,13 @@
 from django.contrib import admin
-from newsfeeds.models import NewsFeed
+from newsfeeds.models import NewsFeed, NewsFeedRetention
 
 
 @admin.register(NewsFeed)
 class NewsFeedAdmin(admin.ModelAdmin):
     list_display = ('user', 'tweet', 'created_at')
     date_hierarchy = 'created_at'
+
+
+@admin.register(NewsFeedRetention)
+class NewsFeedRetentionAdmin(admin.ModelAdmin):
+    list_display = ('user', 'trimmed_before', 'updated_at')
@@ -4,8 +4,12 @@ from tweets.api.serializers import TweetSerializer
 
 
 class NewsFeedSerializer(serializers.ModelSerializer):
+    # newsfeed 按 tweet 的发布时间排序，翻页的 cursor(created_at__lt / created_at__gt) 也用它
+    created_at = serializers.DateTimeField(source='tweet_created_at')
     tweet = TweetSerializer()
+    # newsfeed 的 id 也是 snowflake，和 tweet 一样提供字符串形式的 id_str
+    id_str = serializers.CharField(source='id', read_only=True)
 
     class Meta:
         model = NewsFeed
-        fields = ('id', 'created_at', 'user', 'tweet')
\ No newline at end of file
+        fields = ('id', 'id_str', 'created_at', 'user', 'tweet')
\ No newline at end of file
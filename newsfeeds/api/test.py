@@ -1,11 +1,19 @@
+from django.db import connection, connections
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
 from friendships.models import Friendship
+from newsfeeds.services import NewsFeedServices
+from newsfeeds.routers import get_newsfeed_db
 from rest_framework.test import APIClient
 from testing.testcases import TestCase
+from tweets.models import Tweet
+from utils.paginations import EndlessPagination
 
 
 NEWSFEEDS_URL = '/api/newsfeeds/'
 POST_TWEETS_URL = '/api/tweets/'
 FOLLOW_URL = '/api/friendships/{}/follow/'
+UNFOLLOW_URL = '/api/friendships/{}/unfollow/'
 
 
 class NewsFeedApiTests(TestCase):
@@ -51,3 +59,234 @@ class NewsFeedApiTests(TestCase):
         response = self.user1_client.get(NEWSFEEDS_URL)
         self.assertEqual(len(response.data['newsfeeds']), 2)
         self.assertEqual(response.data['newsfeeds'][0]['tweet']['id'], posted_tweet_id)
+        self.assertEqual(response.data['newsfeeds'][0]['tweet']['id_str'], str(posted_tweet_id))
+        newsfeed = response.data['newsfeeds'][0]
+        self.assertEqual(newsfeed['id_str'], str(newsfeed['id']))
+
+    @override_settings(NEWSFEED_PUSH_FOLLOWERS_THRESHOLD=1)
+    def test_list_with_high_fanout_author(self):
+        # user2 有 2 个粉丝，超过阈值，成为大V
+        self.user1_client.post(FOLLOW_URL.format(self.user2.id))
+        self.user1_client.post(POST_TWEETS_URL, {'content': 'from user1'})
+        response = self.user2_client.post(POST_TWEETS_URL, {'content': 'from user2'})
+        star_tweet_id = response.data['id']
+        self.user1_client.post(POST_TWEETS_URL, {'content': 'user1 again'})
+
+        # 大V 的 tweet 没有 push 给粉丝
+        self.assertEqual(
+            self.get_newsfeeds(self.user1).filter(tweet_id=star_tweet_id).exists(),
+            False,
+        )
+        response = self.user1_client.get(NEWSFEEDS_URL)
+        self.assertEqual(response.status_code, 200)
+        contents = [item['tweet']['content'] for item in response.data['newsfeeds']]
+        self.assertEqual(contents, ['user1 again', 'from user2', 'from user1'])
+
+    def test_pagination(self):
+        page_size = EndlessPagination.page_size
+        followed_user = self.create_user('followed')
+        newsfeeds = []
+        for i in range(page_size * 2):
+            tweet = self.create_tweet(followed_user)
+            newsfeeds.append(self.create_newsfeed(user=self.user1, tweet=tweet))
+        newsfeeds = newsfeeds[::-1]
+
+        # pull the first page (newsfeed 在 user1 所在的库里)
+        with CaptureQueriesContext(connections[get_newsfeed_db(self.user1.id)]) as captured:
+            response = self.user1_client.get(NEWSFEEDS_URL)
+        self.assertEqual(response.data['has_next_page'], True)
+        self.assertEqual(len(response.data['newsfeeds']), page_size)
+        self.assertEqual(response.data['newsfeeds'][0]['id'], newsfeeds[0].id)
+        self.assertEqual(
+            response.data['newsfeeds'][page_size - 1]['id'],
+            newsfeeds[page_size - 1].id,
+        )
+        # keyset 翻页，不会用 OFFSET
+        for query in captured.captured_queries:
+            self.assertNotIn('OFFSET', query['sql'].upper())
+
+        # pull the second page
+        last = response.data['newsfeeds'][-1]
+        response = self.user1_client.get(NEWSFEEDS_URL, {
+            'created_at__lt': last['created_at'],
+            'id__lt': last['id'],
+        })
+        self.assertEqual(response.data['has_next_page'], False)
+        self.assertEqual(
+            [item['id'] for item in response.data['newsfeeds']],
+            [newsfeed.id for newsfeed in newsfeeds[page_size:]],
+        )
+
+        # pull latest newsfeeds
+        first = newsfeeds[0]
+        response = self.user1_client.get(NEWSFEEDS_URL, {
+            'created_at__gt': first.created_at,
+            'id__gt': first.id,
+        })
+        self.assertEqual(response.data['has_next_page'], False)
+        self.assertEqual(len(response.data['newsfeeds']), 0)
+
+        tweet = self.create_tweet(followed_user)
+        new_newsfeed = self.create_newsfeed(user=self.user1, tweet=tweet)
+        response = self.user1_client.get(NEWSFEEDS_URL, {
+            'created_at__gt': first.created_at,
+            'id__gt': first.id,
+        })
+        self.assertEqual(len(response.data['newsfeeds']), 1)
+        self.assertEqual(response.data['newsfeeds'][0]['id'], new_newsfeed.id)
+
+        # 不带 id 的时候严格按时间比较，不会返回 cursor 那一条
+        response = self.user1_client.get(NEWSFEEDS_URL, {'created_at__gt': new_newsfeed.created_at})
+        self.assertEqual(response.data['newsfeeds'], [])
+
+        # 新的比一页多的时候返回紧挨着 cursor 的一页，has_next_page 表示更新的还有，不会跳过中间的
+        newer = [
+            self.create_newsfeed(user=self.user1, tweet=self.create_tweet(followed_user))
+            for _ in range(7)
+        ]
+        cursor = {'created_at__gt': new_newsfeed.created_at, 'id__gt': new_newsfeed.id, 'page_size': 3}
+        refreshed = []
+        while True:
+            response = self.user1_client.get(NEWSFEEDS_URL, cursor)
+            page = [item['id'] for item in response.data['newsfeeds']]
+            # 每一页都是新的在前
+            self.assertEqual(page, sorted(page, reverse=True))
+            refreshed = page + refreshed
+            if not response.data['has_next_page']:
+                break
+            cursor.update({
+                'created_at__gt': response.data['newsfeeds'][0]['created_at'],
+                'id__gt': response.data['newsfeeds'][0]['id'],
+            })
+        self.assertEqual(refreshed, [newsfeed.id for newsfeed in reversed(newer)])
+
+        # page_size 参数
+        response = self.user1_client.get(NEWSFEEDS_URL, {'page_size': 5})
+        self.assertEqual(len(response.data['newsfeeds']), 5)
+        self.assertEqual(response.data['has_next_page'], True)
+
+        # 错误的 cursor
+        response = self.user1_client.get(NEWSFEEDS_URL, {'created_at__lt': 'yesterday'})
+        self.assertEqual(response.status_code, 400)
+
+    @override_settings(NEWSFEED_PUSH_FOLLOWERS_THRESHOLD=1)
+    def test_pagination_with_pulled_tweets(self):
+        # user2 是大V，user1 关注了 user2
+        self.user1_client.post(FOLLOW_URL.format(self.user2.id))
+        tweet_ids = []
+        for i in range(5):
+            for client in [self.user1_client, self.user2_client]:
+                response = client.post(POST_TWEETS_URL, {'content': 'tweet {}'.format(i)})
+                tweet_ids.append(response.data['id'])
+        tweet_ids = tweet_ids[::-1]
+
+        results = []
+        params = {'page_size': 3}
+        while True:
+            response = self.user1_client.get(NEWSFEEDS_URL, params)
+            results.extend(response.data['newsfeeds'])
+            if not response.data['has_next_page']:
+                break
+            last = response.data['newsfeeds'][-1]
+            params = {'page_size': 3, 'created_at__lt': last['created_at']}
+            if last['id'] is not None:
+                params['id__lt'] = last['id']
+        self.assertEqual([item['tweet']['id'] for item in results], tweet_ids)
+
+    @override_settings(NEWSFEED_FOLLOW_BACKFILL_LIMIT=2)
+    def test_follow_and_unfollow(self):
+        user2_tweets = [self.create_tweet(self.user2, 'tweet {}'.format(i)) for i in range(3)]
+        own_tweet_id = self.user1_client.post(POST_TWEETS_URL, {'content': 'my tweet'}).data['id']
+        response = self.user1_client.get(NEWSFEEDS_URL)
+        self.assertEqual(len(response.data['newsfeeds']), 1)
+
+        # 关注之后补上被关注的人最新的 2 条 tweets，按 tweet 的时间排序
+        self.user1_client.post(FOLLOW_URL.format(self.user2.id))
+        response = self.user1_client.get(NEWSFEEDS_URL)
+        self.assertEqual(
+            [item['tweet']['id'] for item in response.data['newsfeeds']],
+            [own_tweet_id, user2_tweets[2].id, user2_tweets[1].id],
+        )
+
+        # 取关之后被取关的人的 tweets 都从 newsfeed 里删掉
+        self.user1_client.post(UNFOLLOW_URL.format(self.user2.id))
+        response = self.user1_client.get(NEWSFEEDS_URL)
+        self.assertEqual(
+            [item['tweet']['id'] for item in response.data['newsfeeds']],
+            [own_tweet_id],
+        )
+        self.assertEqual(self.get_newsfeeds(self.user1).count(), 1)
+
+    def test_list_query_count_is_constant(self):
+        authors = [self.create_user('author{}'.format(i)) for i in range(5)]
+        # 多一条，page size 最大(100)的时候也不是最后一页
+        for i in range(101):
+            tweet = self.create_tweet(authors[i % 5], 'tweet {}'.format(i))
+            self.create_newsfeed(self.user1, tweet)
+            if i % 3 == 0:
+                self.create_comment(self.user2, tweet)
+                self.create_like(self.user1, tweet)
+
+        # 第一次读会把 newsfeed 和 tweets 加载进缓存，之后每次请求的 query 数量都不应该随 page size 变化
+        self.user1_client.get(NEWSFEEDS_URL, {'page_size': 100})
+        query_counts = []
+        for page_size in (1, 10, 50, 100):
+            with CaptureQueriesContext(connection) as captured:
+                response = self.user1_client.get(NEWSFEEDS_URL, {'page_size': page_size})
+            self.assertEqual(len(response.data['newsfeeds']), page_size)
+            query_counts.append(len(captured))
+        self.assertEqual(len(set(query_counts)), 1)
+
+        # 批量查出来的数据和单独查的一致
+        for item in response.data['newsfeeds']:
+            liked = int(item['tweet']['content'].split()[-1]) % 3 == 0
+            self.assertEqual(item['tweet']['user']['username'][:6], 'author')
+            self.assertEqual(item['tweet']['comments_count'], 1 if liked else 0)
+            self.assertEqual(item['tweet']['likes_count'], 1 if liked else 0)
+            self.assertEqual(item['tweet']['has_liked'], liked)
+
+    def test_pagination_after_compaction(self):
+        self.user1_client.post(FOLLOW_URL.format(self.user2.id))
+        tweet_ids = []
+        for i in range(6):
+            response = self.user2_client.post(POST_TWEETS_URL, {'content': 'tweet {}'.format(i)})
+            tweet_ids.insert(0, response.data['id'])
+        self.user1_client.get(NEWSFEEDS_URL)
+
+        # 只保留最新的 2 条，更旧的翻页的时候从 Tweet 表里 pull
+        self.assertEqual(NewsFeedServices.compact_newsfeeds(self.user1.id, keep=2), 4)
+        results, params = [], {'page_size': 4}
+        while True:
+            response = self.user1_client.get(NEWSFEEDS_URL, params)
+            results.extend(response.data['newsfeeds'])
+            if not response.data['has_next_page']:
+                break
+            last = response.data['newsfeeds'][-1]
+            params = {'page_size': 4, 'created_at__lt': last['created_at']}
+            if last['id'] is not None:
+                params['id__lt'] = last['id']
+        self.assertEqual([item['tweet']['id'] for item in results], tweet_ids)
+
+    def test_list_after_tweets_deleted(self):
+        self.user1_client.post(FOLLOW_URL.format(self.user2.id))
+        tweet_ids = []
+        for i in range(5):
+            response = self.user2_client.post(POST_TWEETS_URL, {'content': 'tweet {}'.format(i)})
+            tweet_ids.insert(0, response.data['id'])
+        # 缓存加载好之后再删 tweet，缓存里还留着这些 tweet 的 newsfeed
+        self.user1_client.get(NEWSFEEDS_URL)
+        Tweet.objects.filter(id__in=tweet_ids[:2]).delete()
+
+        # 这一页仍然是满的，tweet 被删掉的 newsfeed 也被清理掉了
+        response = self.user1_client.get(NEWSFEEDS_URL, {'page_size': 2})
+        self.assertEqual(
+            [item['tweet']['id'] for item in response.data['newsfeeds']],
+            tweet_ids[2:4],
+        )
+        self.assertTrue(response.data['has_next_page'])
+        self.assertEqual(self.get_newsfeeds(self.user1).count(), 3)
+        response = self.user1_client.get(NEWSFEEDS_URL)
+        self.assertEqual(
+            [item['tweet']['id'] for item in response.data['newsfeeds']],
+            tweet_ids[2:],
+        )
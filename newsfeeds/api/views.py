@@ -2,12 +2,17 @@ from rest_framework import viewsets, status
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from newsfeeds.models import NewsFeed
+from newsfeeds.routers import get_newsfeed_db
 from newsfeeds.api.serializers import NewsFeedSerializer
+from newsfeeds.services import NewsFeedServices
+from utils.paginations import EndlessPagination
 
 
 class NewsFeedViewSet(viewsets.GenericViewSet):
     # 只有登陆了才能看到
     permission_classes = [IsAuthenticated]
+    # 用 (tweet_created_at, id) 做 cursor 翻页，避免一次返回用户全部的 newsfeed
+    pagination_class = EndlessPagination
 
     def get_queryset(self):
         # 自定义 queryset，因为 newsfeed 的查看是有权限的
@@ -16,15 +21,52 @@ class NewsFeedViewSet(viewsets.GenericViewSet):
         # 但是一般最好还是按照 NewsFeed.objects.filter 的方式写，更清晰直观
 
         # self.request.user -> 当前request(登陆)的用户
-        return NewsFeed.objects.filter(user=self.request.user)
+        # newsfeed 是按 user_id 分片的，只需要查当前用户所在的分片
+        return NewsFeed.objects.using(
+            get_newsfeed_db(self.request.user.id),
+        ).filter(user=self.request.user)
+
+    def get_page(self, request):
+        cursor = self.paginator.get_cursor(request)
+        # 每个数据源都只取 page_size + 1 条，多的一条用来判断 has_next_page
+        limit = self.paginator.get_page_size(request) + 1
+        # push 的 newsfeed 优先从缓存里读，超出缓存窗口的走 (user, tweet_created_at) 联合索引
+        pushed_newsfeeds = NewsFeedServices.get_pushed_newsfeeds(
+            request.user.id,
+            cursor,
+            limit,
+        )
+        # push 的 newsfeed + 从关注的大V那里 pull 的 tweets，按时间倒序归并
+        sources = [
+            pushed_newsfeeds,
+            NewsFeedServices.get_pulled_newsfeeds(request.user, limit, cursor),
+        ]
+        # push 的 newsfeed 翻到底了，更旧的可能已经被 compact_newsfeeds 删掉了 -> 从 Tweet 表里 pull
+        if len(pushed_newsfeeds) < limit:
+            sources.append(NewsFeedServices.get_trimmed_newsfeeds(request.user, limit, cursor))
+        newsfeeds = NewsFeedServices.merge_newsfeeds(*sources)
+        return self.paginator.paginate_ordered_list(newsfeeds, request)
 
     def list(self, request):
+        while True:
+            page = self.get_page(request)
+            # 整页的 tweets / 作者 / 评论数 / 点赞数 / 是否点过赞 都批量查好，避免 N+1 Queries
+            newsfeeds, context = NewsFeedServices.hydrate_newsfeeds(page, request.user)
+            if len(newsfeeds) == len(page):
+                break
+            # 有 tweet 已经被删掉了，这一页就少了几条 -> 删掉这些 newsfeed(缓存也会失效)之后重新取一页
+            # 每次至少删掉一条，不会一直循环
+            NewsFeedServices.remove_dangling_newsfeeds(
+                request.user.id,
+                [newsfeed.id for newsfeed in page if newsfeed.tweet is None],
+            )
         # 因为有很多的news - 设置many=True
         serializer = NewsFeedSerializer(
-            self.get_queryset(),
-            context={'request': request},
+            newsfeeds,
+            context={'request': request, **context},
             many=True,
         )
         return Response({
             'newsfeeds': serializer.data,
+            'has_next_page': self.paginator.has_next_page,
         }, status=status.HTTP_200_OK)
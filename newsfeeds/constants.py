@@ -0,0 +1,28 @@
+# newsfeeds 相关配置的默认值，都可以在 settings 里用同名的配置覆盖
+
+# fanout 的时候每次 bulk_create 最多写多少条 newsfeed
+NEWSFEED_FANOUT_BATCH_SIZE = 1000
+
+# 粉丝数超过这个阈值的用户(大V)发帖不做 push fanout，
+# 由粉丝读 newsfeed 的时候从 Tweet 表里 pull
+NEWSFEED_PUSH_FOLLOWERS_THRESHOLD = 10000
+
+# 每个用户在缓存里最多保存多少条最新的 newsfeed
+NEWSFEED_CACHE_LIMIT = 200
+# 用 settings.CACHES 里的哪个 cache，本地用 locmem/file 即可，线上用 memcached/redis
+NEWSFEED_CACHE_ALIAS = 'default'
+NEWSFEED_CACHE_TIMEOUT = 3600
+
+# 关注一个人之后，把他最新的多少条 tweet 补到自己的 newsfeed 里
+NEWSFEED_FOLLOW_BACKFILL_LIMIT = 20
+# 取关之后分批删除 newsfeed，每批最多删除多少条
+NEWSFEED_DELETE_BATCH_SIZE = 1000
+
+# compact_newsfeeds 每个用户保留最新的多少条 newsfeed，None 表示不按条数删
+NEWSFEED_RETENTION_LIMIT = 1000
+# compact_newsfeeds 删除多少天之前的 newsfeed，None 表示不按时间删
+NEWSFEED_RETENTION_DAYS = None
+
+# NewsFeed 按 user_id 的 hash 分布在这些数据库(settings.DATABASES 的 alias)上
+# 要在 settings 里加上 DATABASE_ROUTERS = ['newsfeeds.routers.NewsFeedRouter']
+NEWSFEED_DATABASES = ['default']
@@ -0,0 +1,11 @@
+def push_newsfeed_to_cache(sender, instance, created, **kwargs):
+    # bulk_create 不会触发 post_save，fanout 的时候在 tasks.py 里单独更新缓存
+    if not created:
+        return
+
+    # import 写在里面避免循环依赖
+    from newsfeeds.services import NewsFeedServices
+    NewsFeedServices.push_entries_to_cache({
+        instance.user_id: [(instance.id, instance.tweet_id, instance.tweet_created_at)],
+    })
+
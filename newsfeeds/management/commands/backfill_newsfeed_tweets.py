@@ -0,0 +1,70 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from newsfeeds.models import NewsFeed
+from newsfeeds.routers import get_newsfeed_databases
+from newsfeeds.services import NewsFeedServices
+from tweets.models import Tweet
+
+
+class Command(BaseCommand):
+    help = (
+        'Fill the denormalized tweet_created_at / tweet_user columns of existing '
+        'newsfeeds, walking each newsfeed database in primary key order'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        started_at = time.monotonic()
+        updated = 0
+        for db in get_newsfeed_databases():
+            updated += self.backfill_database(db, batch_size, options['verbosity'])
+        elapsed = time.monotonic() - started_at
+
+        if options['verbosity'] > 0:
+            self.stdout.write('Done, backfilled {} newsfeeds in {:.2f}s ({:.0f} rows/s)'.format(
+                updated,
+                elapsed,
+                updated / elapsed if elapsed else 0,
+            ))
+
+    def backfill_database(self, db, batch_size, verbosity):
+        updated = 0
+        last_id = 0
+        while True:
+            # 按主键往后扫，tweet 已经被删掉的行不会被更新，但也不会被重复扫描
+            rows = list(NewsFeed.objects.using(db).filter(
+                id__gt=last_id,
+                tweet_created_at__isnull=True,
+                tweet_id__isnull=False,
+            ).order_by('id').values_list('id', 'user_id', 'tweet_id')[:batch_size])
+            if not rows:
+                break
+            last_id = rows[-1][0]
+
+            # tweet 在 default 库，一个 batch 一条 query
+            tweets = Tweet.objects.in_bulk({tweet_id for _, _, tweet_id in rows})
+            newsfeeds = [
+                NewsFeed(
+                    id=newsfeed_id,
+                    tweet_created_at=tweets[tweet_id].created_at,
+                    tweet_user_id=tweets[tweet_id].user_id,
+                )
+                for newsfeed_id, _, tweet_id in rows
+                if tweet_id in tweets
+            ]
+            NewsFeed.objects.using(db).bulk_update(
+                newsfeeds,
+                ['tweet_created_at', 'tweet_user'],
+            )
+            updated += len(newsfeeds)
+            # 缓存里没有这些还没有排序字段的 newsfeed，让它们下次读的时候重新加载
+            for user_id in {user_id for _, user_id, _ in rows}:
+                NewsFeedServices.invalidate_cache(user_id)
+            if verbosity > 1:
+                self.stdout.write('{}: backfilled up to id {}'.format(db, last_id))
+        return updated
@@ -0,0 +1,88 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from newsfeeds import constants
+from newsfeeds.services import NewsFeedServices
+
+
+class Command(BaseCommand):
+    help = (
+        'Trim every user\'s newsfeed to the newest --keep rows and/or drop rows '
+        'older than --days. Trimmed pages are served from the Tweet table instead'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--keep',
+            type=int,
+            default=getattr(
+                settings,
+                'NEWSFEED_RETENTION_LIMIT',
+                constants.NEWSFEED_RETENTION_LIMIT,
+            ),
+            help='Number of newest newsfeeds to keep per user',
+        )
+        parser.add_argument(
+            '--days',
+            type=int,
+            default=getattr(
+                settings,
+                'NEWSFEED_RETENTION_DAYS',
+                constants.NEWSFEED_RETENTION_DAYS,
+            ),
+            help='Delete newsfeeds older than this many days',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=None,
+            help='Rows deleted per statement',
+        )
+        parser.add_argument(
+            '--user',
+            type=int,
+            action='append',
+            dest='user_ids',
+            help='Only compact these users (can be repeated)',
+        )
+
+    def handle(self, *args, **options):
+        keep = options['keep']
+        before = None
+        if options['days'] is not None:
+            before = timezone.now() - timedelta(days=options['days'])
+
+        user_ids = options['user_ids']
+        if user_ids is None:
+            user_ids = User.objects.order_by('id').values_list('id', flat=True).iterator()
+
+        started_at = time.monotonic()
+        users = removed = 0
+        for user_id in user_ids:
+            count = NewsFeedServices.compact_newsfeeds(
+                user_id,
+                keep=keep,
+                before=before,
+                batch_size=options['batch_size'],
+            )
+            if count:
+                users += 1
+                removed += count
+                if options['verbosity'] > 1:
+                    self.stdout.write('user {}: removed {} newsfeeds'.format(user_id, count))
+        elapsed = time.monotonic() - started_at
+
+        if options['verbosity'] > 0:
+            self.stdout.write(
+                'Done, removed {} newsfeeds of {} users in {:.2f}s ({:.0f} rows/s)'.format(
+                    removed,
+                    users,
+                    elapsed,
+                    removed / elapsed if elapsed else 0,
+                )
+            )
@@ -0,0 +1,34 @@
+# Generated by Django 3.1.3 on 2026-10-18 10:41
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('newsfeeds', '0003_newsfeed_without_db_constraint'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='newsfeed',
+            options={'ordering': ('-tweet_created_at',)},
+        ),
+        migrations.AddField(
+            model_name='newsfeed',
+            name='tweet_created_at',
+            field=models.DateTimeField(null=True),
+        ),
+        migrations.AddField(
+            model_name='newsfeed',
+            name='tweet_user',
+            field=models.ForeignKey(db_constraint=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterIndexTogether(
+            name='newsfeed',
+            index_together={('user', 'tweet_created_at')},
+        ),
+    ]
@@ -1,22 +1,55 @@
 from django.contrib.auth.models import User
 from django.db import models
+from django.db.models.signals import post_save
+from newsfeeds.listeners import push_newsfeed_to_cache
 from tweets.models import Tweet
+from utils.snowflake import generate_id
 
 
 class NewsFeed(models.Model):
     # user -> 谁可以看见这条Tweet！(不是谁发的这条tweet
     # tweet -> tweet主体
-    # created_at -> 主要用于排序(建index)
+    # tweet_created_at -> 主要用于排序(建index)
     # 因此: 假设用户A被用户1,2,3关注 那当用户A发帖时 -> 会创建3条记录，分别是:
     # 用户1可以看到这条帖子，用户2可以看到这条帖子，用户3可以看到这条帖子
-    user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True)
-    tweet = models.ForeignKey(Tweet, on_delete=models.SET_NULL, null=True)
+    # NewsFeed 按 user_id 分片存在不同的数据库上(见 newsfeeds/routers.py)，
+    # user / tweet 在 default 库，跨库没法建外键约束 -> db_constraint=False
+    # 删除 tweet 的时候只有和 tweet 在同一个库的 newsfeed 会被 SET_NULL，
+    # 其他分片上的读的时候找不到 tweet 会被跳过
+    # 和 Tweet 一样用按时间递增的 id，bulk_create 之前就知道每条 newsfeed 的 id
+    id = models.BigIntegerField(primary_key=True, default=generate_id, editable=False)
+    user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, db_constraint=False)
+    tweet = models.ForeignKey(Tweet, on_delete=models.SET_NULL, null=True, db_constraint=False)
     created_at = models.DateTimeField(auto_now_add=True)
+    # 冗余存储 tweet 的发布时间和作者，翻页 / 按作者过滤都不需要再 JOIN tweet 表
+    # newsfeed 按 tweet_created_at 排序 -> 关注之后补进来的旧 tweet 也能排在正确的位置
+    tweet_created_at = models.DateTimeField(null=True)
+    tweet_user = models.ForeignKey(
+        User,
+        on_delete=models.SET_NULL,
+        null=True,
+        db_constraint=False,
+        related_name='+',
+    )
 
     class Meta:
-        index_together = (('user', 'created_at'),)
+        index_together = (('user', 'tweet_created_at'),)
         unique_together = (('user', 'tweet'),)
-        ordering = ('-created_at',)
+        ordering = ('-tweet_created_at',)
 
     def __str__(self):
-        return f'{self.created_at} inbox of {self.user}: {self.tweet}'
\ No newline at end of file
+        return f'{self.created_at} inbox of {self.user}: {self.tweet}'
+
+
+class NewsFeedRetention(models.Model):
+    # 压缩(compact_newsfeeds)之后每个用户删掉的 newsfeed 里最新的时间
+    # 比这个时间早的 newsfeed 不再存在表里，读的时候从 Tweet 表里 pull
+    user = models.OneToOneField(User, on_delete=models.SET_NULL, null=True)
+    trimmed_before = models.DateTimeField()
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f'{self.user} newsfeeds trimmed before {self.trimmed_before}'
+
+
+post_save.connect(push_newsfeed_to_cache, sender=NewsFeed)
@@ -0,0 +1,71 @@
+import zlib
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+from newsfeeds import constants
+
+
+def get_newsfeed_databases():
+    return getattr(settings, 'NEWSFEED_DATABASES', constants.NEWSFEED_DATABASES)
+
+
+def get_newsfeed_db(user_id):
+    # 同一个用户的 newsfeed 都在同一个分片上，读一个用户的 newsfeed 只需要查一个库
+    # 不用 python 自带的 hash()，它在每个进程里的结果可能不一样
+    databases = get_newsfeed_databases()
+    return databases[zlib.crc32(str(user_id).encode()) % len(databases)]
+
+
+def group_by_newsfeed_db(user_ids):
+    # {db alias: [user_id, ...]}，fanout 的时候每个分片一次 bulk_create
+    groups = defaultdict(list)
+    for user_id in user_ids:
+        groups[get_newsfeed_db(user_id)].append(user_id)
+    return groups
+
+
+class NewsFeedRouter(object):
+    """
+    NewsFeed 按 user_id 分片，其他的 model 都在 default 库
+    只有 save / delete 单个 NewsFeed 的时候 django 会把 instance 传进来，
+    queryset(filter / bulk_create) 没办法知道 user_id，要自己 .using(get_newsfeed_db(user_id))
+    """
+
+    def _is_newsfeed(self, model):
+        return model._meta.label == 'newsfeeds.NewsFeed'
+
+    def _db_for_instance(self, model, instance):
+        if instance is None:
+            return None
+        if self._is_newsfeed(model):
+            # user.newsfeed_set 之类的反向查询传进来的 instance 是 user
+            if instance._meta.label == settings.AUTH_USER_MODEL:
+                return get_newsfeed_db(instance.pk)
+            if not self._is_newsfeed(instance.__class__) or instance.user_id is None:
+                return None
+            return get_newsfeed_db(instance.user_id)
+        # 从分片上读出来的 newsfeed 访问 newsfeed.tweet / newsfeed.user 的时候，
+        # django 默认会去 newsfeed 所在的库里找，要改回 default
+        if self._is_newsfeed(instance.__class__):
+            return DEFAULT_DB_ALIAS
+        return None
+
+    def db_for_read(self, model, **hints):
+        return self._db_for_instance(model, hints.get('instance'))
+
+    def db_for_write(self, model, **hints):
+        return self._db_for_instance(model, hints.get('instance'))
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # NewsFeed 的外键(user / tweet)是跨库的，数据库里没有外键约束(db_constraint=False)
+        if self._is_newsfeed(obj1.__class__) or self._is_newsfeed(obj2.__class__):
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # 专门放 newsfeed 的分片上只建 newsfeed 表
+        if db == DEFAULT_DB_ALIAS or db not in get_newsfeed_databases():
+            return None
+        return app_label == 'newsfeeds' and model_name == 'newsfeed'
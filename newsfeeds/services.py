@@ -1,9 +1,43 @@
-from newsfeeds.models import NewsFeed
-from friendships.services import FriendshipService
+import heapq
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models import Q
+
+from accounts.models import UserProfile
+from friendships.models import Friendship
+from newsfeeds import constants
+from newsfeeds.models import NewsFeed, NewsFeedRetention
+from newsfeeds.routers import get_newsfeed_db, group_by_newsfeed_db
+from newsfeeds.tasks import (
+    backfill_newsfeeds_task,
+    fanout_newsfeeds_task,
+    push_pulled_tweets_task,
+    remove_newsfeeds_task,
+)
+from tweets.models import Tweet
+from tweets.services import TweetService
+from utils.paginations import EndlessPagination
 
 
 class NewsFeedServices(object):
 
+    @classmethod
+    def get_push_followers_threshold(cls):
+        return getattr(
+            settings,
+            'NEWSFEED_PUSH_FOLLOWERS_THRESHOLD',
+            constants.NEWSFEED_PUSH_FOLLOWERS_THRESHOLD,
+        )
+
+    @classmethod
+    def is_high_fanout_user(cls, user_id):
+        # 粉丝数是冗余存在 UserProfile 里的，不需要 COUNT friendships
+        return UserProfile.objects.filter(
+            user_id=user_id,
+            followers_count__gt=cls.get_push_followers_threshold(),
+        ).exists()
+
     # fanout - 扇出,分发
     # 给每个关注了发布tweet的用户在newsfeed中加一条数据
     @classmethod
@@ -18,12 +52,402 @@ class NewsFeedServices(object):
         #         tweet=tweet,
         #     )
 
-        # 正确方法：bulk_create 把insert语句合成一条
-        newsfeeds = [
-            NewsFeed(user=follower, tweet=tweet)
-            for follower in FriendshipService.get_followers(tweet.user)
+        # 大V 的粉丝太多，push 的代价太大 -> 只写自己的 newsfeed
+        # 粉丝读 newsfeed 的时候再去 pull 大V 的 tweets (push + pull 混合模式)
+        if cls.is_high_fanout_user(tweet.user_id):
+            # 记下来这个用户有没 push 过的 tweet，之后粉丝数掉到阈值以下了也还要 pull，直到补 push 完
+            UserProfile.objects.filter(
+                user_id=tweet.user_id,
+                has_pulled_tweets=False,
+            ).update(has_pulled_tweets=True)
+            NewsFeed.objects.using(get_newsfeed_db(tweet.user_id)).get_or_create(
+                user_id=tweet.user_id,
+                tweet=tweet,
+                defaults={
+                    'tweet_created_at': tweet.created_at,
+                    'tweet_user_id': tweet.user_id,
+                },
+            )
+            return
+
+        # 正确方法：bulk_create 把insert语句合成一条 -> 见 newsfeeds/tasks.py
+        # 但是 follower 很多的时候 bulk_create 本身也很慢，不能让发帖的请求等着
+        # 所以这里只是把任务放进队列，由 worker(python manage.py run_jobs) 异步执行
+        fanout_newsfeeds_task.delay(tweet_id=tweet.id)
+
+    @classmethod
+    def backfill_newsfeeds_on_follow(cls, follower_id, followee_id):
+        # 大V的 tweets 读的时候会 pull，不需要补
+        if cls.is_high_fanout_user(followee_id):
+            return
+        # 异步执行，不让关注的请求等着写 newsfeed
+        backfill_newsfeeds_task.delay(follower_id=follower_id, followee_id=followee_id)
+
+    @classmethod
+    def remove_newsfeeds_on_unfollow(cls, follower_id, followee_id):
+        remove_newsfeeds_task.delay(follower_id=follower_id, followee_id=followee_id)
+        # 大V 的粉丝数降到了阈值以下，之后发的 tweet 会 push，之前没 push 的最近的 tweets 补 push 给粉丝
+        if UserProfile.objects.filter(
+            user_id=followee_id,
+            has_pulled_tweets=True,
+            followers_count__lte=cls.get_push_followers_threshold(),
+        ).exists():
+            push_pulled_tweets_task.delay(user_id=followee_id)
+
+    @classmethod
+    def get_pushed_newsfeeds(cls, user_id, cursor, limit):
+        """
+        push 的 newsfeed 里按 cursor 翻页的最多 limit 条
+        在缓存的窗口里的话直接从缓存里返回，不查 newsfeed 表
+        """
+        newsfeeds = cls._get_pushed_newsfeeds_from_cache(user_id, cursor, limit)
+        if newsfeeds is not None:
+            return newsfeeds
+        # 超出了缓存的窗口(翻到了很旧的页) -> 走 (user, tweet_created_at) 联合索引，不 JOIN tweet 表
+        # 还没有 backfill_newsfeed_tweets 的旧数据没有排序字段，先跳过
+        return EndlessPagination.slice_by_cursor(
+            NewsFeed.objects.using(get_newsfeed_db(user_id)).filter(
+                user_id=user_id,
+                tweet_created_at__isnull=False,
+            ),
+            cursor,
+            limit,
+            created_at_field='tweet_created_at',
+        )
+
+    # ---------------------------------------------------------------------
+    # newsfeed 缓存: 每个用户缓存最新的 NEWSFEED_CACHE_LIMIT 条 newsfeed
+    # 缓存的 value 是按 (tweet_created_at, id) 倒序排好的 (id, tweet_id, tweet_created_at) 的 list
+    # 第一次读的时候懒加载，fanout 的时候插到最前面，超过长度的截掉
+    # 注意: django cache 没有原子的 read-modify-write，并发写同一个用户的缓存可能丢数据
+    # 所以缓存设置了过期时间(NEWSFEED_CACHE_TIMEOUT)，最多过期之后就会自动修正
+    # ---------------------------------------------------------------------
+    @classmethod
+    def get_cache(cls):
+        return caches[getattr(
+            settings,
+            'NEWSFEED_CACHE_ALIAS',
+            constants.NEWSFEED_CACHE_ALIAS,
+        )]
+
+    @classmethod
+    def get_cache_limit(cls):
+        return getattr(settings, 'NEWSFEED_CACHE_LIMIT', constants.NEWSFEED_CACHE_LIMIT)
+
+    @classmethod
+    def get_cache_timeout(cls):
+        return getattr(settings, 'NEWSFEED_CACHE_TIMEOUT', constants.NEWSFEED_CACHE_TIMEOUT)
+
+    @classmethod
+    def get_cache_key(cls, user_id):
+        return 'newsfeeds:user:{}'.format(user_id)
+
+    @classmethod
+    def load_cached_entries(cls, user_id):
+        cache = cls.get_cache()
+        key = cls.get_cache_key(user_id)
+        entries = cache.get(key)
+        if entries is not None:
+            return entries
+
+        # cache miss -> 从数据库里加载最新的 limit 条
+        entries = list(NewsFeed.objects.using(get_newsfeed_db(user_id)).filter(
+            user_id=user_id,
+            tweet_created_at__isnull=False,
+        ).order_by('-tweet_created_at', '-id').values_list(
+            'id',
+            'tweet_id',
+            'tweet_created_at',
+        )[:cls.get_cache_limit()])
+        cache.set(key, entries, cls.get_cache_timeout())
+        return entries
+
+    @classmethod
+    def _merge_entries(cls, entries, new_entries):
+        # 新的 newsfeed 一般都是最新的，但还是按 (tweet_created_at, id) 重新排一下，去重之后截断
+        entries_by_id = {entry[0]: entry for entry in entries}
+        for entry in new_entries:
+            entries_by_id[entry[0]] = entry
+        entries = sorted(
+            entries_by_id.values(),
+            key=lambda entry: (entry[2], entry[0]),
+            reverse=True,
+        )
+        return entries[:cls.get_cache_limit()]
+
+    @classmethod
+    def push_entries_to_cache(cls, entries_by_user_id):
+        """
+        entries_by_user_id: {user_id: [(id, tweet_id, tweet_created_at), ...]}
+        只更新已经在缓存里的用户，不在缓存里的等第一次读的时候再懒加载
+        """
+        cache = cls.get_cache()
+        keys = {cls.get_cache_key(user_id): user_id for user_id in entries_by_user_id}
+        cached = cache.get_many(keys.keys())
+        if not cached:
+            return
+        cache.set_many({
+            key: cls._merge_entries(entries, entries_by_user_id[keys[key]])
+            for key, entries in cached.items()
+        }, cls.get_cache_timeout())
+
+    @classmethod
+    def push_tweet_to_cache(cls, user_ids, tweet_id):
+        # fanout 用的 bulk_create(ignore_conflicts=True) 拿不到 id，
+        # 所以对已经在缓存里的用户再查一次刚插入的 newsfeed，走 unique_together(user, tweet) 的索引
+        cache = cls.get_cache()
+        keys = {cls.get_cache_key(user_id): user_id for user_id in user_ids}
+        cached_user_ids = [keys[key] for key in cache.get_many(keys.keys())]
+        if not cached_user_ids:
+            return
+        entries_by_user_id = {}
+        for db, db_user_ids in group_by_newsfeed_db(cached_user_ids).items():
+            for user_id, *entry in NewsFeed.objects.using(db).filter(
+                user_id__in=db_user_ids,
+                tweet_id=tweet_id,
+            ).values_list('user_id', 'id', 'tweet_id', 'tweet_created_at'):
+                entries_by_user_id[user_id] = [tuple(entry)]
+        cls.push_entries_to_cache(entries_by_user_id)
+
+    @classmethod
+    def invalidate_cache(cls, user_id):
+        cls.get_cache().delete(cls.get_cache_key(user_id))
+
+    @classmethod
+    def remove_dangling_newsfeeds(cls, user_id, newsfeed_ids):
+        # tweet 已经被删掉的 newsfeed: 不分片的时候 tweet_id 被 SET_NULL，分片的时候 tweet_id 还留着
+        # 读的时候发现了就删掉，缓存也一起失效，下次读的时候就不会再占着一页里的位置
+        # NewsFeed 没有 post_delete 的 listener，queryset.delete() 是一条 DELETE，删完统一让缓存失效
+        NewsFeed.objects.using(get_newsfeed_db(user_id)).filter(
+            user_id=user_id,
+            id__in=newsfeed_ids,
+        ).delete()
+        cls.invalidate_cache(user_id)
+
+    @classmethod
+    def _get_pushed_newsfeeds_from_cache(cls, user_id, cursor, limit):
+        """
+        缓存能回答这次查询的时候返回 NewsFeed 的 list，否则返回 None
+        """
+        entries = cls.load_cached_entries(user_id)
+        matched = [
+            entry
+            for entry in entries
+            if EndlessPagination.matches_cursor(entry[2], entry[0], cursor)
+        ]
+        # 缓存里的数据少于 limit 说明缓存里就是这个用户全部的 newsfeed
+        is_complete = len(entries) < cls.get_cache_limit()
+        # 往新的方向翻页的时候，只要 cursor 在缓存的窗口里，比它新的就都在缓存里
+        covers_cursor = bool(entries) and cursor is not None and cursor['op'] == 'gt' and (
+            (cursor['created_at'], cursor['id'] or 0) >= (entries[-1][2], entries[-1][0])
+        )
+        if len(matched) < limit and not is_complete and not covers_cursor:
+            return None
+        return [
+            NewsFeed(
+                id=newsfeed_id,
+                user_id=user_id,
+                tweet_id=tweet_id,
+                tweet_created_at=tweet_created_at,
+            )
+            for newsfeed_id, tweet_id, tweet_created_at in EndlessPagination.trim_to_cursor(
+                matched,
+                cursor,
+                limit,
+            )
+        ]
+
+    @classmethod
+    def get_high_fanout_following_ids(cls, user_id):
+        """
+        user 关注的人里面要 pull 的 -> 一条 query (子查询)
+        大V + 粉丝数已经降到阈值以下、但是以大V身份发的 tweets 还没有补 push 的
+        """
+        return list(UserProfile.objects.filter(
+            Q(followers_count__gt=cls.get_push_followers_threshold()) | Q(has_pulled_tweets=True),
+            user_id__in=Friendship.objects.filter(
+                from_user_id=user_id,
+            ).values('to_user_id'),
+        ).values_list('user_id', flat=True))
+
+    @classmethod
+    def get_pulled_newsfeeds(cls, user, limit, cursor=None):
+        """
+        从关注的大V的 tweets 里 pull 最多 limit 条，cursor 和 newsfeed 翻页的 cursor 一样
+        包装成没有存进数据库的 NewsFeed(id=None)，这样可以和 push 的 newsfeed 一起排序和序列化
+        所有大V 一条 query，走 Tweet 的 (user, created_at) 联合索引，不会随关注的大V 的数量变多
+        pull 来的没有 newsfeed id，只按 created_at 和 cursor 比较(见 EndlessPagination.filter_by_cursor)
+        """
+        author_ids = cls.get_high_fanout_following_ids(user.id)
+        if not author_ids:
+            return []
+        tweets = EndlessPagination.slice_by_cursor(
+            Tweet.objects.filter(user_id__in=author_ids),
+            cursor,
+            limit,
+            id_field=None,
+        )
+        return [
+            NewsFeed(
+                id=None,
+                user=user,
+                tweet=tweet,
+                tweet_created_at=tweet.created_at,
+                tweet_user_id=tweet.user_id,
+            )
+            for tweet in tweets
+        ]
+
+    @classmethod
+    def get_trimmed_newsfeeds(cls, user, limit, cursor=None):
+        """
+        被 compact_newsfeeds 删掉的旧 newsfeed 从 Tweet 表里 pull 回来，和 get_pulled_newsfeeds 一样
+        包装成 NewsFeed(id=None)。只有 push 的 newsfeed 已经翻到底了才需要调用
+        自己 + 关注的人(大V已经单独 pull 了)在 trimmed_before 之前的 tweets，一条 query
+        """
+        retention = NewsFeedRetention.objects.filter(user_id=user.id).first()
+        if retention is None:
+            return []
+
+        author_ids = Friendship.objects.filter(
+            from_user_id=user.id,
+        ).exclude(
+            to_user_id__in=cls.get_high_fanout_following_ids(user.id),
+        ).values('to_user_id')
+        tweets = EndlessPagination.slice_by_cursor(
+            Tweet.objects.filter(
+                Q(user_id=user.id) | Q(user_id__in=author_ids),
+                created_at__lte=retention.trimmed_before,
+            ),
+            cursor,
+            limit,
+            id_field=None,
+        )
+        return [
+            NewsFeed(
+                id=None,
+                user=user,
+                tweet=tweet,
+                tweet_created_at=tweet.created_at,
+                tweet_user_id=tweet.user_id,
+            )
+            for tweet in tweets
         ]
-        # 自己也可以看到自己发的
-        newsfeeds.append(NewsFeed(user=tweet.user, tweet=tweet))
-        # bulk_create -> 批量创建(insert)
-        NewsFeed.objects.bulk_create(newsfeeds)
+
+    @classmethod
+    def compact_newsfeeds(cls, user_id, keep=None, before=None, batch_size=None):
+        """
+        删掉 user 的 newsfeed 里除了最新的 keep 条以外的 / 早于 before 的，返回删掉的条数
+        按 (tweet_created_at, id) 从旧到新分批删除，每次只锁一小段数据，不会长时间锁表
+        删掉的部分记在 NewsFeedRetention 里，之后读的时候由 get_trimmed_newsfeeds 从 Tweet 表 pull
+        """
+        if batch_size is None:
+            batch_size = getattr(
+                settings,
+                'NEWSFEED_DELETE_BATCH_SIZE',
+                constants.NEWSFEED_DELETE_BATCH_SIZE,
+            )
+
+        condition = Q()
+        if keep is not None:
+            # 走 (user, tweet_created_at) 联合索引找到第 keep + 1 新的 newsfeed，它和比它旧的都删掉
+            boundary = NewsFeed.objects.using(get_newsfeed_db(user_id)).filter(
+                user_id=user_id,
+            ).order_by('-tweet_created_at', '-id').values_list('tweet_created_at', 'id')[keep:keep + 1]
+            for created_at, newsfeed_id in boundary:
+                condition |= Q(tweet_created_at__lt=created_at) | Q(
+                    tweet_created_at=created_at,
+                    id__lte=newsfeed_id,
+                )
+        if before is not None:
+            condition |= Q(tweet_created_at__lt=before)
+        if not condition:
+            return 0
+
+        queryset = NewsFeed.objects.using(get_newsfeed_db(user_id)).filter(condition, user_id=user_id)
+        trimmed_before = queryset.order_by(
+            '-tweet_created_at',
+        ).values_list('tweet_created_at', flat=True).first()
+        if trimmed_before is None:
+            return 0
+
+        # 先记下删除的范围再删，删到一半失败了，读的时候也能从 Tweet 表里 pull 到
+        retention, created = NewsFeedRetention.objects.get_or_create(
+            user_id=user_id,
+            defaults={'trimmed_before': trimmed_before},
+        )
+        if not created and retention.trimmed_before < trimmed_before:
+            retention.trimmed_before = trimmed_before
+            retention.save()
+
+        # 沿 (user, tweet_created_at) 索引从旧往新走，每批从上一批最后一条之后开始找，
+        # 不用每次都从头扫一遍(已经删掉的行还在索引里没清理掉的时候也不会重复扫)
+        removed, last = 0, None
+        while True:
+            batch = queryset
+            if last is not None:
+                batch = batch.filter(
+                    Q(tweet_created_at__gt=last[0]) | Q(tweet_created_at=last[0], id__gt=last[1]),
+                )
+            keys = list(batch.order_by('tweet_created_at', 'id').values_list(
+                'tweet_created_at',
+                'id',
+            )[:batch_size])
+            if not keys:
+                break
+            deleted, _ = queryset.filter(id__in=[newsfeed_id for _, newsfeed_id in keys]).delete()
+            removed += deleted
+            last = keys[-1]
+        cls.invalidate_cache(user_id)
+        return removed
+
+    @classmethod
+    def _get_sort_key(cls, newsfeed):
+        # 和 EndlessPagination 的排序一致: (tweet_created_at, id)，pull 来的没有 id 当作 0
+        return newsfeed.tweet_created_at, newsfeed.id or 0
+
+    @classmethod
+    def merge_newsfeeds(cls, *sources):
+        """
+        每个 source 都是按 (tweet_created_at, id) 倒序排好的序列，归并之后仍然是倒序
+        同一个 tweet 可能多个 source 都有(比如用户变成大V之前发的 tweet 已经 push 过了)，只保留一条
+        """
+        merged = heapq.merge(*sources, key=cls._get_sort_key, reverse=True)
+        seen_tweet_ids = set()
+        newsfeeds = []
+        for newsfeed in merged:
+            if newsfeed.tweet_id in seen_tweet_ids:
+                continue
+            seen_tweet_ids.add(newsfeed.tweet_id)
+            newsfeeds.append(newsfeed)
+        return newsfeeds
+
+    @classmethod
+    def hydrate_newsfeeds(cls, newsfeeds, viewer):
+        """
+        把一页 newsfeed 序列化需要的数据批量查出来，query 的数量和 page size 无关
+        - 从缓存里来的 newsfeed 只有 tweet_id，所有缺的 tweets 从 tweet 的对象缓存里批量读，没命中的一条 query 查出来
+        - tweet 已经被删掉的 newsfeed 直接去掉(newsfeed.tweet 设成 None)，调用的地方负责补满这一页
+        返回 (newsfeeds, context)，context 要传给 NewsFeedSerializer
+        """
+        tweet_field = NewsFeed._meta.get_field('tweet')
+        missing_tweet_ids = {
+            newsfeed.tweet_id
+            for newsfeed in newsfeeds
+            if newsfeed.tweet_id is not None and not tweet_field.is_cached(newsfeed)
+        }
+        tweets = TweetService.get_by_ids(missing_tweet_ids)
+
+        hydrated = []
+        for newsfeed in newsfeeds:
+            if not tweet_field.is_cached(newsfeed):
+                newsfeed.tweet = tweets.get(newsfeed.tweet_id)
+            if newsfeed.tweet is None:
+                continue
+            hydrated.append(newsfeed)
+
+        context = TweetService.hydrate(
+            [newsfeed.tweet for newsfeed in hydrated],
+            viewer,
+        )
+        return hydrated, context
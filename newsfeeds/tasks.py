@@ -0,0 +1,194 @@
+from django.conf import settings
+
+from accounts.models import UserProfile
+from friendships.models import Friendship
+from friendships.services import FriendshipService
+from jobs.decorators import job
+from newsfeeds.constants import (
+    NEWSFEED_DELETE_BATCH_SIZE,
+    NEWSFEED_FANOUT_BATCH_SIZE,
+    NEWSFEED_FOLLOW_BACKFILL_LIMIT,
+)
+from newsfeeds.models import NewsFeed
+from newsfeeds.routers import get_newsfeed_db, group_by_newsfeed_db
+from tweets.models import Tweet
+from utils.iterators import chunked
+
+
+@job(name='newsfeeds.fanout')
+def fanout_newsfeeds_task(tweet_id):
+    # import 写在里面避免循环依赖
+    from newsfeeds.services import NewsFeedServices
+
+    # 任务可能在 tweet 被删除之后才执行
+    tweet = Tweet.objects.filter(id=tweet_id).first()
+    if tweet is None:
+        return
+
+    batch_size = getattr(
+        settings,
+        'NEWSFEED_FANOUT_BATCH_SIZE',
+        NEWSFEED_FANOUT_BATCH_SIZE,
+    )
+    # 自己也可以看到自己发的
+    # 任务失败重试的时候可能已经插入过了，ignore_conflicts 依赖 unique_together(user, tweet)
+    # 保证重复执行是幂等的
+    NewsFeed.objects.using(get_newsfeed_db(tweet.user_id)).bulk_create(
+        [NewsFeed(
+            user_id=tweet.user_id,
+            tweet_id=tweet.id,
+            tweet_created_at=tweet.created_at,
+            tweet_user_id=tweet.user_id,
+        )],
+        ignore_conflicts=True,
+    )
+    NewsFeedServices.push_tweet_to_cache([tweet.user_id], tweet.id)
+    # follower 可能有几十万，只流式地读 follower id，每 batch_size 个写一次
+    # 内存里同时最多只有 batch_size 个 NewsFeed 对象，不会随 follower 数量增长
+    follower_ids = FriendshipService.iter_follower_ids(tweet.user_id, chunk_size=batch_size)
+    for follower_ids_batch in chunked(follower_ids, batch_size):
+        # newsfeed 按 user_id 分片，每个分片一次 bulk_create
+        for db, db_follower_ids in group_by_newsfeed_db(follower_ids_batch).items():
+            NewsFeed.objects.using(db).bulk_create(
+                [
+                    NewsFeed(
+                        user_id=follower_id,
+                        tweet_id=tweet.id,
+                        tweet_created_at=tweet.created_at,
+                        tweet_user_id=tweet.user_id,
+                    )
+                    for follower_id in db_follower_ids
+                ],
+                batch_size=batch_size,
+                ignore_conflicts=True,
+            )
+        # bulk_create 不会触发 post_save，手动把新的 newsfeed 插到已经缓存的用户的最前面
+        NewsFeedServices.push_tweet_to_cache(follower_ids_batch, tweet.id)
+
+
+@job(name='newsfeeds.backfill_on_follow')
+def backfill_newsfeeds_task(follower_id, followee_id):
+    # import 写在里面避免循环依赖
+    from newsfeeds.services import NewsFeedServices
+
+    # 任务是异步执行的，执行的时候可能已经取关了
+    if not Friendship.objects.filter(from_user_id=follower_id, to_user_id=followee_id).exists():
+        return
+
+    limit = getattr(
+        settings,
+        'NEWSFEED_FOLLOW_BACKFILL_LIMIT',
+        NEWSFEED_FOLLOW_BACKFILL_LIMIT,
+    )
+    # 走 Tweet 的 (user, created_at) 联合索引
+    tweets = list(Tweet.objects.filter(
+        user_id=followee_id,
+    ).order_by('-created_at').values_list('id', 'created_at')[:limit])
+    if not tweets:
+        return
+
+    db = get_newsfeed_db(follower_id)
+    # unique_together(user, tweet) + ignore_conflicts -> 已经有的不会重复插入，重复执行也是幂等的
+    # newsfeed 按冗余的 tweet_created_at 排序，补进来的旧 tweet 会排在正确的位置
+    NewsFeed.objects.using(db).bulk_create(
+        [
+            NewsFeed(
+                user_id=follower_id,
+                tweet_id=tweet_id,
+                tweet_created_at=created_at,
+                tweet_user_id=followee_id,
+            )
+            for tweet_id, created_at in tweets
+        ],
+        ignore_conflicts=True,
+    )
+    # ignore_conflicts 拿不到 id，缓存需要 id，再查一次
+    entries = NewsFeed.objects.using(db).filter(
+        user_id=follower_id,
+        tweet_id__in=[tweet_id for tweet_id, _ in tweets],
+    ).values_list('id', 'tweet_id', 'tweet_created_at')
+    NewsFeedServices.push_entries_to_cache({follower_id: list(entries)})
+
+
+@job(name='newsfeeds.remove_on_unfollow')
+def remove_newsfeeds_task(follower_id, followee_id):
+    # import 写在里面避免循环依赖
+    from newsfeeds.services import NewsFeedServices
+
+    # 执行的时候又重新关注了的话就不删了
+    if Friendship.objects.filter(from_user_id=follower_id, to_user_id=followee_id).exists():
+        return
+
+    batch_size = getattr(
+        settings,
+        'NEWSFEED_DELETE_BATCH_SIZE',
+        NEWSFEED_DELETE_BATCH_SIZE,
+    )
+    # newsfeed 里冗余存了作者(tweet_user)，不需要查 tweet 表
+    # 每批先找出最多 batch_size 条的 id，再按主键范围删除，一次只锁住一小批数据
+    queryset = NewsFeed.objects.using(get_newsfeed_db(follower_id)).filter(
+        user_id=follower_id,
+        tweet_user_id=followee_id,
+    )
+    while True:
+        newsfeed_ids = list(queryset.order_by('id').values_list('id', flat=True)[:batch_size])
+        if not newsfeed_ids:
+            break
+        queryset.filter(id__gte=newsfeed_ids[0], id__lte=newsfeed_ids[-1]).delete()
+    NewsFeedServices.invalidate_cache(follower_id)
+
+
+@job(name='newsfeeds.push_pulled_tweets')
+def push_pulled_tweets_task(user_id):
+    """
+    大V 的粉丝数降到阈值以下之后，粉丝不再 pull 他的 tweets
+    以大V身份发的(没有 push 过的)最近 NEWSFEED_FOLLOW_BACKFILL_LIMIT 条 tweets 补 push 给所有粉丝，
+    然后清掉 has_pulled_tweets，在这之前粉丝读 newsfeed 的时候还是会 pull，不会有 tweet 消失
+    """
+    # import 写在里面避免循环依赖
+    from newsfeeds.services import NewsFeedServices
+
+    # 执行的时候又变回大V了，继续 pull
+    if NewsFeedServices.is_high_fanout_user(user_id):
+        return
+
+    limit = getattr(
+        settings,
+        'NEWSFEED_FOLLOW_BACKFILL_LIMIT',
+        NEWSFEED_FOLLOW_BACKFILL_LIMIT,
+    )
+    batch_size = getattr(
+        settings,
+        'NEWSFEED_FANOUT_BATCH_SIZE',
+        NEWSFEED_FANOUT_BATCH_SIZE,
+    )
+    # 走 Tweet 的 (user, created_at) 联合索引
+    tweets = list(Tweet.objects.filter(
+        user_id=user_id,
+    ).order_by('-created_at').values_list('id', 'created_at')[:limit])
+    follower_ids = FriendshipService.iter_follower_ids(user_id, chunk_size=batch_size)
+    for follower_ids_batch in chunked(follower_ids, batch_size):
+        # unique_together(user, tweet) + ignore_conflicts -> 成为大V之前已经 push 过的不会重复插入
+        for db, db_follower_ids in group_by_newsfeed_db(follower_ids_batch).items():
+            NewsFeed.objects.using(db).bulk_create(
+                [
+                    NewsFeed(
+                        user_id=follower_id,
+                        tweet_id=tweet_id,
+                        tweet_created_at=created_at,
+                        tweet_user_id=user_id,
+                    )
+                    for follower_id in db_follower_ids
+                    for tweet_id, created_at in tweets
+                ],
+                batch_size=batch_size,
+                ignore_conflicts=True,
+            )
+        # 补进来的是旧的 tweet，不一定在缓存的窗口里，直接让缓存失效
+        for follower_id in follower_ids_batch:
+            NewsFeedServices.invalidate_cache(follower_id)
+    # 补 push 的过程中又变回大V的话不清掉，之后发的 tweets 还要 pull
+    UserProfile.objects.filter(
+        user_id=user_id,
+        followers_count__lte=NewsFeedServices.get_push_followers_threshold(),
+    ).update(has_pulled_tweets=False)
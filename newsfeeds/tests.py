@@ -0,0 +1,414 @@
+from io import StringIO
+from unittest import skipUnless
+
+from django.core.management import call_command
+from django.db import connection, connections
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+
+from friendships.models import Friendship
+from newsfeeds.models import NewsFeed, NewsFeedRetention
+from newsfeeds.routers import (
+    NewsFeedRouter,
+    get_newsfeed_databases,
+    get_newsfeed_db,
+    group_by_newsfeed_db,
+)
+from newsfeeds.services import NewsFeedServices
+from newsfeeds.tasks import (
+    backfill_newsfeeds_task,
+    fanout_newsfeeds_task,
+    remove_newsfeeds_task,
+)
+from rest_framework.test import APIClient
+from testing.testcases import TestCase
+from tweets.models import Tweet
+
+
+class NewsFeedTaskTests(TestCase):
+
+    def setUp(self):
+        self.user1 = self.create_user('user1')
+        self.followers = [
+            self.create_user('follower{}'.format(i))
+            for i in range(5)
+        ]
+        for follower in self.followers:
+            Friendship.objects.create(from_user=follower, to_user=self.user1)
+
+    @override_settings(NEWSFEED_FANOUT_BATCH_SIZE=2)
+    def test_fanout_in_batches(self):
+        tweet = self.create_tweet(self.user1)
+        fanout_newsfeeds_task(tweet_id=tweet.id)
+        self.assertEqual(self.count_newsfeeds(tweet=tweet), 6)
+        for user in self.followers + [self.user1]:
+            self.assertEqual(self.get_newsfeeds(user).filter(tweet=tweet).count(), 1)
+
+        # 重试的时候不会重复插入
+        fanout_newsfeeds_task(tweet_id=tweet.id)
+        self.assertEqual(self.count_newsfeeds(tweet=tweet), 6)
+
+    def test_fanout_deleted_tweet(self):
+        tweet = self.create_tweet(self.user1)
+        tweet_id = tweet.id
+        tweet.delete()
+        fanout_newsfeeds_task(tweet_id=tweet_id)
+        self.assertEqual(self.count_newsfeeds(), 0)
+
+
+@override_settings(NEWSFEED_PUSH_FOLLOWERS_THRESHOLD=2)
+class NewsFeedServiceTests(TestCase):
+
+    def setUp(self):
+        self.star = self.create_user('star')
+        self.viewer = self.create_user('viewer')
+        self.normal = self.create_user('normal')
+        self.fan = self.create_user('fan1')
+        for user in [self.viewer, self.fan, self.create_user('fan2')]:
+            Friendship.objects.create(from_user=user, to_user=self.star)
+        Friendship.objects.create(from_user=self.viewer, to_user=self.normal)
+
+    def test_followers_count(self):
+        self.assertEqual(self.star.profile.followers_count, 3)
+        Friendship.objects.filter(from_user=self.viewer, to_user=self.star).delete()
+        self.star.profile.refresh_from_db()
+        self.assertEqual(self.star.profile.followers_count, 2)
+
+    def test_high_fanout_user_skips_push(self):
+        self.assertEqual(NewsFeedServices.is_high_fanout_user(self.star.id), True)
+        self.assertEqual(NewsFeedServices.is_high_fanout_user(self.normal.id), False)
+
+        tweet = self.create_tweet(self.star)
+        NewsFeedServices.fanout_to_followers(tweet)
+        # 只有自己的 newsfeed
+        self.assertEqual(self.count_newsfeeds(tweet=tweet), 1)
+        self.assertEqual(self.get_newsfeeds(self.star).filter(tweet=tweet).count(), 1)
+
+        tweet = self.create_tweet(self.normal)
+        NewsFeedServices.fanout_to_followers(tweet)
+        self.assertEqual(self.count_newsfeeds(tweet=tweet), 2)
+
+    def test_push_pulled_tweets_after_dropping_below_threshold(self):
+        star_tweets = [self.create_tweet(self.star, 'star {}'.format(i)) for i in range(2)]
+        for tweet in star_tweets:
+            NewsFeedServices.fanout_to_followers(tweet)
+        self.star.profile.refresh_from_db()
+        self.assertTrue(self.star.profile.has_pulled_tweets)
+
+        # 粉丝数降到阈值，还没有补 push 之前还是要 pull
+        Friendship.objects.filter(from_user=self.viewer, to_user=self.star).delete()
+        self.assertEqual(NewsFeedServices.get_high_fanout_following_ids(self.fan.id), [self.star.id])
+
+        # 取关的时候补 push 给剩下的粉丝，之后不再 pull
+        NewsFeedServices.remove_newsfeeds_on_unfollow(self.viewer.id, self.star.id)
+        self.assertEqual(
+            set(self.get_newsfeeds(self.fan).values_list('tweet_id', flat=True)),
+            {tweet.id for tweet in star_tweets},
+        )
+        self.assertEqual(NewsFeedServices.get_high_fanout_following_ids(self.fan.id), [])
+        self.star.profile.refresh_from_db()
+        self.assertFalse(self.star.profile.has_pulled_tweets)
+
+    def test_pull_from_all_stars_in_one_query(self):
+        star2 = self.create_user('star2')
+        for user in [self.viewer, self.fan, self.normal]:
+            Friendship.objects.create(from_user=user, to_user=star2)
+        tweets = [self.create_tweet(author) for author in [self.star, star2, self.star]]
+        with CaptureQueriesContext(connection) as captured:
+            pulled = NewsFeedServices.get_pulled_newsfeeds(self.viewer, limit=10)
+        self.assertEqual([newsfeed.tweet_id for newsfeed in pulled], [tweet.id for tweet in reversed(tweets)])
+        # 关注的大V 再多也只查一次 tweet 表
+        self.assertEqual(
+            len([query for query in captured.captured_queries if 'tweets_tweet' in query['sql']]),
+            1,
+        )
+
+    def test_pull_and_merge(self):
+        self.assertEqual(
+            NewsFeedServices.get_high_fanout_following_ids(self.viewer.id),
+            [self.star.id],
+        )
+        tweets = []
+        for i in range(3):
+            for author in [self.star, self.normal]:
+                tweet = self.create_tweet(author, 'tweet {}'.format(i))
+                NewsFeedServices.fanout_to_followers(tweet)
+                tweets.append(tweet)
+        # star 在成为大V之前发的 tweet 已经 push 过了，不能重复出现
+        self.create_newsfeed(self.viewer, tweets[0])
+
+        pushed = self.get_newsfeeds(self.viewer).order_by('-tweet_created_at', '-id')
+        pulled = NewsFeedServices.get_pulled_newsfeeds(self.viewer, limit=10)
+        self.assertEqual(len(pulled), 3)
+        self.assertEqual(len(NewsFeedServices.get_pulled_newsfeeds(self.viewer, limit=2)), 2)
+        newsfeeds = NewsFeedServices.merge_newsfeeds(pushed, pulled)
+        self.assertEqual(
+            [newsfeed.tweet_id for newsfeed in newsfeeds],
+            [tweet.id for tweet in reversed(tweets)],
+        )
+
+
+class NewsFeedCacheTests(TestCase):
+
+    def setUp(self):
+        self.user1 = self.create_user('user1')
+        self.user2 = self.create_user('user2')
+        Friendship.objects.create(from_user=self.user2, to_user=self.user1)
+
+    def _newsfeed_queries(self, captured):
+        return [
+            query
+            for query in captured.captured_queries
+            if 'newsfeeds_newsfeed' in query['sql']
+        ]
+
+    def test_lazy_load_and_read_from_cache(self):
+        newsfeeds = [
+            self.create_newsfeed(self.user2, self.create_tweet(self.user1))
+            for _ in range(3)
+        ]
+        cache = NewsFeedServices.get_cache()
+        key = NewsFeedServices.get_cache_key(self.user2.id)
+        self.assertEqual(cache.get(key), None)
+
+        page = NewsFeedServices.get_pushed_newsfeeds(self.user2.id, None, 10)
+        self.assertEqual([n.id for n in page], [n.id for n in reversed(newsfeeds)])
+        self.assertEqual(len(cache.get(key)), 3)
+
+        # 在缓存的窗口里，不会查 newsfeed 表
+        with CaptureQueriesContext(connections[get_newsfeed_db(self.user2.id)]) as captured:
+            page = NewsFeedServices.get_pushed_newsfeeds(self.user2.id, None, 10)
+            cursor = {'op': 'lt', 'created_at': page[0].tweet_created_at, 'id': page[0].id}
+            older = NewsFeedServices.get_pushed_newsfeeds(self.user2.id, cursor, 10)
+        self.assertEqual(self._newsfeed_queries(captured), [])
+        self.assertEqual([n.id for n in older], [newsfeeds[1].id, newsfeeds[0].id])
+        self.assertEqual(page[0].tweet_id, newsfeeds[2].tweet_id)
+
+    def test_fanout_pushes_to_cache(self):
+        tweet = self.create_tweet(self.user1)
+        NewsFeedServices.get_pushed_newsfeeds(self.user2.id, None, 10)
+        fanout_newsfeeds_task(tweet_id=tweet.id)
+
+        with CaptureQueriesContext(connections[get_newsfeed_db(self.user2.id)]) as captured:
+            page = NewsFeedServices.get_pushed_newsfeeds(self.user2.id, None, 10)
+        self.assertEqual(self._newsfeed_queries(captured), [])
+        self.assertEqual([n.tweet_id for n in page], [tweet.id])
+        self.assertEqual(
+            page[0].id,
+            self.get_newsfeeds(self.user2).get(tweet=tweet).id,
+        )
+        # user1 的缓存还没有加载过，不会被写入
+        self.assertEqual(
+            NewsFeedServices.get_cache().get(NewsFeedServices.get_cache_key(self.user1.id)),
+            None,
+        )
+
+    @override_settings(NEWSFEED_CACHE_LIMIT=3)
+    def test_cache_is_trimmed(self):
+        newsfeeds = [
+            self.create_newsfeed(self.user2, self.create_tweet(self.user1))
+            for _ in range(3)
+        ]
+        NewsFeedServices.get_pushed_newsfeeds(self.user2.id, None, 2)
+        newsfeeds.append(self.create_newsfeed(self.user2, self.create_tweet(self.user1)))
+        entries = NewsFeedServices.load_cached_entries(self.user2.id)
+        self.assertEqual(
+            [entry[0] for entry in entries],
+            [n.id for n in reversed(newsfeeds[1:])],
+        )
+
+        # 超出缓存的窗口之后从数据库里读
+        cursor = {'op': 'lt', 'created_at': newsfeeds[2].tweet_created_at, 'id': newsfeeds[2].id}
+        with CaptureQueriesContext(connections[get_newsfeed_db(self.user2.id)]) as captured:
+            page = NewsFeedServices.get_pushed_newsfeeds(self.user2.id, cursor, 3)
+        self.assertEqual(len(self._newsfeed_queries(captured)), 1)
+        self.assertEqual([n.id for n in page], [newsfeeds[1].id, newsfeeds[0].id])
+
+    def test_remove_dangling_newsfeeds(self):
+        newsfeeds = [
+            self.create_newsfeed(self.user2, self.create_tweet(self.user1))
+            for _ in range(3)
+        ]
+        NewsFeedServices.get_pushed_newsfeeds(self.user2.id, None, 3)
+        with CaptureQueriesContext(connections[get_newsfeed_db(self.user2.id)]) as captured:
+            NewsFeedServices.remove_dangling_newsfeeds(self.user2.id, [newsfeeds[1].id])
+        # 没有 post_delete 的 listener，不需要先把要删的行查出来
+        self.assertEqual(len(self._newsfeed_queries(captured)), 1)
+        self.assertEqual(
+            NewsFeedServices.get_cache().get(NewsFeedServices.get_cache_key(self.user2.id)),
+            None,
+        )
+        self.assertEqual(
+            [n.id for n in NewsFeedServices.get_pushed_newsfeeds(self.user2.id, None, 3)],
+            [newsfeeds[2].id, newsfeeds[0].id],
+        )
+
+class NewsFeedFollowTaskTests(TestCase):
+
+    def setUp(self):
+        self.user1 = self.create_user('user1')
+        self.user2 = self.create_user('user2')
+
+    def test_backfill_skips_after_unfollow(self):
+        self.create_tweet(self.user2)
+        # 任务执行的时候已经没有关注关系了
+        backfill_newsfeeds_task(follower_id=self.user1.id, followee_id=self.user2.id)
+        self.assertEqual(self.count_newsfeeds(), 0)
+
+    @override_settings(NEWSFEED_DELETE_BATCH_SIZE=2)
+    def test_remove_in_batches(self):
+        tweets = [self.create_tweet(self.user2) for _ in range(5)]
+        other_tweet = self.create_tweet(self.user1)
+        for tweet in tweets + [other_tweet]:
+            self.create_newsfeed(self.user1, tweet)
+
+        # 重新关注了的话不删除
+        Friendship.objects.create(from_user=self.user1, to_user=self.user2)
+        remove_newsfeeds_task(follower_id=self.user1.id, followee_id=self.user2.id)
+        self.assertEqual(self.get_newsfeeds(self.user1).count(), 6)
+
+        Friendship.objects.filter(from_user=self.user1, to_user=self.user2).delete()
+        remove_newsfeeds_task(follower_id=self.user1.id, followee_id=self.user2.id)
+        self.assertEqual(
+            list(self.get_newsfeeds(self.user1).values_list('tweet_id', flat=True)),
+            [other_tweet.id],
+        )
+
+
+class NewsFeedCompactionTests(TestCase):
+
+    def setUp(self):
+        self.user1 = self.create_user('user1')
+        self.user2 = self.create_user('user2')
+        self.newsfeeds = [
+            self.create_newsfeed(self.user1, self.create_tweet(self.user2))
+            for _ in range(5)
+        ]
+        self.other_newsfeed = self.create_newsfeed(self.user2, self.create_tweet(self.user1))
+
+    def test_compact_keeps_newest(self):
+        removed = NewsFeedServices.compact_newsfeeds(self.user1.id, keep=2, batch_size=2)
+        self.assertEqual(removed, 3)
+        self.assertEqual(
+            set(self.get_newsfeeds(self.user1).values_list('id', flat=True)),
+            {self.newsfeeds[3].id, self.newsfeeds[4].id},
+        )
+        self.assertEqual(
+            NewsFeedRetention.objects.get(user=self.user1).trimmed_before,
+            self.newsfeeds[2].tweet_created_at,
+        )
+        # 其他用户不受影响，再跑一次什么都不删
+        self.assertTrue(self.get_newsfeeds(self.user2).filter(id=self.other_newsfeed.id).exists())
+        self.assertEqual(NewsFeedServices.compact_newsfeeds(self.user1.id, keep=2), 0)
+
+    def test_compact_by_time(self):
+        before = self.newsfeeds[1].tweet_created_at
+        removed = NewsFeedServices.compact_newsfeeds(self.user1.id, before=before)
+        self.assertEqual(removed, 1)
+        self.assertFalse(self.get_newsfeeds(self.user1).filter(id=self.newsfeeds[0].id).exists())
+
+    def test_compact_batches_continue_from_last_key(self):
+        db = get_newsfeed_db(self.user1.id)
+        with CaptureQueriesContext(connections[db]) as captured:
+            removed = NewsFeedServices.compact_newsfeeds(self.user1.id, keep=0, batch_size=2)
+        self.assertEqual(removed, 5)
+        self.assertFalse(self.get_newsfeeds(self.user1).exists())
+        # 5 条分 3 批删，第一批之后每一批都从上一批最后一条之后开始找
+        batch_queries = [
+            query['sql'] for query in captured.captured_queries
+            if query['sql'].startswith('SELECT') and 'ORDER BY' in query['sql'] and 'LIMIT 2' in query['sql']
+        ]
+        self.assertEqual(len(batch_queries), 4)
+        for sql in batch_queries[1:]:
+            self.assertIn('"tweet_created_at" >', sql)
+
+    def test_command(self):
+        out = StringIO()
+        call_command('compact_newsfeeds', keep=1, batch_size=2, stdout=out)
+        self.assertIn('removed 4 newsfeeds of 1 users', out.getvalue())
+        self.assertEqual(self.get_newsfeeds(self.user1).count(), 1)
+        self.assertEqual(self.get_newsfeeds(self.user2).count(), 1)
+
+
+class NewsFeedBackfillCommandTests(TestCase):
+
+    def setUp(self):
+        self.user1 = self.create_user('user1')
+        self.user2 = self.create_user('user2')
+        self.newsfeeds = [
+            self.create_newsfeed(self.user1, self.create_tweet(self.user2))
+            for _ in range(5)
+        ]
+        self.create_newsfeed(self.user2, self.create_tweet(self.user1))
+
+    def test_backfill_newsfeed_tweets(self):
+        for db in get_newsfeed_databases():
+            NewsFeed.objects.using(db).update(tweet_created_at=None, tweet_user=None)
+        NewsFeedServices.get_pushed_newsfeeds(self.user1.id, None, 10)
+        self.assertEqual(NewsFeedServices.load_cached_entries(self.user1.id), [])
+
+        out = StringIO()
+        call_command('backfill_newsfeed_tweets', batch_size=2, stdout=out)
+        self.assertIn('backfilled 6 newsfeeds', out.getvalue())
+        # newsfeed 和 tweet 可能不在同一个库里，不能 select_related
+        for newsfeed in list(self.get_newsfeeds(self.user1)) + list(self.get_newsfeeds(self.user2)):
+            self.assertEqual(newsfeed.tweet_created_at, newsfeed.tweet.created_at)
+            self.assertEqual(newsfeed.tweet_user_id, newsfeed.tweet.user_id)
+        self.assertEqual(
+            [newsfeed.id for newsfeed in NewsFeedServices.get_pushed_newsfeeds(self.user1.id, None, 10)],
+            [newsfeed.id for newsfeed in reversed(self.newsfeeds)],
+        )
+
+
+class NewsFeedRouterTests(TestCase):
+
+    @override_settings(NEWSFEED_DATABASES=['default', 'shard1'])
+    def test_routing(self):
+        user_ids = list(range(1, 101))
+        groups = group_by_newsfeed_db(user_ids)
+        self.assertEqual(set(groups.keys()), {'default', 'shard1'})
+        self.assertEqual(sorted(groups['default'] + groups['shard1']), user_ids)
+        for db, db_user_ids in groups.items():
+            for user_id in db_user_ids:
+                self.assertEqual(get_newsfeed_db(user_id), db)
+
+        router = NewsFeedRouter()
+        user_id = groups['shard1'][0]
+        newsfeed = NewsFeed(user_id=user_id)
+        self.assertEqual(router.db_for_write(NewsFeed, instance=newsfeed), 'shard1')
+        # newsfeed.tweet 要回到 default 库去读
+        self.assertEqual(router.db_for_read(Tweet, instance=newsfeed), 'default')
+        self.assertIsNone(router.db_for_read(Tweet))
+        self.assertTrue(router.allow_migrate('shard1', 'newsfeeds', 'newsfeed'))
+        self.assertFalse(router.allow_migrate('shard1', 'newsfeeds', 'newsfeedretention'))
+        self.assertFalse(router.allow_migrate('shard1', 'tweets', 'tweet'))
+        self.assertIsNone(router.allow_migrate('default', 'tweets', 'tweet'))
+
+
+@skipUnless(len(get_newsfeed_databases()) > 1, 'needs more than one NEWSFEED_DATABASES')
+class NewsFeedShardingTests(TestCase):
+
+    def test_fanout_and_read_across_shards(self):
+        author = self.create_user('author')
+        followers = [self.create_user('follower{}'.format(i)) for i in range(10)]
+        for follower in followers:
+            Friendship.objects.create(from_user=follower, to_user=author)
+        self.assertGreater(len(group_by_newsfeed_db([user.id for user in followers])), 1)
+
+        tweet = self.create_tweet(author)
+        NewsFeedServices.fanout_to_followers(tweet)
+        for user in followers + [author]:
+            for db in get_newsfeed_databases():
+                self.assertEqual(
+                    NewsFeed.objects.using(db).filter(user=user, tweet=tweet).count(),
+                    1 if db == get_newsfeed_db(user.id) else 0,
+                )
+
+        for follower in followers:
+            client = APIClient()
+            client.force_authenticate(follower)
+            response = client.get('/api/newsfeeds/')
+            self.assertEqual(
+                [item['tweet']['id'] for item in response.data['newsfeeds']],
+                [tweet.id],
+            )
@@ -0,0 +1,8 @@
+from django.contrib import admin
+from search.models import SearchPosting
+
+
+@admin.register(SearchPosting)
+class SearchPostingAdmin(admin.ModelAdmin):
+    list_display = ('term', 'tweet', 'tweet_created_at', 'term_frequency')
+    search_fields = ('term',)
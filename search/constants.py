@@ -0,0 +1,9 @@
+# search 相关配置的默认值，都可以在 settings 里用同名的配置覆盖
+
+# term 最长多少个字符，更长的截断
+SEARCH_TERM_MAX_LENGTH = 64
+# 一次搜索最多用多少个 term，多出来的忽略
+SEARCH_MAX_QUERY_TERMS = 5
+# 每个 term 只看最新的多少条 posting(走 (term, tweet_created_at) 索引)，
+# 搜索结果是在这些候选的 tweets 里排序翻页的，所以翻得再深也不会扫整个 term 的 posting
+SEARCH_CANDIDATES_PER_TERM = 1000
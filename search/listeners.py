@@ -0,0 +1,12 @@
+def index_tweet(sender, instance, **kwargs):
+    # import 写在里面避免循环依赖
+    from search.tasks import index_tweet_task
+    index_tweet_task.delay(tweet_id=instance.id)
+
+
+def remove_tweet_postings(sender, instance, **kwargs):
+    # 一条 tweet 的 posting 最多是它的词的个数，直接同步删掉，走 tweet 外键的索引
+    # 在 pre_delete 里删，SET_NULL 的时候就没有要更新的 posting 了
+    # import 写在里面避免循环依赖
+    from search.services import SearchService
+    SearchService.remove_tweets([instance.id])
@@ -0,0 +1,41 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from search.services import SearchService
+from tweets.models import Tweet
+from utils.iterators import chunked
+
+
+class Command(BaseCommand):
+    help = (
+        'Build the search postings of existing tweets, walking the tweets table '
+        'in primary key order'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        # 中断之后可以从上次处理到的 id 接着跑
+        parser.add_argument('--start-id', type=int, default=0)
+
+    def handle(self, *args, **options):
+        started_at = time.monotonic()
+        indexed = 0
+        tweets = Tweet.objects.filter(
+            id__gt=options['start_id'],
+        ).order_by('id').only('id', 'content', 'created_at').iterator(
+            chunk_size=options['batch_size'],
+        )
+        for batch in chunked(tweets, options['batch_size']):
+            SearchService.index_tweets(batch)
+            indexed += len(batch)
+            if options['verbosity'] > 1:
+                self.stdout.write('indexed up to id {}'.format(batch[-1].id))
+        elapsed = time.monotonic() - started_at
+
+        if options['verbosity'] > 0:
+            self.stdout.write('Done, indexed {} tweets in {:.2f}s ({:.0f} tweets/s)'.format(
+                indexed,
+                elapsed,
+                indexed / elapsed if elapsed else 0,
+            ))
@@ -0,0 +1,30 @@
+# Generated by Django 3.1.3 on 2026-10-18 11:05
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ('tweets', '0004_tweet_likes_count_sharded'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchPosting',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('term', models.CharField(max_length=64)),
+                ('tweet_created_at', models.DateTimeField()),
+                ('term_frequency', models.PositiveIntegerField(default=1)),
+                ('tweet', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='tweets.tweet')),
+            ],
+            options={
+                'unique_together': {('term', 'tweet')},
+                'index_together': {('term', 'tweet_created_at')},
+            },
+        ),
+    ]
@@ -0,0 +1,32 @@
+from django.db import models
+from django.db.models.signals import post_save, pre_delete
+
+from search.constants import SEARCH_TERM_MAX_LENGTH
+from search.listeners import index_tweet, remove_tweet_postings
+from tweets.models import Tweet
+
+
+class SearchPosting(models.Model):
+    """
+    tweet 内容的倒排索引: 每个 (term, tweet) 一行
+    同一个 term 的 posting 按 tweet 的发布时间排序(冗余存储的 tweet_created_at)，
+    搜索的时候只需要顺着 (term, tweet_created_at) 索引读最新的一段，不用 LIKE '%term%' 扫 tweet 表
+    """
+    term = models.CharField(max_length=SEARCH_TERM_MAX_LENGTH)
+    # 不用 CASCADE: tweet 被删除之前 listener 先把它的 posting 删掉(见 remove_tweet_postings)
+    tweet = models.ForeignKey(Tweet, on_delete=models.SET_NULL, null=True)
+    tweet_created_at = models.DateTimeField()
+    # term 在这条 tweet 里出现了几次
+    term_frequency = models.PositiveIntegerField(default=1)
+
+    class Meta:
+        unique_together = (('term', 'tweet'),)
+        index_together = (('term', 'tweet_created_at'),)
+
+    def __str__(self):
+        return '{} -> tweet {}'.format(self.term, self.tweet_id)
+
+
+# tweet 发布/修改之后异步更新它的 posting，删除之前把它的 posting 删掉
+post_save.connect(index_tweet, sender=Tweet)
+pre_delete.connect(remove_tweet_postings, sender=Tweet)
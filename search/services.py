@@ -0,0 +1,94 @@
+from collections import Counter
+
+from django.conf import settings
+from django.db import transaction
+
+from search import constants
+from search.models import SearchPosting
+from search.tokenizer import tokenize
+
+
+class SearchService(object):
+
+    @classmethod
+    def index_tweets(cls, tweets):
+        """
+        重建一组 tweets 的 posting，一条 DELETE + 一条 bulk INSERT
+        重复执行的结果是一样的(job 失败重试也没关系)
+        """
+        postings = []
+        for tweet in tweets:
+            postings.extend(
+                SearchPosting(
+                    term=term,
+                    tweet_id=tweet.id,
+                    tweet_created_at=tweet.created_at,
+                    term_frequency=frequency,
+                )
+                for term, frequency in Counter(tokenize(tweet.content)).items()
+            )
+        with transaction.atomic():
+            SearchPosting.objects.filter(tweet_id__in=[tweet.id for tweet in tweets]).delete()
+            SearchPosting.objects.bulk_create(postings)
+
+    @classmethod
+    def index_tweet(cls, tweet):
+        cls.index_tweets([tweet])
+
+    @classmethod
+    def remove_tweets(cls, tweet_ids):
+        SearchPosting.objects.filter(tweet_id__in=tweet_ids).delete()
+
+    @classmethod
+    def get_query_terms(cls, query):
+        max_terms = getattr(settings, 'SEARCH_MAX_QUERY_TERMS', constants.SEARCH_MAX_QUERY_TERMS)
+        # 去重，保留第一次出现的顺序
+        return list(dict.fromkeys(tokenize(query)))[:max_terms]
+
+    @classmethod
+    def search(cls, query, limit, cursor=None):
+        """
+        返回按 (score, tweet_created_at, tweet_id) 倒序排好的最多 limit 个 (tweet_id, tweet_created_at, score)
+        score 是 tweet 命中了几个不同的 query term: 所有词都命中的排在最前面，同样分数的新的在前
+        cursor 是上一页最后一条的 {'score', 'created_at', 'id'}，只往旧(分数低)的方向翻
+
+        每个 term 一条 query，顺着 (term, tweet_created_at) 索引读最新的 SEARCH_CANDIDATES_PER_TERM 条 posting，
+        打分和翻页都在内存里做 -> 不管 term 有多常见，扫描的数据量都是固定的
+        代价是只能搜到每个 term 最新的那一段 posting 里的 tweets
+        """
+        terms = cls.get_query_terms(query)
+        if not terms:
+            return []
+        candidates_per_term = getattr(
+            settings,
+            'SEARCH_CANDIDATES_PER_TERM',
+            constants.SEARCH_CANDIDATES_PER_TERM,
+        )
+
+        scores = Counter()
+        created_at_by_tweet_id = {}
+        for term in terms:
+            # tweet 已经被删掉的 posting(tweet_id 是 NULL)跳过
+            postings = SearchPosting.objects.filter(
+                term=term,
+                tweet_id__isnull=False,
+            ).order_by(
+                '-tweet_created_at',
+            ).values_list('tweet_id', 'tweet_created_at')[:candidates_per_term]
+            for tweet_id, tweet_created_at in postings:
+                scores[tweet_id] += 1
+                created_at_by_tweet_id[tweet_id] = tweet_created_at
+
+        results = [
+            (tweet_id, created_at_by_tweet_id[tweet_id], score)
+            for tweet_id, score in scores.items()
+        ]
+        if cursor is not None:
+            cursor_key = (cursor['score'], cursor['created_at'], cursor['id'] or 0)
+            results = [
+                result
+                for result in results
+                if (result[2], result[1], result[0]) < cursor_key
+            ]
+        results.sort(key=lambda result: (result[2], result[1], result[0]), reverse=True)
+        return results[:limit]
@@ -0,0 +1,12 @@
+from jobs.decorators import job
+from search.services import SearchService
+from tweets.models import Tweet
+
+
+@job(name='search.index_tweet')
+def index_tweet_task(tweet_id):
+    # 任务可能在 tweet 被删除之后才执行
+    tweet = Tweet.objects.filter(id=tweet_id).first()
+    if tweet is None:
+        return
+    SearchService.index_tweet(tweet)
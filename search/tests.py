@@ -0,0 +1,86 @@
+from io import StringIO
+
+from django.core.management import call_command
+
+from search.models import SearchPosting
+from search.services import SearchService
+from search.tokenizer import tokenize
+from testing.testcases import TestCase
+
+
+class TokenizerTests(TestCase):
+
+    def test_tokenize(self):
+        self.assertEqual(
+            tokenize('Hello, World! hello_world 2021'),
+            ['hello', 'world', 'hello_world', '2021'],
+        )
+        # 中文切成 bigram，单个汉字就是它自己
+        self.assertEqual(tokenize('今天天气 好'), ['今天', '天天', '天气', '好'])
+        self.assertEqual(tokenize('a' * 100), ['a' * 64])
+        self.assertEqual(tokenize('...'), [])
+
+
+class SearchServiceTests(TestCase):
+
+    def setUp(self):
+        self.user = self.create_user('searcher')
+
+    def _search(self, query, limit=10, cursor=None):
+        return [
+            (tweet_id, score)
+            for tweet_id, _, score in SearchService.search(query, limit, cursor)
+        ]
+
+    def test_index_on_create_and_delete(self):
+        tweet = self.create_tweet(self.user, 'Django django rocks')
+        self.assertEqual(
+            dict(SearchPosting.objects.filter(tweet=tweet).values_list('term', 'term_frequency')),
+            {'django': 2, 'rocks': 1},
+        )
+        # 修改之后重建
+        tweet.content = 'python rocks'
+        tweet.save()
+        self.assertEqual(
+            set(SearchPosting.objects.filter(tweet=tweet).values_list('term', flat=True)),
+            {'python', 'rocks'},
+        )
+        tweet.delete()
+        self.assertEqual(SearchPosting.objects.count(), 0)
+
+    def test_skip_postings_without_tweet(self):
+        kept = self.create_tweet(self.user, 'django kept')
+        orphan = self.create_tweet(self.user, 'django orphan')
+        # pre_delete 之后异步的索引任务又写进来的 posting，tweet 删掉的时候会被 SET_NULL
+        SearchPosting.objects.filter(tweet=orphan).update(tweet=None)
+        self.assertEqual(self._search('django'), [(kept.id, 1)])
+
+    def test_search_ranking(self):
+        both_old = self.create_tweet(self.user, 'django and python')
+        django = self.create_tweet(self.user, 'just django')
+        both_new = self.create_tweet(self.user, 'Python, Django!')
+        self.create_tweet(self.user, 'nothing relevant')
+
+        self.assertEqual(self._search('django python'), [
+            (both_new.id, 2),
+            (both_old.id, 2),
+            (django.id, 1),
+        ])
+        self.assertEqual(self._search('?!'), [])
+        self.assertEqual(self._search('rust'), [])
+
+        # 按上一页最后一条的 (score, created_at, id) 往下翻
+        cursor = {'score': 2, 'created_at': both_old.created_at, 'id': both_old.id}
+        self.assertEqual(self._search('django python', cursor=cursor), [(django.id, 1)])
+
+    def test_candidates_per_term(self):
+        tweets = [self.create_tweet(self.user, 'django {}'.format(i)) for i in range(3)]
+        with self.settings(SEARCH_CANDIDATES_PER_TERM=2):
+            self.assertEqual(self._search('django'), [(tweets[2].id, 1), (tweets[1].id, 1)])
+
+    def test_rebuild_search_index(self):
+        tweets = [self.create_tweet(self.user, 'tweet {}'.format(i)) for i in range(5)]
+        SearchPosting.objects.all().delete()
+        call_command('rebuild_search_index', batch_size=2, stdout=StringIO())
+        self.assertEqual(SearchPosting.objects.filter(term='tweet').count(), 5)
+        self.assertEqual(self._search('3'), [(tweets[3].id, 1)])
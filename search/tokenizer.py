@@ -0,0 +1,26 @@
+import re
+
+from django.conf import settings
+
+from search import constants
+
+# 连续的字母/数字/下划线 或者 连续的汉字
+TOKEN_RE = re.compile(r'[^\W\u4e00-\u9fff]+|[\u4e00-\u9fff]+')
+CJK_RE = re.compile(r'[\u4e00-\u9fff]')
+
+
+def tokenize(text):
+    """
+    把一段文本切成 term 的 list(可能有重复)，建索引和搜索用的是同一个 tokenizer
+    - 英文 / 数字: 按空格和标点切开，转成小写
+    - 中文: 没有空格可以分词，连续的汉字切成相邻两个字的 bigram，只有一个字的就是它自己
+      比如 '今天天气' -> ['今天', '天天', '天气']
+    """
+    max_length = getattr(settings, 'SEARCH_TERM_MAX_LENGTH', constants.SEARCH_TERM_MAX_LENGTH)
+    terms = []
+    for token in TOKEN_RE.findall(text.lower()):
+        if CJK_RE.match(token) and len(token) > 1:
+            terms.extend(token[i:i + 2] for i in range(len(token) - 1))
+        else:
+            terms.append(token[:max_length])
+    return terms
@@ -1,17 +1,71 @@
 from django.contrib.auth.models import User
 from django.contrib.contenttypes.models import ContentType
-from django.test import TestCase as DjangoTestCase
+from django.core.cache import caches
+from django.db import connections
+from django.test import TestCase as DjangoTestCase, override_settings
 from rest_framework.test import APIClient
 
-from comments.models import Comment
+from comments.services import CommentService
 from likes.models import Like
+from likes.services import LikeService
 from newsfeeds.models import NewsFeed
+from newsfeeds.routers import get_newsfeed_databases, get_newsfeed_db
 from tweets.models import Tweet
 
 
 # 重写了Django自己的TestCase类 -> 实现一些所有test都需要的做的
 # 实现：1. 创建测试用户 2. 发布测试推特
+# 测试的时候异步任务(jobs)直接同步执行，不需要另外跑 worker
+# 测试的时候 DEBUG 是 False，snowflake 的 worker id 要显式配置
+@override_settings(JOBS_ALWAYS_EAGER=True, SNOWFLAKE_WORKER_ID=0)
 class TestCase(DjangoTestCase):
+    # newsfeed 分库(NEWSFEED_DATABASES)之后 newsfeed 会写到其它的数据库里，所有数据库都要在事务里回滚
+    databases = '__all__'
+
+    def _pre_setup(self):
+        super(TestCase, self)._pre_setup()
+        # 数据库每个 test 之后会回滚，但是缓存不会，要清空，不然会读到上一个 test 的数据
+        self.clear_cache()
+        for alias in self._databases_names(include_mirrors=False):
+            self.run_commit_hooks_outside_test_transaction(connections[alias])
+
+    def _post_teardown(self):
+        for alias in self._databases_names(include_mirrors=False):
+            connection = connections[alias]
+            del connection.on_commit
+            del connection.savepoint_commit
+        super(TestCase, self)._post_teardown()
+
+    def run_commit_hooks_outside_test_transaction(self, connection):
+        # 每个 test 都跑在一个不会提交的事务里，transaction.on_commit 注册的回调永远不会执行
+        # 把 test 自己的事务当作不存在: 不在业务代码的 atomic 里就直接执行，
+        # 业务代码最外层的 atomic 成功退出就相当于提交了，执行等着的回调
+        # 被回滚的 savepoint 里注册的回调 django 自己会丢掉
+        test_depth = len(connection.savepoint_ids)
+        on_commit = connection.on_commit
+        savepoint_commit = connection.savepoint_commit
+
+        def run_commit_hooks():
+            while connection.run_on_commit:
+                _, func = connection.run_on_commit.pop(0)
+                func()
+
+        def on_commit_outside_test_transaction(func):
+            on_commit(func)
+            if len(connection.savepoint_ids) == test_depth:
+                run_commit_hooks()
+
+        def savepoint_commit_outside_test_transaction(sid):
+            savepoint_commit(sid)
+            if len(connection.savepoint_ids) == test_depth:
+                run_commit_hooks()
+
+        connection.on_commit = on_commit_outside_test_transaction
+        connection.savepoint_commit = savepoint_commit_outside_test_transaction
+
+    def clear_cache(self):
+        for cache in caches.all():
+            cache.clear()
 
     def create_user(self, username, email=None, password=None):
         if password is None:
@@ -27,10 +81,11 @@ class TestCase(DjangoTestCase):
             content = 'default tweet content'
         return Tweet.objects.create(user=user, content=content)
 
-    def create_comment(self, user, tweet, content=None):
+    def create_comment(self, user, tweet, content=None, parent=None):
         if content is None:
             content = 'default comment content'
-        return Comment.objects.create(user=user, tweet=tweet, content=content)
+        # 和 CommentViewSet.create 一样更新冗余的评论数 / 回复数
+        return CommentService.create_comment(user.id, tweet.id, content, parent)
 
     def create_user_and_client(self, *args, **kwargs):
         user = self.create_user(*args, **kwargs)
@@ -47,12 +102,31 @@ class TestCase(DjangoTestCase):
         return self._anonymous_client
 
     def create_newsfeed(self, user, tweet):
-        return NewsFeed.objects.create(user=user, tweet=tweet)
+        return NewsFeed.objects.using(get_newsfeed_db(user.id)).create(
+            user=user,
+            tweet=tweet,
+            tweet_created_at=tweet.created_at,
+            tweet_user_id=tweet.user_id,
+        )
+
+    def get_newsfeeds(self, user):
+        # newsfeed 按 user 分库，要去 user 所在的库里查
+        return NewsFeed.objects.using(get_newsfeed_db(user.id)).filter(user=user)
+
+    def count_newsfeeds(self, **filters):
+        # 不知道在哪个库里的时候(比如一条 tweet fanout 出去的 newsfeed)，所有的库加起来
+        return sum(
+            NewsFeed.objects.using(db).filter(**filters).count()
+            for db in get_newsfeed_databases()
+        )
 
     def create_like(self, user, target):
-        instance, _ = Like.objects.get_or_create(
+        instance, created = Like.objects.get_or_create(
             content_type=ContentType.objects.get_for_model(target.__class__),
             object_id=target.id,
             user=user,
         )
+        # 和 LikeSerializerForCreate.get_or_create 一样更新冗余的点赞数
+        if created:
+            LikeService.change_likes_count(target.__class__, target.id, 1)
         return instance
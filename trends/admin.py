@@ -0,0 +1,9 @@
+from django.contrib import admin
+from trends.models import TweetHashtag
+
+
+@admin.register(TweetHashtag)
+class TweetHashtagAdmin(admin.ModelAdmin):
+    list_display = ('hashtag', 'tweet', 'created_at')
+    date_hierarchy = 'created_at'
+    search_fields = ('hashtag',)
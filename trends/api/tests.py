@@ -0,0 +1,40 @@
+from io import StringIO
+
+from django.core.management import call_command
+
+from testing.testcases import TestCase
+
+TWEET_CREATE_API = '/api/tweets/'
+TRENDS_API = '/api/trends/'
+
+
+class TrendApiTests(TestCase):
+
+    def setUp(self):
+        self.user, self.client = self.create_user_and_client('tagger')
+
+    def test_list(self):
+        response = self.anonymous_client.get(TRENDS_API)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['window'], '1h')
+        self.assertEqual(response.data['trends'], [])
+        self.assertIsNone(response.data['computed_at'])
+
+        response = self.anonymous_client.get(TRENDS_API, {'window': '5m'})
+        self.assertEqual(response.status_code, 400)
+
+        # 发 tweet 的时候解析 hashtag，refresh_trends 之后才会出现在快照里
+        for content in ('hello #Django', '#django and #python', 'just #python'):
+            response = self.client.post(TWEET_CREATE_API, {'content': content})
+            self.assertEqual(response.status_code, 201)
+        self.client.post(TWEET_CREATE_API, {'content': 'more #django'})
+        self.assertEqual(self.anonymous_client.get(TRENDS_API).data['trends'], [])
+
+        call_command('refresh_trends', stdout=StringIO())
+        for window in ('1h', '24h'):
+            response = self.anonymous_client.get(TRENDS_API, {'window': window})
+            self.assertEqual(response.data['trends'], [
+                {'hashtag': 'django', 'count': 3},
+                {'hashtag': 'python', 'count': 2},
+            ])
+            self.assertIsNotNone(response.data['computed_at'])
@@ -0,0 +1,30 @@
+from django.conf import settings
+from rest_framework import viewsets, status
+from rest_framework.permissions import AllowAny
+from rest_framework.response import Response
+from trends import constants
+from trends.services import TrendService
+
+
+class TrendViewSet(viewsets.ViewSet):
+    permission_classes = [AllowAny]
+
+    def list(self, request):
+        # /api/trends/?window=1h -> 直接返回 refresh_trends 定期写到缓存里的快照
+        windows = getattr(settings, 'TRENDS_WINDOWS', constants.TRENDS_WINDOWS)
+        window = request.query_params.get(
+            'window',
+            getattr(settings, 'TRENDS_DEFAULT_WINDOW', constants.TRENDS_DEFAULT_WINDOW),
+        )
+        if window not in windows:
+            return Response({
+                'success': False,
+                'message': 'window should be one of {}'.format(', '.join(windows)),
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        snapshot = TrendService.get_trends(window)
+        return Response({
+            'window': window,
+            'trends': snapshot['trends'],
+            'computed_at': snapshot['computed_at'],
+        }, status=status.HTTP_200_OK)
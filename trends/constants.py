@@ -0,0 +1,26 @@
+# trends 相关配置的默认值，都可以在 settings 里用同名的配置覆盖
+
+HASHTAG_MAX_LENGTH = 64
+
+# 滑动窗口: 名字 -> (窗口长度, 每个桶的长度)，单位是秒
+# 1h 的窗口按分钟分桶，24h 的窗口按小时分桶，窗口每次滑动一个桶
+TRENDS_WINDOWS = {
+    '1h': (3600, 60),
+    '24h': (86400, 3600),
+}
+TRENDS_DEFAULT_WINDOW = '1h'
+
+# count-min sketch 的大小: 每个桶 depth 行 width 列的计数器，估计的误差和 width 成反比
+TRENDS_SKETCH_WIDTH = 2048
+TRENDS_SKETCH_DEPTH = 4
+# 每个窗口最多跟踪多少个候选的热门 hashtag，快照里返回前多少个
+TRENDS_CANDIDATES = 100
+TRENDS_TOP_K = 10
+
+# refresh_trends 每次往回多读多少秒的 hashtag，覆盖读的时候还没提交的事务
+# 比这个还晚提交的 hashtag 不会被统计
+TRENDS_CONSUME_OVERLAP = 60
+
+# 快照存在 settings.CACHES 里的哪个 cache，refresh_trends 停了之后多久过期
+TRENDS_CACHE_ALIAS = 'default'
+TRENDS_SNAPSHOT_TIMEOUT = 3600
@@ -0,0 +1,37 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from trends.services import TrendService
+
+
+class Command(BaseCommand):
+    help = (
+        'Count recent hashtags in memory with sliding-window count-min sketches '
+        'and publish the trending snapshot to the cache'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument(
+            '--interval',
+            type=float,
+            default=None,
+            help='Keep refreshing every INTERVAL seconds instead of exiting',
+        )
+
+    def handle(self, *args, **options):
+        # 统计的状态只在这个进程的内存里，启动的时候从最大的窗口的开始时间重放 hashtag
+        tracker = TrendService.create_tracker()
+        cursor = None
+        while True:
+            started_at = time.monotonic()
+            cursor = TrendService.refresh(tracker, cursor, options['batch_size'])
+            if options['verbosity'] > 0:
+                self.stdout.write('Refreshed trends up to {} in {:.2f}s'.format(
+                    cursor.since.isoformat(),
+                    time.monotonic() - started_at,
+                ))
+            if options['interval'] is None:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,29 @@
+# Generated by Django 3.1.3 on 2026-10-18 11:08
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ('tweets', '0004_tweet_likes_count_sharded'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TweetHashtag',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hashtag', models.CharField(max_length=64)),
+                ('created_at', models.DateTimeField(db_index=True)),
+                ('tweet', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='tweets.tweet')),
+            ],
+            options={
+                'unique_together': {('tweet', 'hashtag')},
+                'index_together': {('hashtag', 'created_at')},
+            },
+        ),
+    ]
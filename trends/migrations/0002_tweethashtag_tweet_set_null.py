@@ -0,0 +1,20 @@
+# Generated by Django 3.1.3 on 2026-10-18 12:18
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tweets', '0006_tweetphoto'),
+        ('trends', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='tweethashtag',
+            name='tweet',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, to='tweets.tweet'),
+        ),
+    ]
@@ -0,0 +1,24 @@
+from django.db import models
+
+from trends.constants import HASHTAG_MAX_LENGTH
+from tweets.models import Tweet
+
+
+class TweetHashtag(models.Model):
+    """
+    tweet 里出现的 hashtag，发 tweet 的时候解析出来
+    refresh_trends 顺着 created_at 索引增量地读，不需要 GROUP BY
+    """
+    # 不用 CASCADE，tweet 被删掉之后 tweet 是 NULL，refresh_trends 会跳过
+    tweet = models.ForeignKey(Tweet, on_delete=models.SET_NULL, null=True)
+    # 统一转成小写
+    hashtag = models.CharField(max_length=HASHTAG_MAX_LENGTH)
+    # 冗余存储的 tweet 的发布时间，refresh_trends 按这个时间增量地读
+    created_at = models.DateTimeField(db_index=True)
+
+    class Meta:
+        unique_together = (('tweet', 'hashtag'),)
+        index_together = (('hashtag', 'created_at'),)
+
+    def __str__(self):
+        return '#{} in tweet {}'.format(self.hashtag, self.tweet_id)
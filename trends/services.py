@@ -0,0 +1,154 @@
+import re
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models import Q
+
+from trends import constants
+from trends.models import TweetHashtag
+from trends.sketch import TrendTracker
+from utils.time_helpers import utc_now
+
+# '#' 前面不能是字母数字(排除 a#b 和 &#123; 这种)，后面是连续的字母/数字/下划线(包括中文)
+HASHTAG_RE = re.compile(r'(?<![\w&])#(\w+)')
+
+
+class HashtagCursor(object):
+    """
+    refresh_trends 读 hashtag 的进度，只在这个进程的内存里
+    since: 上一次开始读的时间，seen: 重叠的时间段里已经读过的 hashtag 的 {id: created_at}
+    """
+
+    def __init__(self, since):
+        self.since = since
+        self.seen = {}
+
+
+class TrendService(object):
+
+    @classmethod
+    def _get_setting(cls, name):
+        return getattr(settings, name, getattr(constants, name))
+
+    @classmethod
+    def extract_hashtags(cls, content):
+        # 转成小写，去重之后保留第一次出现的顺序
+        max_length = cls._get_setting('HASHTAG_MAX_LENGTH')
+        return list(dict.fromkeys(
+            hashtag.lower()[:max_length]
+            for hashtag in HASHTAG_RE.findall(content)
+        ))
+
+    @classmethod
+    def record_hashtags(cls, tweet):
+        # 发 tweet 的时候调用，一条 bulk INSERT
+        hashtags = cls.extract_hashtags(tweet.content)
+        if not hashtags:
+            return []
+        TweetHashtag.objects.bulk_create([
+            TweetHashtag(tweet_id=tweet.id, hashtag=hashtag, created_at=tweet.created_at)
+            for hashtag in hashtags
+        ], ignore_conflicts=True)
+        return hashtags
+
+    # ---------------------------------------------------------------------
+    # 热门话题: refresh_trends 进程在内存里用 TrendTracker 统计，定期把快照写到缓存里
+    # API 只读快照，不会对 hashtag 表做 GROUP BY
+    # ---------------------------------------------------------------------
+    @classmethod
+    def create_tracker(cls):
+        return TrendTracker(
+            cls._get_setting('TRENDS_WINDOWS'),
+            cls._get_setting('TRENDS_SKETCH_WIDTH'),
+            cls._get_setting('TRENDS_SKETCH_DEPTH'),
+            cls._get_setting('TRENDS_CANDIDATES'),
+        )
+
+    @classmethod
+    def consume_hashtags(cls, tracker, cursor=None, batch_size=1000):
+        """
+        把上次读过之后新出现的 hashtag 喂给 tracker，返回更新过的 cursor
+        cursor=None 表示刚启动，从最大的窗口的开始时间重放
+
+        hashtag 在 tweet 的事务里写入，id / created_at 都是提交之前就定了的，
+        晚提交的行会出现在已经读过的位置之前，只按 id > last_id 往后读会漏掉
+        所以每次都往回多读 TRENDS_CONSUME_OVERLAP 秒(按 created_at 索引)，
+        重叠部分读到的 id 在 cursor.seen 里去重，不会重复计数
+        提交得比 TRENDS_CONSUME_OVERLAP 还晚的 hashtag 仍然会漏掉
+        """
+        overlap = timedelta(seconds=cls._get_setting('TRENDS_CONSUME_OVERLAP'))
+        if cursor is None:
+            cursor = HashtagCursor(utc_now() - timedelta(seconds=tracker.max_window))
+        # 这次开始读之前提交的 hashtag 都能读到，下次从这个时间往回重叠
+        started_at = utc_now()
+
+        # tweet 已经被删掉的 hashtag 不统计
+        queryset = TweetHashtag.objects.filter(
+            created_at__gte=cursor.since - overlap,
+            tweet_id__isnull=False,
+        )
+        last = None
+        while True:
+            batch = queryset
+            if last is not None:
+                batch = batch.filter(Q(created_at__gt=last[0]) | Q(created_at=last[0], id__gt=last[1]))
+            rows = list(batch.order_by('created_at', 'id').values_list(
+                'id',
+                'hashtag',
+                'created_at',
+            )[:batch_size])
+            for hashtag_id, hashtag, created_at in rows:
+                if hashtag_id in cursor.seen:
+                    continue
+                cursor.seen[hashtag_id] = created_at
+                tracker.add(hashtag, created_at.timestamp())
+            if len(rows) < batch_size:
+                break
+            last = (rows[-1][2], rows[-1][0])
+
+        cursor.since = started_at
+        # 下次不会再读到的部分不用再记着
+        cursor.seen = {
+            hashtag_id: created_at
+            for hashtag_id, created_at in cursor.seen.items()
+            if created_at >= cursor.since - overlap
+        }
+        return cursor
+
+    @classmethod
+    def refresh(cls, tracker, cursor=None, batch_size=1000):
+        """
+        读新增的 hashtag，窗口滑到现在，然后写快照，返回更新过的 cursor
+        """
+        cursor = cls.consume_hashtags(tracker, cursor, batch_size)
+        now = utc_now()
+        tracker.advance(now.timestamp())
+        snapshot = {
+            name: [{'hashtag': hashtag, 'count': count} for hashtag, count in top]
+            for name, top in tracker.top(cls._get_setting('TRENDS_TOP_K')).items()
+        }
+        cls.get_cache().set_many(
+            {
+                cls.get_snapshot_key(name): {'trends': trends, 'computed_at': now}
+                for name, trends in snapshot.items()
+            },
+            cls._get_setting('TRENDS_SNAPSHOT_TIMEOUT'),
+        )
+        return cursor
+
+    @classmethod
+    def get_cache(cls):
+        return caches[cls._get_setting('TRENDS_CACHE_ALIAS')]
+
+    @classmethod
+    def get_snapshot_key(cls, window):
+        return 'trends:snapshot:{}'.format(window)
+
+    @classmethod
+    def get_trends(cls, window):
+        # 快照还没有生成(或者 refresh_trends 停了太久)的时候返回空的
+        return cls.get_cache().get(
+            cls.get_snapshot_key(window),
+            {'trends': [], 'computed_at': None},
+        )
@@ -0,0 +1,134 @@
+import heapq
+import zlib
+from array import array
+
+
+class CountMinSketch(object):
+    """
+    count-min sketch: depth 行 width 列的计数器，每行用不同的 hash 把 item 映射到一列
+    估计值 = 各行对应计数器的最小值，只会多估不会少估，内存大小和 item 的个数无关
+    计数都是非负的，所以减掉之前加上的部分(窗口滑过去的桶)之后估计值仍然成立
+    """
+
+    def __init__(self, width, depth):
+        self.width = width
+        self.depth = depth
+        self.rows = [array('q', [0]) * width for _ in range(depth)]
+
+    def _get_columns(self, item):
+        # crc32 在不同进程里的结果是一样的(python 的 hash() 每个进程不一样)
+        return [
+            zlib.crc32('{}:{}'.format(row, item).encode('utf-8')) % self.width
+            for row in range(self.depth)
+        ]
+
+    def add(self, item, count=1):
+        for row, column in zip(self.rows, self._get_columns(item)):
+            row[column] += count
+
+    def estimate(self, item):
+        return min(row[column] for row, column in zip(self.rows, self._get_columns(item)))
+
+    def merge(self, other, sign=1):
+        for row, other_row in zip(self.rows, other.rows):
+            for column, count in enumerate(other_row):
+                if count:
+                    row[column] += sign * count
+
+
+class SlidingWindowTopK(object):
+    """
+    最近 window 秒里出现次数最多的 item
+    - 每 bucket 秒一个 count-min sketch，另外维护一个整个窗口的总和，桶滑出窗口的时候从总和里减掉
+    - 候选的热门 item 最多 capacity 个，满了之后新的 item 估计值比最小的大才替换进来
+    """
+
+    def __init__(self, window, bucket, width, depth, capacity):
+        self.window = window
+        self.bucket = bucket
+        self.width = width
+        self.depth = depth
+        self.capacity = capacity
+        # 桶的开始时间 -> 桶里的 sketch
+        self.buckets = {}
+        self.total = CountMinSketch(width, depth)
+        # item -> 窗口里的估计值
+        self.candidates = {}
+        self.now = 0
+
+    def _get_bucket_start(self, timestamp):
+        return int(timestamp) // self.bucket * self.bucket
+
+    def _is_expired(self, bucket_start):
+        return bucket_start + self.bucket <= self.now - self.window
+
+    def add(self, item, timestamp, count=1):
+        bucket_start = self._get_bucket_start(timestamp)
+        if self._is_expired(bucket_start):
+            # 已经滑出窗口了(比如重放的时候读到的太旧的数据)
+            return
+        if bucket_start not in self.buckets:
+            self.buckets[bucket_start] = CountMinSketch(self.width, self.depth)
+        self.buckets[bucket_start].add(item, count)
+        self.total.add(item, count)
+
+        estimate = self.total.estimate(item)
+        if item in self.candidates or len(self.candidates) < self.capacity:
+            self.candidates[item] = estimate
+            return
+        smallest = min(self.candidates, key=self.candidates.get)
+        if estimate > self.candidates[smallest]:
+            del self.candidates[smallest]
+            self.candidates[item] = estimate
+
+    def advance(self, timestamp):
+        """
+        窗口滑到 timestamp，滑出窗口的桶从总和里减掉，候选的估计值重新算
+        """
+        self.now = max(self.now, int(timestamp))
+        expired = [start for start in self.buckets if self._is_expired(start)]
+        if not expired:
+            return
+        for start in expired:
+            self.total.merge(self.buckets.pop(start), sign=-1)
+        for item in list(self.candidates):
+            estimate = self.total.estimate(item)
+            if estimate:
+                self.candidates[item] = estimate
+            else:
+                del self.candidates[item]
+
+    def top(self, k):
+        # 返回 [(item, 估计值), ...]，次数一样的按 item 排，保证结果是确定的
+        return heapq.nsmallest(
+            k,
+            self.candidates.items(),
+            key=lambda candidate: (-candidate[1], candidate[0]),
+        )
+
+
+class TrendTracker(object):
+    """
+    多个滑动窗口(比如 1h / 24h)一起统计 hashtag，由 refresh_trends 进程在内存里维护
+    """
+
+    def __init__(self, windows, width, depth, capacity):
+        self.windows = {
+            name: SlidingWindowTopK(window, bucket, width, depth, capacity)
+            for name, (window, bucket) in windows.items()
+        }
+
+    @property
+    def max_window(self):
+        return max(counter.window for counter in self.windows.values())
+
+    def add(self, hashtag, timestamp):
+        for counter in self.windows.values():
+            counter.add(hashtag, timestamp)
+
+    def advance(self, timestamp):
+        for counter in self.windows.values():
+            counter.advance(timestamp)
+
+    def top(self, k):
+        return {name: counter.top(k) for name, counter in self.windows.items()}
@@ -0,0 +1,140 @@
+from datetime import timedelta
+from io import StringIO
+
+from django.core.management import call_command
+
+from testing.testcases import TestCase
+from trends.models import TweetHashtag
+from trends.services import TrendService
+from trends.sketch import CountMinSketch, SlidingWindowTopK
+from utils.time_helpers import utc_now
+
+
+class HashtagTests(TestCase):
+
+    def test_extract_hashtags(self):
+        self.assertEqual(
+            TrendService.extract_hashtags('#Django and #python, #django again #中文 a#b &#123;'),
+            ['django', 'python', '中文'],
+        )
+        self.assertEqual(TrendService.extract_hashtags('no tags # here'), [])
+
+    def test_record_hashtags(self):
+        tweet = self.create_tweet(self.create_user('tagger'), '#A #b #a')
+        self.assertEqual(TrendService.record_hashtags(tweet), ['a', 'b'])
+        # 重复记录不会插入重复的数据
+        TrendService.record_hashtags(tweet)
+        self.assertEqual(TweetHashtag.objects.filter(tweet=tweet).count(), 2)
+
+
+class SketchTests(TestCase):
+
+    def test_count_min_sketch(self):
+        sketch = CountMinSketch(width=16, depth=4)
+        for i in range(100):
+            sketch.add('item{}'.format(i % 10))
+        sketch.add('hot', 50)
+        # 只会多估不会少估
+        for i in range(10):
+            self.assertGreaterEqual(sketch.estimate('item{}'.format(i)), 10)
+        self.assertGreaterEqual(sketch.estimate('hot'), 50)
+
+        other = CountMinSketch(width=16, depth=4)
+        other.add('hot', 20)
+        sketch.merge(other, sign=-1)
+        self.assertGreaterEqual(sketch.estimate('hot'), 30)
+
+    def test_sliding_window(self):
+        counter = SlidingWindowTopK(window=60, bucket=10, width=256, depth=4, capacity=2)
+        counter.advance(1000)
+        for _ in range(3):
+            counter.add('old', 995)
+        for _ in range(2):
+            counter.add('new', 1005)
+        counter.add('rare', 1005)
+        self.assertEqual(counter.top(5), [('old', 3), ('new', 2)])
+
+        # 'old' 所在的桶滑出窗口之后就不在候选里了
+        counter.advance(1060)
+        self.assertEqual(counter.top(5), [('new', 2)])
+        counter.add('rare', 1061)
+        counter.add('rare', 1062)
+        self.assertEqual(counter.top(1), [('rare', 3)])
+
+        # 已经滑出窗口的数据直接忽略
+        counter.add('ancient', 900)
+        self.assertNotIn('ancient', dict(counter.top(5)))
+
+
+class RefreshTrendsTests(TestCase):
+
+    def test_refresh(self):
+        user = self.create_user('tagger')
+        now = utc_now()
+        for content, hours_ago in (
+            ('#django #python', 0),
+            ('#django', 0),
+            ('#python', 2),
+            ('#python', 3),
+            ('#ancient', 30),
+        ):
+            tweet = self.create_tweet(user, content)
+            tweet.created_at = now - timedelta(hours=hours_ago)
+            tweet.save()
+            TrendService.record_hashtags(tweet)
+
+        tracker = TrendService.create_tracker()
+        cursor = TrendService.refresh(tracker)
+        self.assertEqual(set(cursor.seen), set(
+            TweetHashtag.objects.filter(created_at__gte=now - timedelta(minutes=1)).values_list('id', flat=True)
+        ))
+        self.assertEqual(TrendService.get_trends('1h')['trends'], [
+            {'hashtag': 'django', 'count': 2},
+            {'hashtag': 'python', 'count': 1},
+        ])
+        self.assertEqual(TrendService.get_trends('24h')['trends'], [
+            {'hashtag': 'python', 'count': 3},
+            {'hashtag': 'django', 'count': 2},
+        ])
+
+        # 增量地读新的 hashtag
+        tweet = self.create_tweet(user, '#rust #rust #rust')
+        TrendService.record_hashtags(tweet)
+        cursor = TrendService.refresh(tracker, cursor)
+        self.assertEqual(
+            [trend['hashtag'] for trend in TrendService.get_trends('1h')['trends']],
+            ['django', 'python', 'rust'],
+        )
+
+        # 上次读的时候还没提交的 hashtag(created_at 在上次读之前)也能读到，重叠部分不会重复计数
+        tweet = self.create_tweet(user, '#late')
+        tweet.created_at = cursor.since - timedelta(seconds=30)
+        tweet.save()
+        TrendService.record_hashtags(tweet)
+        TrendService.refresh(tracker, cursor)
+        self.assertEqual(
+            {trend['hashtag']: trend['count'] for trend in TrendService.get_trends('1h')['trends']},
+            {'django': 2, 'python': 1, 'rust': 1, 'late': 1},
+        )
+
+    def test_refresh_trends_command(self):
+        self.assertEqual(TrendService.get_trends('1h')['trends'], [])
+        call_command('refresh_trends', stdout=StringIO())
+        self.assertEqual(TrendService.get_trends('1h')['trends'], [])
+        self.assertIsNotNone(TrendService.get_trends('1h')['computed_at'])
+
+        TrendService.record_hashtags(self.create_tweet(self.create_user('tagger'), '#hello'))
+        call_command('refresh_trends', stdout=StringIO())
+        self.assertEqual(TrendService.get_trends('1h')['trends'], [{'hashtag': 'hello', 'count': 1}])
+
+    def test_skip_deleted_tweets(self):
+        user = self.create_user('tagger')
+        kept = self.create_tweet(user, '#kept')
+        deleted = self.create_tweet(user, '#deleted')
+        for tweet in (kept, deleted):
+            TrendService.record_hashtags(tweet)
+        deleted.delete()
+        self.assertTrue(TweetHashtag.objects.filter(tweet=None, hashtag='deleted').exists())
+
+        TrendService.refresh(TrendService.create_tracker())
+        self.assertEqual(TrendService.get_trends('1h')['trends'], [{'hashtag': 'kept', 'count': 1}])
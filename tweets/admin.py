@@ -1,5 +1,5 @@
 from django.contrib import admin
-from tweets.models import Tweet
+from tweets.models import Tweet, TweetPhoto
 
 
 @admin.register(Tweet)
@@ -11,3 +11,16 @@ class TweetAdmin(admin.ModelAdmin):
         'user',
         'content',
     )
+
+
+@admin.register(TweetPhoto)
+class TweetPhotoAdmin(admin.ModelAdmin):
+    date_hierarchy = 'created_at'
+    list_display = (
+        'created_at',
+        'tweet',
+        'user',
+        'file',
+        'status',
+    )
+    list_filter = ('status',)
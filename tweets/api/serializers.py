@@ -1,84 +1,174 @@
+from django.conf import settings
+from django.db import transaction
 from rest_framework import serializers
 from comments.api.serializers import CommentSerializer
 from likes.api.serializers import LikeSerializer
 from likes.services import LikeService
-from tweets.models import Tweet
+from trends.services import TrendService
+from tweets import constants
+from tweets.models import Tweet, TweetPhoto
+from tweets.photos import get_image_format
+from tweets.services import TweetPhotoService
 from accounts.api.serializers import UserSerializerForTweet
 
 
+class TweetPhotoSerializer(serializers.ModelSerializer):
+    url = serializers.SerializerMethodField()
+    status = serializers.CharField(source='get_status_display')
+    variants = serializers.SerializerMethodField()
+
+    class Meta:
+        model = TweetPhoto
+        fields = ('id', 'url', 'status', 'variants')
+
+    def get_url(self, obj):
+        return obj.file.url
+
+    # 缩略图还没有生成好(status 是 pending)的时候是空的，客户端先用原图
+    def get_variants(self, obj):
+        return {
+            name: obj.file.storage.url(path)
+            for name, path in obj.variants.items()
+        }
+
+
 class TweetSerializer(serializers.ModelSerializer):
     # 如果不写这个，下面field中展示user只会以user_id的形式展示
     # 用这个的话，user会被深入解析 -> 每个field也可以是serializer()
     user = UserSerializerForTweet()
+    # id 是 snowflake，比 2^53 大，JS 的 number 会丢精度，客户端应该用字符串形式的 id_str
+    id_str = serializers.CharField(source='id', read_only=True)
     # 返回通过计算后得到的数据 -> 定义field后还要定义get方法
     comments_count = serializers.SerializerMethodField()
     likes_count = serializers.SerializerMethodField()
     has_liked = serializers.SerializerMethodField()
+    photos = serializers.SerializerMethodField()
 
     class Meta:
         model = Tweet  # 展示的model类型
         # 展示的field
         fields = (
             'id',
+            'id_str',
             'user',
             'created_at',
             'content',
+            'photos',
             'comments_count',
             'likes_count',
             'has_liked',
         )
 
+    # 点赞数和评论数是冗余存在 tweet 上的，不需要 COUNT
     def get_comments_count(self, obj):
-        # comment_set是django帮忙定义的
-        return obj.comment_set.count()
+        return obj.comments_count
 
     def get_likes_count(self, obj):
-        return obj.like_set.count()
+        # 还要加上 write-behind 还没有写回数据库的增量 / 热门 tweet 的 shard 上的点赞数
+        if obj.id in self.context.get('likes_count_by_tweet_id', {}):
+            return self.context['likes_count_by_tweet_id'][obj.id]
+        return LikeService.get_likes_count(obj)
 
+    # 列表类的接口会用 TweetService.hydrate 把整页的数据批量查好放在 context 里
+    # context 里没有的时候(比如单条 tweet)再单独查
     def get_has_liked(self, obj):
+        if 'liked_tweet_ids' in self.context:
+            return obj.id in self.context['liked_tweet_ids']
         # obj: 当前的Tweet object
         # 需要获得当前登陆用户是否点赞 -> 当前登陆用户:
         # self.context['request'].user
         return LikeService.has_liked(self.context["request"].user, obj)
 
+    def get_photos(self, obj):
+        if 'photos_by_tweet_id' in self.context:
+            photos = self.context['photos_by_tweet_id'].get(obj.id, [])
+        else:
+            photos = TweetPhotoService.get_photos_by_tweet_ids([obj.id]).get(obj.id, [])
+        return TweetPhotoSerializer(photos, many=True).data
+
 
 class TweetSerializerForCreate(serializers.ModelSerializer):
     content = serializers.CharField(min_length=6, max_length=140)
+    # 用 multipart/form-data 上传，同一个 key 可以传多个文件
+    files = serializers.ListField(
+        child=serializers.FileField(),
+        required=False,
+        max_length=getattr(settings, 'TWEET_PHOTOS_MAX_COUNT', constants.TWEET_PHOTOS_MAX_COUNT),
+    )
 
     class Meta:
         model = Tweet
-        # 那些field是可以写进去的 -> 在发布tweet的时候只填content
-        fields = ('content',)
+        # 那些field是可以写进去的 -> 在发布tweet的时候只填content和图片
+        fields = ('content', 'files')
+
+    def validate_files(self, files):
+        # 只看文件大小和文件头，不在请求里解码图片
+        max_size = getattr(settings, 'TWEET_PHOTO_MAX_SIZE', constants.TWEET_PHOTO_MAX_SIZE)
+        for file in files:
+            if file.size > max_size:
+                raise serializers.ValidationError(
+                    'Each photo should be at most {} bytes.'.format(max_size),
+                )
+            if get_image_format(file) is None:
+                raise serializers.ValidationError(
+                    'Only JPEG, PNG, GIF and WebP photos are supported.',
+                )
+        return files
 
     def create(self, validated_data):
         # 获得请求的user
         user = self.context['request'].user
         # 获取content -> validated_data里获取
         content = validated_data['content']
-        tweet = Tweet.objects.create(user=user, content=content)
+        # tweet / hashtag / 图片要么都写进去要么都不写(job 也在数据库里，会一起回滚)
+        # 图片的文件不在事务里，保存失败的时候 create_photos 会把已经存下来的文件删掉
+        with transaction.atomic():
+            tweet = Tweet.objects.create(user=user, content=content)
+            # 解析出 #hashtag 记下来，refresh_trends 增量地读它们统计热门话题
+            TrendService.record_hashtags(tweet)
+            # 原图直接存下来，缩略图交给 job 生成
+            TweetPhotoService.create_photos(tweet, validated_data.get('files', []))
         return tweet
 
 
 class TweetSerializerForDetail(TweetSerializer):
-    # 用source
-    comments = CommentSerializer(source='comment_set', many=True)
-    likes = LikeSerializer(source='like_set', many=True)
+    # 不再用 source='comment_set' / 'like_set' 序列化全部的评论和点赞(热门 tweet 会有几万条)
+    # 只序列化 TweetService.get_detail_context 查好放在 context 里的第一页
+    comments = serializers.SerializerMethodField()
+    has_more_comments = serializers.SerializerMethodField()
+    likes = serializers.SerializerMethodField()
+    has_more_likes = serializers.SerializerMethodField()
 
     class Meta:
         model = Tweet
         fields = (
             'id',
+            'id_str',
             'user',
-            'comments',
             'created_at',
             'content',
-            'likes',
+            'photos',
             'comments',
+            'has_more_comments',
+            'likes',
+            'has_more_likes',
             'likes_count',
             'comments_count',
             'has_liked',
         )
 
+    def get_comments(self, obj):
+        return CommentSerializer(self.context['comments'], context=self.context, many=True).data
+
+    def get_has_more_comments(self, obj):
+        return self.context['has_more_comments']
+
+    def get_likes(self, obj):
+        return LikeSerializer(self.context['likes'], many=True).data
+
+    def get_has_more_likes(self, obj):
+        return self.context['has_more_likes']
+
 
 # class TweetSerializerForNewsFeed(serializers.ModelSerializer):
 #
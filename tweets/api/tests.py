@@ -1,12 +1,28 @@
+import os
+import shutil
+import tempfile
+from unittest import mock
+
+from django.db import connection
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
 from rest_framework.test import APIClient
 from testing.testcases import TestCase
-from tweets.models import Tweet
+from trends.models import TweetHashtag
+from tweets.models import Tweet, TweetPhoto
+from tweets.services import TweetPhotoService
+from tweets.tests import create_image_file
 
 
 # 要测试的API的URL -> 结尾一定要加"/" 不然会返回301 redirect
 TWEET_LIST_API = '/api/tweets/'
 TWEET_CREATE_API = '/api/tweets/'
 TWEET_RETRIEVE_API = '/api/tweets/{}/'
+TWEET_BATCH_API = '/api/tweets/batch/'
+TWEET_SEARCH_API = '/api/tweets/search/'
+TWEET_COMMENTS_API = '/api/tweets/{}/comments/'
+TWEET_LIKES_API = '/api/tweets/{}/likes/'
 
 
 # 用自己重写过带有create_user和create_tweet的TestCase类
@@ -53,6 +69,107 @@ class TweetApiTests(TestCase):
         self.assertEqual(response.data['tweets'][0]['id'], self.tweets2[1].id)
         self.assertEqual(response.data['tweets'][1]['id'], self.tweets2[0].id)
 
+    def test_list_refresh(self):
+        cursor_tweet = self.tweets1[-1]
+        newer = [self.create_tweet(self.user1) for _ in range(5)]
+        params = {
+            'user_id': self.user1.id,
+            'page_size': 2,
+            'created_at__gt': cursor_tweet.created_at.isoformat(),
+            'id__gt': cursor_tweet.id,
+        }
+        # 紧挨着 cursor 的两条，不是最新的两条
+        response = self.anonymous_client.get(TWEET_LIST_API, params)
+        self.assertEqual(
+            [tweet['id'] for tweet in response.data['tweets']],
+            [newer[1].id, newer[0].id],
+        )
+        self.assertEqual(response.data['has_next_page'], True)
+
+        params.update({'created_at__gt': newer[4].created_at.isoformat(), 'id__gt': newer[4].id})
+        response = self.anonymous_client.get(TWEET_LIST_API, params)
+        self.assertEqual(response.data['tweets'], [])
+        self.assertEqual(response.data['has_next_page'], False)
+
+        # 不带 id 的时候不会返回 cursor 那一条
+        del params['id__gt']
+        response = self.anonymous_client.get(TWEET_LIST_API, params)
+        self.assertEqual(response.data['tweets'], [])
+
+    def test_list_pagination(self):
+        tweets = self.tweets1 + [self.create_tweet(self.user1) for _ in range(3)]
+        response = self.anonymous_client.get(TWEET_LIST_API, {
+            'user_id': self.user1.id,
+            'page_size': 4,
+        })
+        self.assertEqual(
+            [tweet['id'] for tweet in response.data['tweets']],
+            [tweet.id for tweet in tweets[:1:-1]],
+        )
+        self.assertEqual(response.data['has_next_page'], True)
+
+        # 用上一页最后一条的 (created_at, id) 翻下一页
+        last = tweets[2]
+        response = self.anonymous_client.get(TWEET_LIST_API, {
+            'user_id': self.user1.id,
+            'page_size': 4,
+            'created_at__lt': last.created_at.isoformat(),
+            'id__lt': last.id,
+        })
+        self.assertEqual(
+            [tweet['id'] for tweet in response.data['tweets']],
+            [tweets[1].id, tweets[0].id],
+        )
+        self.assertEqual(response.data['has_next_page'], False)
+
+    def test_list_since_id(self):
+        since = self.tweets1[-1]
+        response = self.anonymous_client.get(TWEET_LIST_API, {
+            'user_id': self.user1.id,
+            'since_id': since.id,
+        })
+        self.assertEqual(response.data['tweets'], [])
+
+        new_tweets = [self.create_tweet(self.user1) for _ in range(3)]
+        response = self.anonymous_client.get(TWEET_LIST_API, {
+            'user_id': self.user1.id,
+            'since_id': since.id,
+            'page_size': 2,
+        })
+        self.assertEqual(
+            [tweet['id'] for tweet in response.data['tweets']],
+            [new_tweets[2].id, new_tweets[1].id],
+        )
+        self.assertEqual(response.data['has_next_page'], True)
+        # 带着 since_id 接着往下翻，拿到剩下的增量
+        response = self.anonymous_client.get(TWEET_LIST_API, {
+            'user_id': self.user1.id,
+            'since_id': since.id,
+            'page_size': 2,
+            'created_at__lt': new_tweets[1].created_at.isoformat(),
+            'id__lt': new_tweets[1].id,
+        })
+        self.assertEqual(
+            [tweet['id'] for tweet in response.data['tweets']],
+            [new_tweets[0].id],
+        )
+        self.assertEqual(response.data['has_next_page'], False)
+
+        # since_id 对应的 tweet 被删掉了也可以用
+        since_id = since.id
+        since.delete()
+        response = self.anonymous_client.get(TWEET_LIST_API, {
+            'user_id': self.user1.id,
+            'since_id': since_id,
+        })
+        self.assertEqual(len(response.data['tweets']), 3)
+
+        response = self.anonymous_client.get(TWEET_LIST_API, {
+            'user_id': self.user1.id,
+            'since_id': 'abc',
+        })
+        self.assertEqual(response.status_code, 400)
+
     # 测试2: create API
     def test_create_api(self):
         # 发布内容必须登录, 否则403
@@ -84,6 +201,8 @@ class TweetApiTests(TestCase):
         self.assertEqual(response.status_code, 201)
         self.assertEqual(response.data['user']['id'], self.user1.id)
         self.assertEqual(Tweet.objects.count(), tweets_count + 1)
+        # 比 2^53 大的 id 另外给一个字符串形式的，JS 客户端不会丢精度
+        self.assertEqual(response.data['id_str'], str(response.data['id']))
 
     def test_retrieve(self):
         # tweet with id=-1 does not exist
@@ -97,9 +216,302 @@ class TweetApiTests(TestCase):
         response = self.anonymous_client.get(url)
         self.assertEqual(response.status_code, 200)
         self.assertEqual(len(response.data['comments']), 0)
+        self.assertEqual(response.data['id_str'], str(tweet.id))
 
         self.create_comment(self.user2, tweet, 'holly s***')
         self.create_comment(self.user1, tweet, 'hmm...')
         self.create_comment(self.user1, self.create_tweet(self.user2), '...')
         response = self.anonymous_client.get(url)
         self.assertEqual(len(response.data['comments']), 2)
+
+    def test_retrieve_embeds_first_page(self):
+        tweet = self.create_tweet(self.user1)
+        users = [self.create_user('liker{}'.format(i)) for i in range(3)]
+        comments = [self.create_comment(users[i], tweet, str(i)) for i in range(3)]
+        for user in users:
+            self.create_like(user, tweet)
+        self.create_like(self.user1, comments[2])
+
+        url = TWEET_RETRIEVE_API.format(tweet.id)
+        with self.settings(TWEET_DETAIL_COMMENTS_LIMIT=2, TWEET_DETAIL_LIKES_LIMIT=2):
+            response = self.user1_client.get(url)
+        self.assertEqual(
+            [comment['id'] for comment in response.data['comments']],
+            [comments[2].id, comments[1].id],
+        )
+        self.assertEqual(response.data['comments'][0]['has_liked'], True)
+        self.assertEqual(response.data['comments'][0]['likes_count'], 1)
+        self.assertEqual(response.data['has_more_comments'], True)
+        self.assertEqual(
+            [like['user']['id'] for like in response.data['likes']],
+            [users[2].id, users[1].id],
+        )
+        self.assertEqual(response.data['has_more_likes'], True)
+        self.assertEqual(response.data['comments_count'], 3)
+        self.assertEqual(response.data['likes_count'], 3)
+
+        response = self.user1_client.get(url)
+        self.assertEqual(len(response.data['comments']), 3)
+        self.assertEqual(response.data['has_more_comments'], False)
+        self.assertEqual(len(response.data['likes']), 3)
+        self.assertEqual(response.data['has_more_likes'], False)
+
+    def test_comments_and_likes_pagination(self):
+        tweet = self.create_tweet(self.user1)
+        users = [self.create_user('liker{}'.format(i)) for i in range(3)]
+        comments = [self.create_comment(users[i], tweet, str(i)) for i in range(3)]
+        likes = [self.create_like(user, tweet) for user in users]
+
+        response = self.anonymous_client.get(TWEET_COMMENTS_API.format(0))
+        self.assertEqual(response.status_code, 404)
+
+        # 翻到下一页的 cursor 是上一页最后一条的 (created_at, id)
+        for url, items in (
+            (TWEET_COMMENTS_API.format(tweet.id), comments),
+            (TWEET_LIKES_API.format(tweet.id), likes),
+        ):
+            response = self.anonymous_client.get(url, {'page_size': 2})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.data['has_next_page'], True)
+            self.assertEqual(len(response.data['results']), 2)
+            self.assertEqual(
+                response.data['results'][0]['created_at'],
+                items[2].created_at.isoformat().replace('+00:00', 'Z'),
+            )
+            response = self.anonymous_client.get(url, {
+                'page_size': 2,
+                'created_at__lt': items[1].created_at.isoformat(),
+                'id__lt': items[1].id,
+            })
+            self.assertEqual(response.data['has_next_page'], False)
+            self.assertEqual(len(response.data['results']), 1)
+            self.assertEqual(
+                response.data['results'][0]['user']['id'],
+                users[0].id,
+            )
+
+    def _count_queries(self, client, url, params=None):
+        with CaptureQueriesContext(connection) as captured:
+            response = client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        return len(captured)
+
+    def test_list_query_count(self):
+        # 是否点过赞 / 作者 都是整页批量查的，query 数量和 tweet 的数量无关
+        self.create_like(self.user1, self.tweets2[0])
+        few = self._count_queries(self.user1_client, TWEET_LIST_API, {'user_id': self.user2.id})
+        for _ in range(10):
+            self.create_like(self.user1, self.create_tweet(self.user2))
+        many = self._count_queries(self.user1_client, TWEET_LIST_API, {'user_id': self.user2.id})
+        self.assertEqual(few, many)
+
+        response = self.user1_client.get(TWEET_LIST_API, {'user_id': self.user2.id})
+        self.assertEqual(len(response.data['tweets']), 12)
+        self.assertEqual(
+            [tweet['has_liked'] for tweet in response.data['tweets']],
+            [True] * 10 + [False, True],
+        )
+
+    def test_retrieve_query_count(self):
+        tweet = self.create_tweet(self.user1)
+        url = TWEET_RETRIEVE_API.format(tweet.id)
+        comment = self.create_comment(self.user2, tweet)
+        self.create_like(self.user1, comment)
+        few = self._count_queries(self.user1_client, url)
+        for _ in range(10):
+            self.create_comment(self.user2, tweet)
+        many = self._count_queries(self.user1_client, url)
+        self.assertEqual(few, many)
+
+        # 嵌入的评论和 /api/tweets/<id>/comments/ 的第一页一样，最新的在前
+        response = self.user1_client.get(url)
+        self.assertEqual(
+            [item['has_liked'] for item in response.data['comments']],
+            [False] * 10 + [True],
+        )
+
+    def test_batch(self):
+        ids = [self.tweets2[1].id, 0, self.tweets1[0].id, self.tweets2[1].id]
+        self.create_like(self.user1, self.tweets2[1])
+
+        # 缺少 ids / ids 不是数字 / 超过上限
+        response = self.anonymous_client.get(TWEET_BATCH_API)
+        self.assertEqual(response.status_code, 400)
+        response = self.anonymous_client.get(TWEET_BATCH_API, {'ids': '1,a'})
+        self.assertEqual(response.status_code, 400)
+        with self.settings(TWEET_BATCH_MAX_SIZE=2):
+            response = self.anonymous_client.get(TWEET_BATCH_API, {'ids': '1,2,3'})
+        self.assertEqual(response.status_code, 400)
+
+        # 顺序和 ids 一致，重复的只返回一次，不存在的放在 missing_ids 里
+        response = self.user1_client.get(
+            TWEET_BATCH_API,
+            {'ids': ','.join(str(tweet_id) for tweet_id in ids)},
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [tweet['id'] for tweet in response.data['tweets']],
+            [self.tweets2[1].id, self.tweets1[0].id],
+        )
+        self.assertEqual(response.data['missing_ids'], [0])
+        self.assertEqual(response.data['tweets'][0]['has_liked'], True)
+        self.assertEqual(response.data['tweets'][0]['likes_count'], 1)
+        self.assertEqual(response.data['tweets'][0]['user']['id'], self.user2.id)
+        self.assertEqual(response.data['tweets'][1]['has_liked'], False)
+
+        # tweets 都在缓存里之后，query 数量和 tweet 的数量无关
+        few = self._count_queries(self.user1_client, TWEET_BATCH_API, {
+            'ids': str(self.tweets1[0].id),
+        })
+        many = self._count_queries(self.user1_client, TWEET_BATCH_API, {
+            'ids': ','.join(str(tweet.id) for tweet in self.tweets1 + self.tweets2),
+        })
+        self.assertEqual(few, many - 1)
+        many = self._count_queries(self.user1_client, TWEET_BATCH_API, {
+            'ids': ','.join(str(tweet.id) for tweet in self.tweets1 + self.tweets2),
+        })
+        self.assertEqual(few, many)
+
+    def test_search(self):
+        response = self.anonymous_client.get(TWEET_SEARCH_API)
+        self.assertEqual(response.status_code, 400)
+
+        old = self.create_tweet(self.user2, 'hello search world')
+        only_hello = self.create_tweet(self.user1, 'hello there')
+        new = self.create_tweet(self.user1, 'Search: hello!')
+        self.create_like(self.user1, new)
+
+        response = self.user1_client.get(TWEET_SEARCH_API, {'q': 'hello search', 'page_size': 2})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [(item['tweet']['id'], item['score']) for item in response.data['results']],
+            [(new.id, 2), (old.id, 2)],
+        )
+        self.assertEqual(response.data['results'][0]['tweet']['has_liked'], True)
+        self.assertEqual(response.data['has_next_page'], True)
+
+        response = self.user1_client.get(TWEET_SEARCH_API, {
+            'q': 'hello search',
+            'page_size': 2,
+            'score': 2,
+            'created_at__lt': old.created_at.isoformat(),
+            'id__lt': old.id,
+        })
+        self.assertEqual(
+            [(item['tweet']['id'], item['score']) for item in response.data['results']],
+            [(only_hello.id, 1)],
+        )
+        self.assertEqual(response.data['has_next_page'], False)
+
+        # 翻页的时候必须带 score
+        response = self.user1_client.get(TWEET_SEARCH_API, {
+            'q': 'hello',
+            'created_at__lt': old.created_at.isoformat(),
+        })
+        self.assertEqual(response.status_code, 400)
+
+        # 删掉的 tweet 搜不到
+        new.delete()
+        response = self.anonymous_client.get(TWEET_SEARCH_API, {'q': 'search'})
+        self.assertEqual(
+            [item['tweet']['id'] for item in response.data['results']],
+            [old.id],
+        )
+
+
+@override_settings(TWEET_PHOTO_PROCESS_POOL_SIZE=0)
+class TweetPhotoApiTests(TestCase):
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        self.settings_override.enable()
+        self.user1, self.user1_client = self.create_user_and_client('user1')
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.media_root, ignore_errors=True)
+
+    def test_create_with_photos(self):
+        response = self.user1_client.post(TWEET_CREATE_API, {
+            'content': 'hello with photos',
+            'files': [create_image_file('a.png'), create_image_file('b.png')],
+        }, format='multipart')
+        self.assertEqual(response.status_code, 201)
+        photos = response.data['photos']
+        self.assertEqual(len(photos), 2)
+        self.assertTrue(photos[0]['url'].startswith('/media/tweet_photos/'))
+        # job 在测试里是同步执行的，返回的时候缩略图已经生成好了
+        self.assertEqual(photos[0]['status'], 'ready')
+        self.assertEqual(set(photos[0]['variants']), {'thumbnail', 'medium'})
+        self.assertTrue(photos[0]['variants']['thumbnail'].endswith('_thumbnail.jpg'))
+
+        # 没有图片也可以发
+        response = self.user1_client.post(TWEET_CREATE_API, {'content': 'no photos here'})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['photos'], [])
+
+    def _stored_files(self):
+        return [
+            os.path.join(root, name)
+            for root, _, names in os.walk(self.media_root)
+            for name in names
+        ]
+
+    def test_create_is_atomic(self):
+        tweets_count = Tweet.objects.count()
+        # 第二张图片保存失败
+        with mock.patch.object(TweetPhoto, 'save', side_effect=[None, OSError('disk full')]):
+            with self.assertRaises(OSError):
+                self.user1_client.post(TWEET_CREATE_API, {
+                    'content': 'hello with #photos',
+                    'files': [create_image_file('a.png'), create_image_file('b.png')],
+                })
+        # tweet / hashtag 都回滚了，已经存下来的文件也删掉了
+        self.assertEqual(Tweet.objects.count(), tweets_count)
+        self.assertFalse(TweetHashtag.objects.filter(hashtag='photos').exists())
+        self.assertEqual(self._stored_files(), [])
+
+    def test_create_with_invalid_photos(self):
+        count = Tweet.objects.count()
+        # 不是图片
+        response = self.user1_client.post(TWEET_CREATE_API, {
+            'content': 'hello with photos',
+            'files': [create_image_file(), SimpleUploadedFile('a.png', b'not an image')],
+        }, format='multipart')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('files', response.data['errors'])
+
+        # 太多
+        response = self.user1_client.post(TWEET_CREATE_API, {
+            'content': 'hello with photos',
+            'files': [create_image_file() for _ in range(5)],
+        }, format='multipart')
+        self.assertEqual(response.status_code, 400)
+
+        # 太大
+        with override_settings(TWEET_PHOTO_MAX_SIZE=100):
+            response = self.user1_client.post(TWEET_CREATE_API, {
+                'content': 'hello with photos',
+                'files': [create_image_file()],
+            }, format='multipart')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Tweet.objects.count(), count)
+        self.assertEqual(TweetPhoto.objects.count(), 0)
+
+    def test_list_photos_query_count(self):
+        # 整页 tweet 的图片是一条 query 查出来的
+        tweet = self.create_tweet(self.user1)
+        TweetPhotoService.create_photos(tweet, [create_image_file()])
+        with CaptureQueriesContext(connection) as captured:
+            self.anonymous_client.get(TWEET_LIST_API, {'user_id': self.user1.id})
+        few = len(captured)
+        for _ in range(5):
+            TweetPhotoService.create_photos(self.create_tweet(self.user1), [create_image_file()])
+        with CaptureQueriesContext(connection) as captured:
+            response = self.anonymous_client.get(TWEET_LIST_API, {'user_id': self.user1.id})
+        self.assertEqual(few, len(captured))
+        self.assertEqual(len(response.data['tweets']), 6)
+        for item in response.data['tweets']:
+            self.assertEqual(len(item['photos']), 1)
+
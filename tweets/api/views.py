@@ -1,14 +1,25 @@
+from django.conf import settings
+from django.http import Http404
 from rest_framework import viewsets, status
+from rest_framework.decorators import action
 from rest_framework.permissions import IsAuthenticated, AllowAny
 from rest_framework.response import Response
+from comments.api.serializers import CommentSerializer
+from likes.api.serializers import LikeSerializer
 from tweets.api.serializers import (
     TweetSerializer,
     TweetSerializerForCreate,
     TweetSerializerForDetail,
 )
+from tweets import constants
 from tweets.models import Tweet
+from tweets.services import TweetService
+from comments.services import CommentService
+from likes.services import LikeService
 from newsfeeds.services import NewsFeedServices
+from search.services import SearchService
 from utils.decorators import required_params
+from utils.paginations import EndlessPagination
 
 
 class TweetViewSet(viewsets.GenericViewSet,
@@ -21,6 +32,10 @@ class TweetViewSet(viewsets.GenericViewSet,
     queryset = Tweet.objects.all()
     # 创建时表单的样子
     serializer_class = TweetSerializerForCreate
+    # detail 的 url 只匹配数字的 id，retrieve 里可以直接 int()
+    lookup_value_regex = r'\d+'
+    # 用户的 tweets / 评论 / 点赞列表都用 (created_at, id) 做 cursor 翻页
+    pagination_class = EndlessPagination
 
     @required_params(params=['user_id'])
     def list(self, request, *args, **kwargs):
@@ -29,24 +44,133 @@ class TweetViewSet(viewsets.GenericViewSet,
         # if 'user_id' not in request.query_params:
         #     return Response('missing user_id', status=400)
 
-        # 取出该用户所有的Tweets
+        # 取出该用户的Tweets -> 不再一次返回全部，按 (created_at, id) 倒序做 cursor 翻页
         # request.query_params -> 请求的data
         user_id = request.query_params['user_id']
-        # order_by -> 根据created_at 倒序拍
-        tweets = Tweet.objects.filter(
-            user_id=user_id
-        ).order_by('-created_at')
+        # 翻页的时候走 (user, created_at) 联合索引，翻到多深都只扫 page_size 条
+        queryset = Tweet.objects.filter(user_id=user_id)
+        if 'since_id' in request.query_params:
+            # ?since_id=<客户端已经有的最新的 tweet id> -> 只返回比它新的 tweets，轮询的时候只拉增量
+            try:
+                since_id = int(request.query_params['since_id'])
+            except ValueError:
+                return Response({
+                    'success': False,
+                    'message': 'since_id should be an integer',
+                }, status=status.HTTP_400_BAD_REQUEST)
+            # id 是按时间递增的(见 utils/snowflake.py)，比 since_id 大的就是之后发的
+            queryset = queryset.filter(id__gt=since_id)
+            since_tweet = TweetService.get_by_id(since_id)
+            if since_tweet is not None:
+                # 再用 created_at 限定一下范围，索引只需要扫比它新的那一段
+                queryset = queryset.filter(created_at__gte=since_tweet.created_at)
+        tweets = self.paginate_queryset(queryset)
+        # 作者 / 是否点过赞 / 点赞数 批量查好，避免每条 tweet 都查一遍
+        context = TweetService.hydrate(tweets, request.user)
 
         # Serializer传入的是QuerySet
         # 如果many=True 则表示传入的是list of dict
         serializer = TweetSerializer(
             tweets,
-            context={"request": request},
+            context={"request": request, **context},
             many=True,
         )
 
         # 约定俗成 -> JSON的最外层默认是一个dict,一般不直接返回list
-        return Response({'tweets': serializer.data})
+        # 新增的 tweets 超过一页的时候 has_next_page=True，带着 since_id 接着往下翻就可以拿到剩下的
+        return Response({
+            'tweets': serializer.data,
+            'has_next_page': self.paginator.has_next_page,
+        })
+
+    @action(methods=['GET'], detail=False)
+    @required_params(params=['ids'])
+    def batch(self, request, *args, **kwargs):
+        # /api/tweets/batch/?ids=1,2,3 -> 一次请求拿到多个 tweet，顺序和 ids 一致
+        # tweets 走对象缓存(get_many + 没命中的一条 query)，作者 / 是否点过赞 各一条 query
+        try:
+            tweet_ids = [
+                int(tweet_id)
+                for tweet_id in request.query_params['ids'].split(',')
+                if tweet_id.strip()
+            ]
+        except ValueError:
+            return Response({
+                'success': False,
+                'message': 'ids should be a comma separated list of integers',
+            }, status=status.HTTP_400_BAD_REQUEST)
+        # 去重，保留第一次出现的顺序
+        tweet_ids = list(dict.fromkeys(tweet_ids))
+        max_size = getattr(settings, 'TWEET_BATCH_MAX_SIZE', constants.TWEET_BATCH_MAX_SIZE)
+        if len(tweet_ids) > max_size:
+            return Response({
+                'success': False,
+                'message': 'at most {} ids in one request'.format(max_size),
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        tweets_by_id = TweetService.get_by_ids(tweet_ids)
+        tweets = [tweets_by_id[tweet_id] for tweet_id in tweet_ids if tweet_id in tweets_by_id]
+        context = TweetService.hydrate(tweets, request.user)
+        serializer = TweetSerializer(
+            tweets,
+            context={"request": request, **context},
+            many=True,
+        )
+        return Response({
+            'tweets': serializer.data,
+            # 不存在 / 已经被删掉的 tweet
+            'missing_ids': [tweet_id for tweet_id in tweet_ids if tweet_id not in tweets_by_id],
+        })
+
+    @action(methods=['GET'], detail=False)
+    @required_params(params=['q'])
+    def search(self, request, *args, **kwargs):
+        # /api/tweets/search/?q=... -> 命中的 query term 越多越靠前，同样分数的新的在前
+        # 往下翻: ?q=...&score=<上一页最后一条的 score>&created_at__lt=<它的 created_at>&id__lt=<它的 id>
+        cursor = self.paginator.get_cursor(request)
+        if cursor is not None:
+            try:
+                cursor['score'] = int(request.query_params['score'])
+            except (KeyError, ValueError):
+                return Response({
+                    'success': False,
+                    'message': 'score should be an integer when paginating search results',
+                }, status=status.HTTP_400_BAD_REQUEST)
+            if cursor['op'] != 'lt':
+                return Response({
+                    'success': False,
+                    'message': 'search results can only be paginated with created_at__lt',
+                }, status=status.HTTP_400_BAD_REQUEST)
+
+        results = self.paginator.paginate_ordered_list(
+            SearchService.search(
+                request.query_params['q'],
+                self.paginator.get_page_size(request) + 1,
+                cursor,
+            ),
+            request,
+        )
+        # 索引是异步更新的，搜到的 tweet 可能刚刚被删掉了
+        tweets_by_id = TweetService.get_by_ids([tweet_id for tweet_id, _, _ in results])
+        results = [
+            (tweets_by_id[tweet_id], score)
+            for tweet_id, _, score in results
+            if tweet_id in tweets_by_id
+        ]
+        tweets = [tweet for tweet, _ in results]
+        context = TweetService.hydrate(tweets, request.user)
+        serializer = TweetSerializer(
+            tweets,
+            context={"request": request, **context},
+            many=True,
+        )
+        return Response({
+            'results': [
+                {'score': score, 'tweet': data}
+                for (_, score), data in zip(results, serializer.data)
+            ],
+            'has_next_page': self.paginator.has_next_page,
+        })
 
     def create(self, request, *args, **kwargs):
         # 因为在创建tweet的时候需要用到发布者(User)的信息
@@ -70,6 +194,7 @@ class TweetViewSet(viewsets.GenericViewSet,
         tweet = serializer.save()
 
         # 发送tweet之后 - 在newsfeed表中给发布者每个follower添加数据
+        # fanout 是异步执行的，这里只是放进队列，不用等 fanout 完成就可以返回 201
         NewsFeedServices.fanout_to_followers(tweet)
 
         # TweetSerializer(tweet).data本身就是一个dict了 就不用加{}了
@@ -81,16 +206,45 @@ class TweetViewSet(viewsets.GenericViewSet,
     # 权限管理
     def get_permissions(self):
         # self.action -> 对应是调用的方法名(create, list...)
-        if self.action in ['list', 'retrieve']:
+        if self.action in ['list', 'retrieve', 'batch', 'search', 'comments', 'likes']:
             # 允许任何人都能访问
             return [AllowAny()]
         # 必须登陆
         return [IsAuthenticated()]
 
     def retrieve(self, request, *args, **kwargs):
-        # get_object -> 获得querySet
-        tweet = self.get_object()
+        # tweet 先从对象缓存里读，没命中才查数据库(之前是 get_object -> 每次都查)
+        tweet = self._get_tweet_or_404(self.kwargs['pk'])
+        # 只嵌入最新的一页评论和点赞，评论的作者 / 是否点过赞 和点赞的用户都批量查好
+        context = TweetService.get_detail_context(tweet, request.user)
         return Response(
-            TweetSerializerForDetail(tweet, context={"request": request}).data,
+            TweetSerializerForDetail(tweet, context={"request": request, **context}).data,
             status=status.HTTP_200_OK,
         )
+
+    def _get_tweet_or_404(self, pk):
+        tweet = TweetService.get_by_id(int(pk))
+        if tweet is None:
+            raise Http404
+        return tweet
+
+    @action(methods=['GET'], detail=True)
+    def comments(self, request, pk):
+        # /api/tweets/<id>/comments/?created_at__lt=...&id__lt=... -> 详情页之后的评论
+        tweet = self._get_tweet_or_404(pk)
+        page = self.paginate_queryset(TweetService.get_comments_queryset(tweet.id))
+        context = CommentService.hydrate(page, request.user)
+        serializer = CommentSerializer(
+            page,
+            context={'request': request, **context},
+            many=True,
+        )
+        return self.get_paginated_response(serializer.data)
+
+    @action(methods=['GET'], detail=True)
+    def likes(self, request, pk):
+        # /api/tweets/<id>/likes/?created_at__lt=...&id__lt=... -> 详情页之后的点赞
+        tweet = self._get_tweet_or_404(pk)
+        page = self.paginate_queryset(TweetService.get_likes_queryset(tweet.id))
+        LikeService.attach_users(page)
+        return self.get_paginated_response(LikeSerializer(page, many=True).data)
@@ -0,0 +1,26 @@
+# tweets 相关配置的默认值，都可以在 settings 里用同名的配置覆盖
+
+# tweet 对象缓存(TweetService.get_by_id / get_by_ids)用 settings.CACHES 里的哪个 cache
+TWEET_CACHE_ALIAS = 'default'
+TWEET_CACHE_TIMEOUT = 3600
+# 缓存的是 pickle 之后的 Tweet 对象，Tweet 的字段有变化的时候把版本号加一，旧的缓存就都不会被读到了
+TWEET_CACHE_VERSION = 1
+
+# GET /api/tweets/batch/?ids=... 一次最多查多少个 tweet
+TWEET_BATCH_MAX_SIZE = 100
+
+# tweet 详情页只嵌入最新的多少条评论 / 多少个赞，更多的用 /api/tweets/<id>/comments/ 和 likes/ 翻页
+TWEET_DETAIL_COMMENTS_LIMIT = 20
+TWEET_DETAIL_LIKES_LIMIT = 20
+
+# 每条 tweet 最多几张图片，每张最大多少字节
+TWEET_PHOTOS_MAX_COUNT = 4
+TWEET_PHOTO_MAX_SIZE = 5 * 1024 * 1024
+# 异步生成的图片尺寸: 名字 -> (最大宽度, 最大高度)，保持宽高比缩小，统一存成 JPEG
+TWEET_PHOTO_VARIANTS = {
+    'thumbnail': (150, 150),
+    'medium': (1024, 1024),
+}
+TWEET_PHOTO_VARIANT_QUALITY = 85
+# 缩放图片的进程池大小，0 表示直接在 job 的进程里做
+TWEET_PHOTO_PROCESS_POOL_SIZE = 2
@@ -0,0 +1,15 @@
+def invalidate_tweet_cache(sender, instance, **kwargs):
+    # queryset.update() 不会触发 post_save，用 update 改 tweet 的地方要自己调用 invalidate_cache
+    # import 写在里面避免循环依赖
+    from tweets.services import TweetService
+    TweetService.invalidate_cache([instance.id])
+
+
+def delete_tweet_photos(sender, instance, **kwargs):
+    # 在 pre_delete 里找出 tweet 的图片(删除之后 tweet 会被 SET_NULL，就找不到了)，文件交给 job 删
+    # import 写在里面避免循环依赖
+    from tweets.models import TweetPhoto
+    from tweets.tasks import delete_photos_task
+    photo_ids = list(TweetPhoto.objects.filter(tweet_id=instance.id).values_list('id', flat=True))
+    if photo_ids:
+        delete_photos_task.delay(photo_ids=photo_ids)
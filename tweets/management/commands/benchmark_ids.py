@@ -0,0 +1,126 @@
+import random
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from utils.snowflake import generate_id
+from utils.time_helpers import utc_now
+
+# 只在跑 benchmark 的时候建临时表(连接断开就没了)，不定义 model，不会注册到任何 app 里
+# 原来的方案: 自增 id + created_at，timeline 走 (user, created_at) 联合索引
+AUTO_INCREMENT_TABLE = 'benchmark_ids_auto_increment'
+# snowflake id: id 本身就是按时间排序的，timeline 走 (user, id) 联合索引
+SNOWFLAKE_TABLE = 'benchmark_ids_snowflake'
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare insert and timeline range-scan throughput of auto-increment ids + '
+        'created_at against snowflake ids, on temporary tables in the default database'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=100000)
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--scans', type=int, default=2000)
+        parser.add_argument('--page-size', type=int, default=20)
+
+    def handle(self, *args, **options):
+        with connection.cursor() as cursor:
+            self.create_tables(cursor)
+            try:
+                results = [
+                    ('auto_increment + created_at', *self.benchmark(
+                        cursor,
+                        AUTO_INCREMENT_TABLE,
+                        'created_at DESC, id DESC',
+                        'created_at',
+                        options,
+                    )),
+                    ('snowflake id', *self.benchmark(
+                        cursor,
+                        SNOWFLAKE_TABLE,
+                        'id DESC',
+                        'id',
+                        options,
+                    )),
+                ]
+            finally:
+                for table in (AUTO_INCREMENT_TABLE, SNOWFLAKE_TABLE):
+                    cursor.execute('DROP TABLE {}'.format(table))
+
+        self.stdout.write('{:<30}{:>16}{:>16}'.format('scheme', 'inserts/s', 'page scans/s'))
+        for name, inserts, scans in results:
+            self.stdout.write('{:<30}{:>16.0f}{:>16.0f}'.format(name, inserts, scans))
+
+    def create_tables(self, cursor):
+        # 自增主键的写法每种数据库不一样，用 django 的 backend 里 BigAutoField 的定义
+        auto_increment = '{} PRIMARY KEY {}'.format(
+            connection.data_types['BigAutoField'],
+            connection.data_types_suffix.get('BigAutoField', ''),
+        )
+        cursor.execute(
+            'CREATE TEMPORARY TABLE {} (id {}, user_id integer NOT NULL, '
+            'content varchar(255) NOT NULL, created_at {} NOT NULL)'.format(
+                AUTO_INCREMENT_TABLE,
+                auto_increment,
+                connection.data_types['DateTimeField'],
+            )
+        )
+        cursor.execute('CREATE INDEX {0}_user_created_at ON {0} (user_id, created_at)'.format(
+            AUTO_INCREMENT_TABLE,
+        ))
+        cursor.execute(
+            'CREATE TEMPORARY TABLE {} (id bigint PRIMARY KEY, user_id integer NOT NULL, '
+            'content varchar(255) NOT NULL)'.format(SNOWFLAKE_TABLE)
+        )
+        cursor.execute('CREATE INDEX {0}_user_id ON {0} (user_id, id)'.format(SNOWFLAKE_TABLE))
+
+    def benchmark(self, cursor, table, ordering, cursor_field, options):
+        # 两种方案用同样的随机种子，插入的数据和扫描的用户都一样
+        rng = random.Random(0)
+        started_at = utc_now() - timedelta(days=1)
+
+        start = time.monotonic()
+        for offset in range(0, options['rows'], options['batch_size']):
+            rows = []
+            for i in range(offset, min(offset + options['batch_size'], options['rows'])):
+                user_id = rng.randrange(options['users'])
+                if table == AUTO_INCREMENT_TABLE:
+                    created_at = connection.ops.adapt_datetimefield_value(
+                        started_at + timedelta(milliseconds=i),
+                    )
+                    rows.append((user_id, 'x' * 140, created_at))
+                else:
+                    rows.append((generate_id(), user_id, 'x' * 140))
+            if table == AUTO_INCREMENT_TABLE:
+                sql = 'INSERT INTO {} (user_id, content, created_at) VALUES (%s, %s, %s)'
+            else:
+                sql = 'INSERT INTO {} (id, user_id, content) VALUES (%s, %s, %s)'
+            cursor.executemany(sql.format(table), rows)
+        inserts = options['rows'] / (time.monotonic() - start)
+
+        # 每个用户读第一页，再用最后一条做 cursor 读第二页
+        first_page_sql = 'SELECT id, {} FROM {} WHERE user_id = %s ORDER BY {} LIMIT %s'.format(
+            cursor_field,
+            table,
+            ordering,
+        )
+        next_page_sql = 'SELECT id, {0} FROM {1} WHERE user_id = %s AND {0} < %s ORDER BY {2} LIMIT %s'.format(
+            cursor_field,
+            table,
+            ordering,
+        )
+        start = time.monotonic()
+        for _ in range(options['scans']):
+            user_id = rng.randrange(options['users'])
+            cursor.execute(first_page_sql, [user_id, options['page_size']])
+            page = cursor.fetchall()
+            if page:
+                cursor.execute(next_page_sql, [user_id, page[-1][1], options['page_size']])
+                cursor.fetchall()
+        scans = options['scans'] * 2 / (time.monotonic() - start)
+        return inserts, scans
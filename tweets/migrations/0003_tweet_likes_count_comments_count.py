@@ -0,0 +1,67 @@
+# Generated by Django 3.1.3 on 2026-10-18 10:46
+
+from django.db import migrations, models
+from django.db.models import Count
+
+BATCH_SIZE = 1000
+
+
+def backfill_counts(apps, schema_editor):
+    Tweet = apps.get_model('tweets', 'Tweet')
+    Comment = apps.get_model('comments', 'Comment')
+    Like = apps.get_model('likes', 'Like')
+    ContentType = apps.get_model('contenttypes', 'ContentType')
+    content_type = ContentType.objects.filter(app_label='tweets', model='tweet').first()
+
+    # 按主键分批，每批 tweet 的点赞数和评论数各一条 GROUP BY query
+    last_id = 0
+    while True:
+        tweet_ids = list(Tweet.objects.filter(
+            id__gt=last_id,
+        ).order_by('id').values_list('id', flat=True)[:BATCH_SIZE])
+        if not tweet_ids:
+            break
+        last_id = tweet_ids[-1]
+
+        comments_count = dict(Comment.objects.filter(
+            tweet_id__in=tweet_ids,
+        ).values('tweet_id').annotate(count=Count('id')).values_list('tweet_id', 'count'))
+        likes_count = {}
+        if content_type is not None:
+            likes_count = dict(Like.objects.filter(
+                content_type=content_type,
+                object_id__in=tweet_ids,
+            ).values('object_id').annotate(count=Count('id')).values_list('object_id', 'count'))
+
+        Tweet.objects.bulk_update([
+            Tweet(
+                id=tweet_id,
+                likes_count=likes_count.get(tweet_id, 0),
+                comments_count=comments_count.get(tweet_id, 0),
+            )
+            for tweet_id in tweet_ids
+        ], ['likes_count', 'comments_count'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('comments', '0001_initial'),
+        ('likes', '0001_initial'),
+        ('tweets', '0002_auto_20220630_1859'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tweet',
+            name='comments_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='tweet',
+            name='likes_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_counts, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.1.3 on 2026-10-18 10:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tweets', '0003_tweet_likes_count_comments_count'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tweet',
+            name='likes_count_sharded',
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 3.1.3 on 2026-10-18 11:18
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import tweets.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('tweets', '0005_tweet_snowflake_id'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TweetPhoto',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('file', models.FileField(upload_to=tweets.models.get_photo_upload_path)),
+                ('order', models.PositiveSmallIntegerField(default=0)),
+                ('status', models.SmallIntegerField(choices=[(0, 'pending'), (1, 'ready'), (2, 'failed')], default=0)),
+                ('variants', models.JSONField(default=dict)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('tweet', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, to='tweets.tweet')),
+                ('user', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'index_together': {('tweet', 'order')},
+            },
+        ),
+    ]
@@ -1,7 +1,13 @@
+import os
+import uuid
+
 from django.contrib.contenttypes.models import ContentType
 from django.db import models
+from django.db.models.signals import post_delete, post_save, pre_delete
 from django.contrib.auth.models import User
 from likes.models import Like
+from tweets.listeners import delete_tweet_photos, invalidate_tweet_cache
+from utils.snowflake import generate_id
 from utils.time_helpers import utc_now
 
 """
@@ -12,6 +18,9 @@ create_at: 创建时间
 
 
 class Tweet(models.Model):
+    # 64 位按时间递增的 id (见 utils/snowflake.py)，不再用数据库的自增 id
+    # 新的 tweet 的 id 越大越新，并且比之前自增的 id 都大
+    id = models.BigIntegerField(primary_key=True, default=generate_id, editable=False)
     # User是foreignKey -> on_delete一定要设为SET_NULL
     # 然后因为设置了SET_NULL，那null要设置为True -> 表示可以为空
     user = models.ForeignKey(
@@ -24,6 +33,12 @@ class Tweet(models.Model):
     content = models.CharField(max_length=255)
     # auto_now_add -> 创建的时候自动去计算创建时间
     created_at = models.DateTimeField(auto_now_add=True)
+    # 冗余存储的点赞数和评论数，点赞/取消点赞、评论/删除评论的时候用 F() 原子地更新
+    # 序列化的时候直接读，不需要每条 tweet 都 COUNT 一次
+    likes_count = models.IntegerField(default=0)
+    comments_count = models.IntegerField(default=0)
+    # 点赞太快的热门 tweet 之后的点赞数记在 LikesCountShard 里(见 LikeService.change_likes_count)
+    likes_count_sharded = models.BooleanField(default=False)
 
     class Meta:
         # 联合索引 compound(composite ) index
@@ -50,3 +65,49 @@ class Tweet(models.Model):
             content_type=ContentType.objects.get_for_model(Tweet),
             object_id=self.id,
         ).order_by('-created_at')
+
+
+def get_photo_upload_path(instance, filename):
+    # 按月分目录，文件名用随机的 uuid，原来的文件名只保留扩展名
+    extension = os.path.splitext(filename)[1].lower()
+    return utc_now().strftime('tweet_photos/%Y/%m/') + uuid.uuid4().hex + extension
+
+
+class TweetPhoto(models.Model):
+    """
+    tweet 的图片，发 tweet 的时候上传
+    缩略图等尺寸(variants)由 job 异步生成，生成好之前 status 是 pending
+    """
+    STATUS_PENDING = 0
+    STATUS_READY = 1
+    # 图片解析失败，只有原图
+    STATUS_FAILED = 2
+    STATUS_CHOICES = (
+        (STATUS_PENDING, 'pending'),
+        (STATUS_READY, 'ready'),
+        (STATUS_FAILED, 'failed'),
+    )
+
+    tweet = models.ForeignKey(Tweet, on_delete=models.SET_NULL, null=True)
+    user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True)
+    file = models.FileField(upload_to=get_photo_upload_path)
+    # 在 tweet 里是第几张
+    order = models.PositiveSmallIntegerField(default=0)
+    status = models.SmallIntegerField(choices=STATUS_CHOICES, default=STATUS_PENDING)
+    # variant 的名字 -> storage 里的文件名，比如 {'thumbnail': 'tweet_photos/..._thumbnail.jpg'}
+    variants = models.JSONField(default=dict)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        # 一页 tweets 的图片一条 query 按 tweet 取出来
+        index_together = (('tweet', 'order'),)
+
+    def __str__(self):
+        return '{} photo {} of tweet {}'.format(self.created_at, self.order, self.tweet_id)
+
+
+# tweet 被修改/删除的时候让 tweet 的对象缓存失效
+post_save.connect(invalidate_tweet_cache, sender=Tweet)
+post_delete.connect(invalidate_tweet_cache, sender=Tweet)
+# tweet 被删除的时候图片的文件也删掉
+pre_delete.connect(delete_tweet_photos, sender=Tweet)
@@ -0,0 +1,70 @@
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from PIL import Image
+
+# 文件开头的 magic number -> 格式，只读文件头判断是不是图片，不需要把整个文件读进内存
+IMAGE_SIGNATURES = (
+    (b'\xff\xd8\xff', 'jpeg'),
+    (b'\x89PNG\r\n\x1a\n', 'png'),
+    (b'GIF87a', 'gif'),
+    (b'GIF89a', 'gif'),
+)
+
+_pool = None
+_pool_size = None
+
+
+def get_image_format(file):
+    header = file.read(12)
+    file.seek(0)
+    for signature, image_format in IMAGE_SIGNATURES:
+        if header.startswith(signature):
+            return image_format
+    if header[:4] == b'RIFF' and header[8:12] == b'WEBP':
+        return 'webp'
+    return None
+
+
+def resize_image(source_path, target_path, size, quality):
+    """
+    在进程池里执行(所以参数只能是可以 pickle 的路径和数字)
+    保持宽高比缩小到 size 以内，存成 JPEG
+    图片的像素数超过 Image.MAX_IMAGE_PIXELS 的时候 Pillow 会报错，防止解压炸弹
+    """
+    with Image.open(source_path) as image:
+        image.thumbnail(size, Image.LANCZOS)
+        image.convert('RGB').save(target_path, 'JPEG', quality=quality)
+
+
+def get_process_pool(size):
+    # 每个 worker 进程只建一个进程池，重复使用
+    global _pool, _pool_size
+    if _pool is None or _pool_size != size:
+        if _pool is not None:
+            _pool.shutdown()
+        _pool = ProcessPoolExecutor(max_workers=size)
+        _pool_size = size
+    return _pool
+
+
+def resize_images(tasks, pool_size):
+    """
+    tasks 是 resize_image 的参数的 list，pool_size > 0 的时候在进程池里并行执行
+    图片缩放是 CPU 密集的，放在单独的进程里不会占住 job worker 的 GIL，
+    Pillow 崩溃的时候也不会把 worker 带走
+    """
+    if pool_size <= 0:
+        for task in tasks:
+            resize_image(*task)
+        return
+    global _pool
+    pool = get_process_pool(pool_size)
+    try:
+        for future in [pool.submit(resize_image, *task) for task in tasks]:
+            # 有一个失败了就把异常抛出去
+            future.result()
+    except BrokenProcessPool:
+        # 子进程被杀掉了(比如内存不够)，下次重新建一个进程池，这次的 job 交给重试
+        _pool = None
+        raise
@@ -0,0 +1,226 @@
+import os
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import caches
+from PIL import Image, UnidentifiedImageError
+from comments.models import Comment
+from comments.services import CommentService
+from likes.models import Like
+from likes.services import LikeService
+from tweets import constants
+from tweets.models import Tweet, TweetPhoto
+from tweets.photos import resize_images
+from utils.paginations import EndlessPagination
+
+
+class TweetService(object):
+
+    # ---------------------------------------------------------------------
+    # tweet 对象缓存 (cache-aside): tweets:v<version>:<id> -> Tweet 对象
+    # 读的时候先 get_many，没命中的一条 query 查出来再 set_many 回去
+    # tweet 除了删除只有冗余的计数会变，post_save / post_delete 和用 update 改计数的地方都会让缓存失效
+    # 注意: 失效和没命中之后的回填之间没有加锁，并发的时候可能回填一个旧的值，
+    # 所以缓存设置了过期时间(TWEET_CACHE_TIMEOUT)，最多过期之后就会自动修正
+    # ---------------------------------------------------------------------
+    @classmethod
+    def get_cache(cls):
+        return caches[getattr(settings, 'TWEET_CACHE_ALIAS', constants.TWEET_CACHE_ALIAS)]
+
+    @classmethod
+    def get_cache_key(cls, tweet_id):
+        return 'tweets:v{}:{}'.format(
+            getattr(settings, 'TWEET_CACHE_VERSION', constants.TWEET_CACHE_VERSION),
+            tweet_id,
+        )
+
+    @classmethod
+    def get_by_ids(cls, tweet_ids):
+        """
+        返回 {tweet_id: tweet}，已经被删掉的 tweet 不在结果里
+        不管多少个 tweet，最多一次 get_many + 一条 query + 一次 set_many
+        """
+        tweet_ids = set(tweet_ids)
+        if not tweet_ids:
+            return {}
+        cache = cls.get_cache()
+        keys = {cls.get_cache_key(tweet_id): tweet_id for tweet_id in tweet_ids}
+        tweets = {keys[key]: tweet for key, tweet in cache.get_many(keys.keys()).items()}
+
+        missing_ids = tweet_ids - tweets.keys()
+        if missing_ids:
+            missing = Tweet.objects.in_bulk(missing_ids)
+            cache.set_many(
+                {cls.get_cache_key(tweet_id): tweet for tweet_id, tweet in missing.items()},
+                getattr(settings, 'TWEET_CACHE_TIMEOUT', constants.TWEET_CACHE_TIMEOUT),
+            )
+            tweets.update(missing)
+        return tweets
+
+    @classmethod
+    def get_by_id(cls, tweet_id):
+        # tweet 不存在的时候返回 None
+        return cls.get_by_ids([tweet_id]).get(tweet_id)
+
+    @classmethod
+    def invalidate_cache(cls, tweet_ids):
+        cls.get_cache().delete_many([cls.get_cache_key(tweet_id) for tweet_id in tweet_ids])
+
+    @classmethod
+    def hydrate(cls, tweets, viewer):
+        """
+        一次性把一页 tweets 序列化要用到的数据都查出来，避免每条 tweet 都查一遍(N+1 Queries)
+        - 作者: 1 条 query，直接挂到 tweet.user 上
+        - 当前用户点过赞的 tweets: 1 条 query
+        - 还没有写回数据库的点赞数增量 / 热门 tweet 的 shard 上的点赞数: 最多 1 条 query
+        - 图片: 1 条 query
+        (评论数 / 点赞数是冗余存在 tweet 上的，不需要查)
+        返回的 dict 要放进 serializer 的 context 里，TweetSerializer 会优先从 context 里读
+        """
+        tweets = [tweet for tweet in tweets if tweet is not None]
+        tweet_ids = [tweet.id for tweet in tweets]
+
+        user_ids = {tweet.user_id for tweet in tweets if tweet.user_id is not None}
+        users = User.objects.in_bulk(user_ids)
+        for tweet in tweets:
+            if tweet.user_id is not None:
+                tweet.user = users.get(tweet.user_id)
+
+        return {
+            'liked_tweet_ids': LikeService.get_liked_object_ids(viewer, Tweet, tweet_ids),
+            'likes_count_by_tweet_id': LikeService.get_likes_counts(tweets),
+            'photos_by_tweet_id': TweetPhotoService.get_photos_by_tweet_ids(tweet_ids),
+        }
+
+    @classmethod
+    def get_comments_queryset(cls, tweet_id):
+        # 只有顶层评论，回复用 CommentService.get_replies_queryset 按回复串取
+        # 按 (created_at, id) 倒序翻页，走 (tweet, depth, created_at) 联合索引
+        return Comment.objects.filter(tweet_id=tweet_id, depth=0)
+
+    @classmethod
+    def get_likes_queryset(cls, tweet_id):
+        # 按 (created_at, id) 倒序翻页，走 (content_type, object_id, created_at) 联合索引
+        return Like.objects.filter(
+            content_type=ContentType.objects.get_for_model(Tweet),
+            object_id=tweet_id,
+        )
+
+    @classmethod
+    def get_detail_context(cls, tweet, viewer):
+        """
+        tweet 详情页只嵌入最新的一页评论和点赞(和 /api/tweets/<id>/comments/、likes/ 的第一页一样)
+        热门 tweet 的评论 / 点赞再多，详情页的大小和 query 数量都是固定的
+        - 评论 / 点赞: 各 1 条 query，多取一条用来判断还有没有更多
+        - 评论的作者 / 是否点过赞 / 点赞数 和点赞的用户都是批量查的
+        返回的 dict 要放进 TweetSerializerForDetail 的 context 里
+        """
+        comments_limit = getattr(
+            settings,
+            'TWEET_DETAIL_COMMENTS_LIMIT',
+            constants.TWEET_DETAIL_COMMENTS_LIMIT,
+        )
+        likes_limit = getattr(settings, 'TWEET_DETAIL_LIKES_LIMIT', constants.TWEET_DETAIL_LIKES_LIMIT)
+        comments = list(EndlessPagination.filter_by_cursor(
+            cls.get_comments_queryset(tweet.id),
+            None,
+        )[:comments_limit + 1])
+        likes = list(EndlessPagination.filter_by_cursor(
+            cls.get_likes_queryset(tweet.id),
+            None,
+        )[:likes_limit + 1])
+        LikeService.attach_users(likes[:likes_limit])
+        return {
+            'comments': comments[:comments_limit],
+            'has_more_comments': len(comments) > comments_limit,
+            'likes': likes[:likes_limit],
+            'has_more_likes': len(likes) > likes_limit,
+            **CommentService.hydrate(comments[:comments_limit], viewer),
+        }
+
+
+class TweetPhotoService(object):
+
+    @classmethod
+    def _get_setting(cls, name):
+        return getattr(settings, name, getattr(constants, name))
+
+    @classmethod
+    def create_photos(cls, tweet, files):
+        """
+        发 tweet 的时候保存上传的图片，缩略图等尺寸交给 job 异步生成，发 tweet 的请求不用等
+        上传的时候 Django 的 upload handler 已经把大文件按 chunk 写到了临时文件里，
+        FileField.save -> storage.save 也是按 chunk 复制(或者直接移动临时文件)，不会把整个文件读进内存
+        """
+        # import 写在里面避免循环依赖
+        from tweets.tasks import generate_photo_variants_task
+
+        photos = []
+        try:
+            for order, file in enumerate(files):
+                photo = TweetPhoto(tweet=tweet, user_id=tweet.user_id, order=order)
+                photo.file.save(file.name, file, save=False)
+                photos.append(photo)
+                photo.save()
+        except Exception:
+            # 数据库的部分由调用的地方的事务回滚，已经存下来的文件要自己删掉
+            cls.delete_photo_files(photos)
+            raise
+        for photo in photos:
+            generate_photo_variants_task.delay(photo_id=photo.id)
+        return photos
+
+    @classmethod
+    def delete_photo_files(cls, photos):
+        # 原图和已经生成的各个尺寸，文件不存在的时候 storage.delete 什么都不做
+        for photo in photos:
+            for name in [photo.file.name, *photo.variants.values()]:
+                photo.file.storage.delete(name)
+
+    @classmethod
+    def delete_photos(cls, photo_ids):
+        photos = list(TweetPhoto.objects.filter(id__in=photo_ids))
+        cls.delete_photo_files(photos)
+        TweetPhoto.objects.filter(id__in=photo_ids).delete()
+
+    @classmethod
+    def generate_variants(cls, photo):
+        """
+        生成 TWEET_PHOTO_VARIANTS 里的每个尺寸，在进程池里并行缩放
+        用的是 storage.path()，只支持本地文件系统的 storage
+        """
+        storage = photo.file.storage
+        root = os.path.splitext(photo.file.name)[0]
+        variants = {
+            name: '{}_{}.jpg'.format(root, name)
+            for name in cls._get_setting('TWEET_PHOTO_VARIANTS')
+        }
+        quality = cls._get_setting('TWEET_PHOTO_VARIANT_QUALITY')
+        try:
+            resize_images(
+                [
+                    (storage.path(photo.file.name), storage.path(variants[name]), size, quality)
+                    for name, size in cls._get_setting('TWEET_PHOTO_VARIANTS').items()
+                ],
+                cls._get_setting('TWEET_PHOTO_PROCESS_POOL_SIZE'),
+            )
+        except (UnidentifiedImageError, Image.DecompressionBombError):
+            # 文件头是图片但是解析不了 / 像素太多，重试也没有用
+            # 其他的 OSError(磁盘满了 / 文件暂时读不到之类的)抛出去，交给 job 的重试
+            photo.status = TweetPhoto.STATUS_FAILED
+            photo.save(update_fields=['status'])
+            return
+        photo.variants = variants
+        photo.status = TweetPhoto.STATUS_READY
+        photo.save(update_fields=['variants', 'status'])
+
+    @classmethod
+    def get_photos_by_tweet_ids(cls, tweet_ids):
+        # {tweet_id: [photo, ...]}，一条 query，走 (tweet, order) 联合索引
+        photos_by_tweet_id = {}
+        if not tweet_ids:
+            return photos_by_tweet_id
+        for photo in TweetPhoto.objects.filter(tweet_id__in=tweet_ids).order_by('tweet_id', 'order'):
+            photos_by_tweet_id.setdefault(photo.tweet_id, []).append(photo)
+        return photos_by_tweet_id
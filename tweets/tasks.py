@@ -0,0 +1,18 @@
+from jobs.decorators import job
+from tweets.models import TweetPhoto
+from tweets.services import TweetPhotoService
+
+
+@job(name='tweets.generate_photo_variants')
+def generate_photo_variants_task(photo_id):
+    # 任务可能在图片被删除之后才执行
+    photo = TweetPhoto.objects.filter(id=photo_id).first()
+    if photo is None:
+        return
+    TweetPhotoService.generate_variants(photo)
+
+
+@job(name='tweets.delete_photos')
+def delete_photos_task(photo_ids):
+    # tweet 删掉之后 TweetPhoto.tweet 被 SET_NULL 了，所以按 photo 的 id 删
+    TweetPhotoService.delete_photos(photo_ids)
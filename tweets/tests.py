@@ -1,6 +1,19 @@
+import io
+import os
+import shutil
+import tempfile
+
+from PIL import Image
 from django.contrib.auth.models import User
-from django.test import TestCase
-from tweets.models import Tweet
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import override_settings
+from likes.services import LikeService
+from testing.testcases import TestCase
+from tweets.models import Tweet, TweetPhoto
+from tweets.photos import get_image_format
+from tweets.services import TweetPhotoService, TweetService
+from utils.snowflake import SnowflakeGenerator, get_id_datetime
 from datetime import timedelta
 from utils.time_helpers import utc_now
 
@@ -17,3 +30,195 @@ class TweetTests(TestCase):
         tweet.save()
         # 查看测试结果
         self.assertEqual(tweet.hours_to_now, 10)
+
+
+class TweetCacheTests(TestCase):
+    """
+    TweetService.get_by_id / get_by_ids 的对象缓存
+    """
+
+    def setUp(self):
+        self.user = self.create_user('cacheuser')
+        self.tweets = [self.create_tweet(self.user, str(i)) for i in range(3)]
+
+    def test_get_by_ids(self):
+        tweet_ids = [tweet.id for tweet in self.tweets]
+        with self.assertNumQueries(1):
+            tweets = TweetService.get_by_ids(tweet_ids + [0])
+        self.assertEqual(sorted(tweets.keys()), sorted(tweet_ids))
+        # 第二次全部命中缓存，不查数据库
+        with self.assertNumQueries(0):
+            tweets = TweetService.get_by_ids(tweet_ids)
+        self.assertEqual(tweets[self.tweets[0].id].content, '0')
+        # 只查没命中的
+        new_tweet = self.create_tweet(self.user, 'new')
+        with self.assertNumQueries(1):
+            tweets = TweetService.get_by_ids(tweet_ids + [new_tweet.id])
+        self.assertEqual(len(tweets), 4)
+        self.assertIsNone(TweetService.get_by_id(0))
+
+    def test_invalidate_on_save_and_delete(self):
+        tweet = self.tweets[0]
+        TweetService.get_by_id(tweet.id)
+        tweet.content = 'changed'
+        tweet.save()
+        self.assertEqual(TweetService.get_by_id(tweet.id).content, 'changed')
+        tweet.delete()
+        self.assertIsNone(TweetService.get_by_id(tweet.id))
+
+    def test_invalidate_on_counters(self):
+        tweet = self.tweets[0]
+        TweetService.get_by_id(tweet.id)
+        self.create_comment(self.user, tweet)
+        self.assertEqual(TweetService.get_by_id(tweet.id).comments_count, 1)
+        self.create_like(self.user, tweet)
+        self.assertEqual(
+            LikeService.get_likes_count(TweetService.get_by_id(tweet.id)),
+            1,
+        )
+
+    def test_cache_version(self):
+        tweet = self.tweets[0]
+        TweetService.get_by_id(tweet.id)
+        with self.settings(TWEET_CACHE_VERSION=2):
+            with self.assertNumQueries(1):
+                TweetService.get_by_id(tweet.id)
+
+
+def get_test_worker_id():
+    return 7
+
+
+class SnowflakeIdTests(TestCase):
+
+    def test_generator(self):
+        generator = SnowflakeGenerator(worker_id=3)
+        ids = [generator.generate() for _ in range(5000)]
+        # 严格递增(一毫秒里超过 4096 个的时候借用下一毫秒)
+        self.assertEqual(ids, sorted(set(ids)))
+        self.assertEqual((ids[0] >> 12) & 1023, 3)
+        self.assertLess(abs((get_id_datetime(ids[0]) - utc_now()).total_seconds()), 5)
+
+        # 时钟回拨也不会生成更小的 id
+        generator.get_current_timestamp = lambda: 0
+        self.assertGreater(generator.generate(), ids[-1])
+
+        with self.assertRaises(ValueError):
+            SnowflakeGenerator(worker_id=1024)
+
+    def test_worker_id_setting(self):
+        with self.settings(SNOWFLAKE_WORKER_ID=5):
+            self.assertEqual(SnowflakeGenerator().worker_id, 5)
+        with self.settings(SNOWFLAKE_WORKER_ID='tweets.tests.get_test_worker_id'):
+            self.assertEqual(SnowflakeGenerator().worker_id, 7)
+        # 线上没有配置 worker id 直接报错，不能用 pid 凑
+        with self.settings(SNOWFLAKE_WORKER_ID=None, DEBUG=False):
+            with self.assertRaises(ImproperlyConfigured):
+                SnowflakeGenerator()
+        with self.settings(SNOWFLAKE_WORKER_ID=None, DEBUG=True):
+            self.assertLessEqual(SnowflakeGenerator().worker_id, 1023)
+
+    def test_tweet_ids(self):
+        user = self.create_user('snowflake')
+        tweets = [self.create_tweet(user) for _ in range(3)]
+        self.assertEqual([tweet.id for tweet in tweets], sorted(tweet.id for tweet in tweets))
+        self.assertGreater(tweets[0].id, 1 << 32)
+        self.assertEqual(Tweet.objects.get(id=tweets[0].id), tweets[0])
+
+
+def create_image_file(name='photo.png', size=(400, 300), image_format='PNG'):
+    buffer = io.BytesIO()
+    Image.new('RGB', size, (255, 0, 0)).save(buffer, image_format)
+    return SimpleUploadedFile(name, buffer.getvalue())
+
+
+class TweetPhotoTests(TestCase):
+
+    def setUp(self):
+        # 上传的文件写到临时目录里，测试完删掉
+        self.media_root = tempfile.mkdtemp()
+        self.settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        self.settings_override.enable()
+        self.user = self.create_user('photouser')
+        self.tweet = self.create_tweet(self.user)
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.media_root, ignore_errors=True)
+
+    def test_get_image_format(self):
+        self.assertEqual(get_image_format(create_image_file()), 'png')
+        self.assertEqual(get_image_format(create_image_file(image_format='JPEG')), 'jpeg')
+        self.assertEqual(get_image_format(create_image_file(image_format='GIF')), 'gif')
+        self.assertEqual(get_image_format(create_image_file(image_format='WEBP')), 'webp')
+        self.assertIsNone(get_image_format(SimpleUploadedFile('a.png', b'<html></html>')))
+
+    def _assert_variants(self, photo):
+        photo.refresh_from_db()
+        self.assertEqual(photo.status, TweetPhoto.STATUS_READY)
+        self.assertEqual(set(photo.variants), {'thumbnail', 'medium'})
+        with Image.open(photo.file.storage.path(photo.variants['thumbnail'])) as image:
+            self.assertEqual(image.format, 'JPEG')
+            # 保持宽高比
+            self.assertEqual(image.size, (150, 113))
+        with Image.open(photo.file.storage.path(photo.variants['medium'])) as image:
+            # 原图比 medium 小的时候不放大
+            self.assertEqual(image.size, (400, 300))
+
+    @override_settings(TWEET_PHOTO_PROCESS_POOL_SIZE=0)
+    def test_create_photos(self):
+        photos = TweetPhotoService.create_photos(
+            self.tweet,
+            [create_image_file('a.png'), create_image_file('b.jpg', image_format='JPEG')],
+        )
+        self.assertEqual([photo.order for photo in photos], [0, 1])
+        self.assertTrue(photos[0].file.name.startswith('tweet_photos/'))
+        self.assertTrue(photos[1].file.name.endswith('.jpg'))
+        # 测试里 job 是同步执行的
+        for photo in photos:
+            self._assert_variants(photo)
+
+    @override_settings(TWEET_PHOTO_PROCESS_POOL_SIZE=2)
+    def test_generate_variants_in_process_pool(self):
+        photo = TweetPhotoService.create_photos(self.tweet, [create_image_file()])[0]
+        self._assert_variants(photo)
+
+    @override_settings(TWEET_PHOTO_PROCESS_POOL_SIZE=0)
+    def test_generate_variants_failed(self):
+        # 文件头是 JPEG，后面是坏的，Pillow 认不出来
+        file = SimpleUploadedFile('bad.jpg', b'\xff\xd8\xff' + b'0' * 100)
+        photo = TweetPhotoService.create_photos(self.tweet, [file])[0]
+        photo.refresh_from_db()
+        self.assertEqual(photo.status, TweetPhoto.STATUS_FAILED)
+        self.assertEqual(photo.variants, {})
+
+    @override_settings(TWEET_PHOTO_PROCESS_POOL_SIZE=0)
+    def test_generate_variants_io_error_is_retried(self):
+        photo = TweetPhotoService.create_photos(self.tweet, [create_image_file()])[0]
+        TweetPhoto.objects.filter(id=photo.id).update(status=TweetPhoto.STATUS_PENDING, variants={})
+        photo.refresh_from_db()
+        # 文件暂时读不到不是图片本身的问题，异常抛给 job 重试，不标记成失败
+        os.remove(photo.file.storage.path(photo.file.name))
+        with self.assertRaises(FileNotFoundError):
+            TweetPhotoService.generate_variants(photo)
+        photo.refresh_from_db()
+        self.assertEqual(photo.status, TweetPhoto.STATUS_PENDING)
+
+    @override_settings(TWEET_PHOTO_PROCESS_POOL_SIZE=0)
+    def test_delete_tweet_deletes_photos(self):
+        photo = TweetPhotoService.create_photos(self.tweet, [create_image_file()])[0]
+        photo.refresh_from_db()
+        paths = [photo.file.storage.path(name) for name in [photo.file.name, *photo.variants.values()]]
+        self.assertTrue(all(os.path.exists(path) for path in paths))
+
+        self.tweet.delete()
+        self.assertFalse(TweetPhoto.objects.filter(id=photo.id).exists())
+        self.assertFalse(any(os.path.exists(path) for path in paths))
+
+    def test_get_photos_by_tweet_ids(self):
+        other = self.create_tweet(self.user)
+        photos = TweetPhotoService.create_photos(self.tweet, [create_image_file(), create_image_file()])
+        photos_by_tweet_id = TweetPhotoService.get_photos_by_tweet_ids([self.tweet.id, other.id])
+        self.assertEqual(photos_by_tweet_id, {self.tweet.id: photos})
+        self.assertEqual(TweetPhotoService.get_photos_by_tweet_ids([]), {})
+
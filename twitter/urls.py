@@ -13,6 +13,8 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
+from django.conf import settings
+from django.conf.urls.static import static
 from django.contrib import admin
 from django.urls import include, path
 from rest_framework import routers
@@ -23,6 +25,7 @@ from newsfeeds.api.views import NewsFeedViewSet
 from comments.api.views import CommentViewSet
 from likes.api.views import LikeViewSet
 from inbox.api.views import NotificationViewSet
+from trends.api.views import TrendViewSet
 
 router = routers.DefaultRouter()
 router.register(r'api/users', UserViewSet)
@@ -33,6 +36,7 @@ router.register(r'api/newsfeeds', NewsFeedViewSet, basename='newsfeeds')
 router.register(r'api/comments', CommentViewSet, basename='comments')
 router.register(r'api/likes', LikeViewSet, basename='likes')
 router.register(r'api/notifications', NotificationViewSet, basename='notifications')
+router.register(r'api/trends', TrendViewSet, basename='trends')
 
 urlpatterns = [
     path('admin/', admin.site.urls),
@@ -40,3 +44,5 @@ urlpatterns = [
     path('api-auth/', include('rest_framework.urls', namespace='rest_framework')),
     path('__debug__/', include('debug_toolbar.urls')),
 ]
+# 开发环境下由 Django 提供上传的图片，线上交给 nginx / CDN (DEBUG=False 的时候 static() 返回空的)
+urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
@@ -0,0 +1,14 @@
+from itertools import islice
+
+
+def chunked(iterable, size):
+    """
+    把一个(可能很大的)iterable 切成每段最多 size 个元素的 list
+    一次只在内存里保留一段，配合 queryset.iterator() 使用可以让内存占用不随数据量增长
+    """
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
@@ -0,0 +1,164 @@
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import ValidationError
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+
+
+class EndlessPagination(BasePagination):
+    """
+    基于 (created_at, id) 的 keyset(cursor) 翻页 -> 不用 OFFSET，翻到多深都只扫 page_size 条
+    - 第一页: 不带参数，返回最新的 page_size 条
+    - 往下翻: ?created_at__lt=<上一页最后一条的 created_at>&id__lt=<它的 id>
+    - 刷新:   ?created_at__gt=<当前第一条的 created_at>&id__gt=<它的 id>
+    id 只用来在 created_at 相同的时候打破平局，可以不传(不传的时候严格按 created_at 比较)
+    两个方向返回的都是紧挨着 cursor 的最多 page_size 条数据，按 (created_at, id) 倒序排好
+    has_next_page 表示沿着翻页的方向还有数据: 往下翻是这一页的最后一条之后(更旧的)还有，
+    刷新是这一页的第一条之前(更新的)还有，客户端用这一页的第一条作为 cursor 接着刷新
+    """
+    page_size = 20
+    max_page_size = 100
+    page_size_query_param = 'page_size'
+
+    def __init__(self):
+        super(EndlessPagination, self).__init__()
+        self.has_next_page = False
+
+    def to_html(self):
+        pass
+
+    def get_page_size(self, request):
+        if self.page_size_query_param not in request.query_params:
+            return self.page_size
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except ValueError:
+            return self.page_size
+        return max(1, min(page_size, self.max_page_size))
+
+    def get_cursor(self, request):
+        """
+        从 query params 里解析出 cursor: {'op': 'lt'/'gt', 'created_at': datetime, 'id': int/None}
+        没有 cursor 的时候返回 None
+        """
+        for op in ['gt', 'lt']:
+            created_at_param = 'created_at__{}'.format(op)
+            if created_at_param not in request.query_params:
+                continue
+            created_at = parse_datetime(request.query_params[created_at_param])
+            if created_at is None:
+                raise ValidationError({created_at_param: 'Invalid datetime'})
+
+            id_param = 'id__{}'.format(op)
+            cursor_id = None
+            if id_param in request.query_params:
+                try:
+                    cursor_id = int(request.query_params[id_param])
+                except ValueError:
+                    raise ValidationError({id_param: 'Invalid id'})
+            return {'op': op, 'created_at': created_at, 'id': cursor_id}
+        return None
+
+    @classmethod
+    def filter_by_cursor(cls, queryset, cursor, id_field='id', created_at_field='created_at'):
+        """
+        按 cursor 过滤并排序，用的是 (xxx, created_at) 联合索引
+        - 没有 cursor / 往下翻(lt): 按 (created_at, id) 倒序
+        - 刷新(gt): 按 (created_at, id) 正序，离 cursor 最近的在前面，这样取前 N 条不会跳过中间的数据
+          取出来之后要倒过来，一般直接用 slice_by_cursor
+        id_field=None 表示这个数据源里的数据没有 id (排序时当作 0)，
+        比如 newsfeed 里从大V那 pull 过来的 tweets
+        created_at_field 是排序用的时间字段，比如 newsfeed 用的是冗余的 tweet_created_at
+        """
+        if id_field is None:
+            fields = (created_at_field,)
+        else:
+            fields = (created_at_field, id_field)
+        descending = ['-{}'.format(field) for field in fields]
+        if cursor is None:
+            return queryset.order_by(*descending)
+
+        op, created_at = cursor['op'], cursor['created_at']
+        if id_field is None:
+            # (created_at, 0) 和 (cursor.created_at, cursor.id) 比较
+            if op == 'lt' and (cursor['id'] or 0) > 0:
+                condition = Q(**{'{}__lte'.format(created_at_field): created_at})
+            else:
+                condition = Q(**{'{}__{}'.format(created_at_field, op): created_at})
+        elif cursor['id'] is None:
+            # 没有传 id 的时候严格按 created_at 比较，不会返回客户端已经有的 cursor 那一条
+            condition = Q(**{'{}__{}'.format(created_at_field, op): created_at})
+        else:
+            condition = Q(**{'{}__{}'.format(created_at_field, op): created_at}) | Q(**{
+                created_at_field: created_at,
+                '{}__{}'.format(id_field, op): cursor['id'],
+            })
+        queryset = queryset.filter(condition)
+        if op == 'gt':
+            return queryset.order_by(*fields)
+        return queryset.order_by(*descending)
+
+    @classmethod
+    def slice_by_cursor(cls, queryset, cursor, limit, id_field='id', created_at_field='created_at'):
+        # 紧挨着 cursor 的最多 limit 条，两个方向返回的都是按 (created_at, id) 倒序排好的 list
+        items = list(cls.filter_by_cursor(queryset, cursor, id_field, created_at_field)[:limit])
+        if cursor is not None and cursor['op'] == 'gt':
+            items.reverse()
+        return items
+
+    @classmethod
+    def matches_cursor(cls, created_at, item_id, cursor):
+        # 和 filter_by_cursor 一样的判断，用于已经在内存(比如缓存)里的数据
+        if cursor is None:
+            return True
+        if cursor['id'] is None:
+            item_key, cursor_key = created_at, cursor['created_at']
+        else:
+            item_key = (created_at, item_id or 0)
+            cursor_key = (cursor['created_at'], cursor['id'])
+        if cursor['op'] == 'lt':
+            return item_key < cursor_key
+        return item_key > cursor_key
+
+    @classmethod
+    def trim_to_cursor(cls, items, cursor, limit):
+        # items 是按倒序排好的、满足 cursor 的数据，留下紧挨着 cursor 的 limit 条
+        if cursor is not None and cursor['op'] == 'gt':
+            return items[-limit:] if limit else []
+        return items[:limit]
+
+    def paginate_ordered_list(self, items, request):
+        # items 已经按 cursor 过滤、按倒序排好，并且是紧挨着 cursor 的最多 page_size + 1 条
+        page_size = self.get_page_size(request)
+        self.has_next_page = len(items) > page_size
+        return self.trim_to_cursor(items, self.get_cursor(request), page_size)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        # 多取一条用来判断还有没有下一页
+        items = self.slice_by_cursor(queryset, self.get_cursor(request), self.get_page_size(request) + 1)
+        return self.paginate_ordered_list(items, request)
+
+    def paginate_queryset_ascending(self, queryset, request):
+        """
+        按 (created_at, id) 正序翻页，比如评论列表最上面是最早的评论，用的是同一个 (xxx, created_at) 联合索引
+        - 第一页: 不带参数，返回最早的 page_size 条
+        - 往下翻: ?created_at__gt=<上一页最后一条的 created_at>&id__gt=<它的 id>
+        只能往下翻，has_next_page 表示这一页的最后一条之后(更新的)还有
+        """
+        cursor = self.get_cursor(request)
+        if cursor is None:
+            queryset = queryset.order_by('created_at', 'id')
+        elif cursor['op'] == 'gt':
+            queryset = self.filter_by_cursor(queryset, cursor)
+        else:
+            raise ValidationError({'created_at__lt': 'Only created_at__gt is supported'})
+        page_size = self.get_page_size(request)
+        items = list(queryset[:page_size + 1])
+        self.has_next_page = len(items) > page_size
+        return items[:page_size]
+
+    def get_paginated_response(self, data):
+        return Response({
+            'has_next_page': self.has_next_page,
+            'results': data,
+        })
@@ -0,0 +1,111 @@
+import os
+import threading
+import time
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.module_loading import import_string
+
+# 下面的配置都可以在 settings 里用同名的配置覆盖
+
+# 用哪个 id 生成器(实现了 generate() 的类)，可以换成别的实现，比如从 id 服务批量取号
+ID_GENERATOR = 'utils.snowflake.SnowflakeGenerator'
+# 时间戳从 2021-01-01 00:00:00 UTC 开始算(毫秒)，41 位可以用到 2090 年
+SNOWFLAKE_EPOCH = 1609459200000
+# 每个进程的 worker id (0 ~ 1023)，同时在写 Tweet / NewsFeed 的进程之间一定不能重复
+# - 整数: 一个机器(容器)只跑一个进程的时候直接配置
+# - 函数的路径(比如 'deploy.worker_ids.get_worker_id'): 一个机器 fork 多个 worker 的时候，
+#   每个进程(fork 之后)会调用一次，用机器编号 + worker 编号之类的算出不重复的 id
+# - None: 只有 DEBUG 的时候允许，用 pid 凑一个(pid 取低 10 位会撞，不能用在线上)
+SNOWFLAKE_WORKER_ID = None
+
+WORKER_ID_BITS = 10
+SEQUENCE_BITS = 12
+MAX_WORKER_ID = (1 << WORKER_ID_BITS) - 1
+SEQUENCE_MASK = (1 << SEQUENCE_BITS) - 1
+TIMESTAMP_SHIFT = WORKER_ID_BITS + SEQUENCE_BITS
+
+
+def get_worker_id():
+    worker_id = getattr(settings, 'SNOWFLAKE_WORKER_ID', SNOWFLAKE_WORKER_ID)
+    if isinstance(worker_id, str):
+        worker_id = import_string(worker_id)()
+    if worker_id is not None:
+        return worker_id
+    if not settings.DEBUG:
+        # 两个进程拿到同一个 worker id，同一毫秒就会生成重复的主键
+        raise ImproperlyConfigured(
+            'SNOWFLAKE_WORKER_ID must be set to a worker id that is unique '
+            'to each process writing Tweet / NewsFeed rows'
+        )
+    return os.getpid() & MAX_WORKER_ID
+
+
+class SnowflakeGenerator(object):
+    """
+    64 位按时间递增的 id: | 1 位符号(0) | 41 位毫秒时间戳 | 10 位 worker id | 12 位序号 |
+    - 同一个 worker 生成的 id 严格递增，不同 worker 的 id 按毫秒大致有序
+    - 同一毫秒的序号用完了 / 时钟回拨了，都借用上一个时间戳往后推，不会阻塞也不会生成重复的 id
+    """
+
+    def __init__(self, worker_id=None, epoch=None):
+        if worker_id is None:
+            worker_id = get_worker_id()
+        if not 0 <= worker_id <= MAX_WORKER_ID:
+            raise ValueError('worker_id should be between 0 and {}'.format(MAX_WORKER_ID))
+        if epoch is None:
+            epoch = getattr(settings, 'SNOWFLAKE_EPOCH', SNOWFLAKE_EPOCH)
+        self.worker_id = worker_id
+        self.epoch = epoch
+        self.last_timestamp = -1
+        self.sequence = 0
+        self.lock = threading.Lock()
+
+    def get_current_timestamp(self):
+        return int(time.time() * 1000)
+
+    def generate(self):
+        with self.lock:
+            timestamp = max(self.get_current_timestamp(), self.last_timestamp)
+            if timestamp == self.last_timestamp:
+                self.sequence = (self.sequence + 1) & SEQUENCE_MASK
+                if self.sequence == 0:
+                    timestamp += 1
+            else:
+                self.sequence = 0
+            self.last_timestamp = timestamp
+            return (
+                (timestamp - self.epoch) << TIMESTAMP_SHIFT
+                | self.worker_id << SEQUENCE_BITS
+                | self.sequence
+            )
+
+
+_generator = None
+_generator_pid = None
+_generator_lock = threading.Lock()
+
+
+def get_id_generator():
+    global _generator, _generator_pid
+    # fork 出来的子进程不能和父进程共用一个生成器(worker id 和序号都一样会生成重复的 id)
+    if _generator is None or _generator_pid != os.getpid():
+        with _generator_lock:
+            if _generator is None or _generator_pid != os.getpid():
+                _generator = import_string(getattr(settings, 'ID_GENERATOR', ID_GENERATOR))()
+                _generator_pid = os.getpid()
+    return _generator
+
+
+def generate_id():
+    # 用作 model 主键的 default
+    return get_id_generator().generate()
+
+
+def get_id_datetime(snowflake_id, epoch=None):
+    # 从 id 里解析出生成的时间(UTC)
+    if epoch is None:
+        epoch = getattr(settings, 'SNOWFLAKE_EPOCH', SNOWFLAKE_EPOCH)
+    milliseconds = (snowflake_id >> TIMESTAMP_SHIFT) + epoch
+    return datetime.fromtimestamp(milliseconds / 1000, tz=timezone.utc)